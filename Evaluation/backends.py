@@ -0,0 +1,129 @@
+import os
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# openai is only needed for the 'openai' backend
+try:
+    from openai import OpenAI
+except ImportError:
+    OpenAI = None
+
+# Per rank type decoding budgets; 'full' needs a few letters, 'score' a single digit
+DEFAULT_DECODING = {
+    'full': {'max_new_tokens': 32, 'constrained': False},
+    'score': {'max_new_tokens': 8, 'constrained': False},
+}
+
+def profile_settings(config):
+    """Merges the config's `decoding` section over the default profile of each rank type."""
+    return {
+        rank_type: {**defaults, **config.get('decoding', {}).get(rank_type, {})}
+        for rank_type, defaults in DEFAULT_DECODING.items()
+    }
+
+def load_backend(config, labels, telemetry=None):
+    """Creates the inference backend named by the config's `backend` option (default 'transformers')."""
+    backend = config.get('backend', 'transformers')
+    if backend == 'transformers':
+        # Imported here so the 'openai' backend runs without torch
+        from transformers_backend import TransformersBackend
+        return TransformersBackend(config, labels, telemetry=telemetry)
+    if backend == 'openai':
+        return OpenAIBackend(config, labels, telemetry=telemetry)
+    raise ValueError(f"Unknown evaluation backend '{backend}'. Expected 'transformers' or 'openai'.")
+
+class OpenAIBackend:
+    """Sends judge prompts to an OpenAI-compatible chat server (e.g. vLLM, llama.cpp) with concurrent requests."""
+    def __init__(self, config, labels, telemetry=None):
+        if OpenAI is None:
+            raise ImportError("The 'openai' backend needs the openai client: pip install openai")
+        self.config = config
+        self.labels = labels
+        self.telemetry = telemetry
+        self.model_name = config['model_name']
+        self.client = OpenAI(
+            api_key=config.get('api_key') or os.environ.get('OPENAI_API_KEY', 'EMPTY'),
+            base_url=config['base_url'],
+            max_retries=config.get('max_retries', 5),
+            timeout=config.get('request_timeout', 600)
+        )
+        self.max_in_flight = config.get('max_in_flight', 16)
+        self.top_logprobs = config.get('top_logprobs', 20)
+        self.profiles = profile_settings(config)
+        if any(profile['constrained'] for profile in self.profiles.values()):
+            print("Note: constrained decoding is not available with the 'openai' backend and is ignored.")
+        print(f"Using OpenAI-compatible server at {config['base_url']} with model {self.model_name}.")
+
+    def cache_fields(self, rank_type, input_prompt):
+        """Returns everything that determines the response to one prompt, for the judge cache key."""
+        if rank_type == 'logits':
+            params = {'labels': self.labels, 'top_logprobs': self.top_logprobs}
+        else:
+            params = {'max_tokens': self.profiles[rank_type]['max_new_tokens']}
+        # The server applies the chat template, so the raw prompt stands in for the rendered one
+        return {
+            'backend': 'openai', 'base_url': self.config['base_url'], 'model': self.model_name,
+            'rank_type': rank_type, 'prompt': input_prompt, 'params': params
+        }
+
+    def warm_up(self, sample_prompts):
+        """Nothing to prepare; the server loads and warms up its own model."""
+
+    def _chat(self, input_prompt, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model_name,
+                messages=[{"role": "user", "content": input_prompt}],
+                temperature=0,
+                **kwargs
+            )
+        except Exception:
+            # The client has already used up its own retries
+            if self.telemetry:
+                self.telemetry.record_failure(self.model_name)
+            raise
+        if self.telemetry:
+            self.telemetry.record_call(self.model_name, time.perf_counter() - start, getattr(response, 'usage', None))
+        return response
+
+    def _generate_one(self, input_prompt, rank_type):
+        response = self._chat(input_prompt, max_tokens=self.profiles[rank_type]['max_new_tokens'])
+        return response.choices[0].message.content or ""
+
+    def _score_one(self, input_prompt):
+        """Reads each option letter's log-probability from the first token's top_logprobs."""
+        response = self._chat(input_prompt, max_tokens=1, logprobs=True, top_logprobs=self.top_logprobs)
+        content = response.choices[0].logprobs.content
+        top_logprobs = content[0].top_logprobs if content else []
+        # Letters outside the returned top candidates get -inf, i.e. probability 0
+        logprobs = {label: -math.inf for label in self.labels}
+        for candidate in top_logprobs:
+            label = candidate.token.strip()
+            if label in logprobs:
+                logprobs[label] = max(logprobs[label], candidate.logprob)
+        # JSON has no -inf, so those letters are stored as null in the raw output and the judge cache
+        values = [logprobs[label] if logprobs[label] > -math.inf else None for label in self.labels]
+        # The server exposes no raw logits; log-probabilities differ from them only by a per-prompt constant
+        return values, values
+
+    def _run(self, func, args):
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            return list(executor.map(lambda arg: func(*arg), args))
+
+    def generate_text(self, input_prompts, rank_type, shared_prefix=False):
+        """Generates answers for a list of prompts with up to `max_in_flight` concurrent requests."""
+        return self._run(self._generate_one, [(prompt, rank_type) for prompt in input_prompts])
+
+    def next_token_logprobs(self, input_prompts):
+        """Returns (logits, log-probabilities) of each option letter as the next token, for a list of prompts."""
+        return self._run(self._score_one, [(prompt,) for prompt in input_prompts])
+
+    def batch(self, requests):
+        """Answers (group, rank_type, prompt) requests concurrently, in request order."""
+        def answer(rank_type, prompt):
+            if rank_type == 'logits':
+                return self._score_one(prompt)
+            return self._generate_one(prompt, rank_type)
+        return self._run(answer, [(rank_type, prompt) for _, rank_type, prompt in requests])
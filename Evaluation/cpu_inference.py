@@ -0,0 +1,75 @@
+import numpy as np
+import torch
+
+# Defaults of the config's `cpu` section; precision is "float32", "bfloat16" or "int8"
+DEFAULT_CPU = {
+    'enabled': False,
+    'precision': 'int8',
+    'num_threads': None,
+    'num_interop_threads': None,
+    'compile': False,
+}
+
+def cpu_settings(config):
+    """Merges the config's `cpu` section over the defaults; returns None when the CPU profile is off."""
+    settings = {**DEFAULT_CPU, **(config.get('cpu') or {})}
+    if not settings['enabled']:
+        return None
+    if settings['precision'] not in ['float32', 'bfloat16', 'int8']:
+        raise ValueError(f"Unknown CPU precision '{settings['precision']}'. Expected 'float32', 'bfloat16' or 'int8'.")
+    return settings
+
+def bf16_supported():
+    """Whether the CPU has native bfloat16 kernels (AVX512-BF16 or AMX)."""
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+def apply_thread_settings(settings):
+    """Sets torch's intra-op and inter-op thread pools from the CPU profile."""
+    if settings['num_threads']:
+        torch.set_num_threads(settings['num_threads'])
+    if settings['num_interop_threads']:
+        try:
+            torch.set_num_interop_threads(settings['num_interop_threads'])
+        except RuntimeError:
+            # The inter-op pool can only be sized before torch first uses it
+            print("Warning: torch's inter-op thread pool is already running; num_interop_threads is ignored.")
+    print(f"CPU inference with {torch.get_num_threads()} intra-op and {torch.get_num_interop_threads()} inter-op threads.")
+
+def optimize_model(model, settings):
+    """Converts a full-precision CPU model in place to the profile's precision; returns the precision used."""
+    precision = settings['precision']
+    if precision == 'bfloat16' and not bf16_supported():
+        print("Note: this CPU has no native bfloat16 support; keeping the model in float32.")
+        precision = 'float32'
+    if precision == 'bfloat16':
+        model = model.to(torch.bfloat16)
+    elif precision == 'int8':
+        # Linear weights are stored as int8; activations are quantized on the fly, per batch
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    if settings['compile']:
+        # Prompt lengths and batch sizes vary, so the graph is compiled with dynamic shapes
+        model.forward = torch.compile(model.forward, dynamic=True)
+    print(f"Judge model prepared for CPU inference ({precision}{', compiled' if settings['compile'] else ''}).")
+    return precision
+
+def _option_distributions(logprobs):
+    """Turns each prompt's option-letter log-probabilities into a distribution over the options."""
+    logprobs = np.array(logprobs, dtype=float)
+    probs = np.exp(logprobs - logprobs.max(axis=1, keepdims=True))
+    return probs / probs.sum(axis=1, keepdims=True)
+
+def drift_report(reference, converted):
+    """Compares the 'logits' mode option distributions of the full-precision and the converted model."""
+    p = _option_distributions([logprobs for _, logprobs in reference])
+    q = _option_distributions([logprobs for _, logprobs in converted])
+    kl = np.sum(p * (np.log(np.clip(p, 1e-12, None)) - np.log(np.clip(q, 1e-12, None))), axis=1)
+    return {
+        'samples': len(p),
+        'mean_kl': float(kl.mean()),
+        'max_kl': float(kl.max()),
+        'max_abs_prob_diff': float(np.abs(p - q).max()),
+        'top1_agreement': float((p.argmax(axis=1) == q.argmax(axis=1)).mean()),
+    }
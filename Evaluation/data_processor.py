@@ -1,8 +1,17 @@
+import os
 import json
 import ast
+import hashlib
 import numpy as np
 import pandas as pd
 from data_loader import load_dataset
+from columnar import open_stage
+
+# Raw output fields used for metrics; a Parquet raw output file decodes only these
+RAW_OUTPUT_COLUMNS = ['id', 'logits', 'logprobs', 'score', 'full']
+
+# Bump when the compiled gold standard layout changes, so older artifacts are rebuilt
+GOLD_ARTIFACT_VERSION = 1
 
 class DataProcessor:
     def __init__(self, config):
@@ -39,18 +48,47 @@ class DataProcessor:
             avg_scores.append(np.mean(scores))
         return avg_scores
 
-    def process_gold_standard(self, gold_file_path):
-        """Processes the raw gold standard file into a clean DataFrame."""
-        gold_data = load_dataset(gold_file_path)
-        processed_records = []
-        for item in gold_data:
-            record = item.copy()
+    def _gold_arrays(self, gold_data):
+        """Decodes gold items straight into an id column and (n_items, n_options) matrices."""
+        ids, distributions, scores, ranks = [], [], [], []
+        for position, item in enumerate(gold_data):
+            ids.append(str(item.get('id', position)))
             if 'votes_distribution' in item:
-                record['distribution'] = self._transfer_votings_to_dist(item['votes_distribution'], item)
+                distributions.append(self._transfer_votings_to_dist(item['votes_distribution'], item))
             if 'answerA_ratings' in item:
-                 record['score'] = self._transfer_ratings_to_scores(item)
-            processed_records.append(record)
-        return pd.DataFrame(processed_records)
+                scores.append(self._transfer_ratings_to_scores(item))
+            if 'rank' in item:
+                ranks.append(item['rank'])
+        arrays = {'id': np.array(ids)}
+        # A column is kept only when every item has it, as the metrics need one row per item
+        for name, rows in [('distribution', distributions), ('score', scores), ('rank', ranks)]:
+            if rows and len(rows) == len(ids):
+                arrays[name] = np.array(rows, dtype=float)
+        return arrays
+
+    def compile_gold_standard(self, gold_file_path):
+        """Returns the gold standard as dense arrays, cached as an .npz keyed by the file's content and the label list."""
+        digest = hashlib.sha256(f"{GOLD_ARTIFACT_VERSION}:{json.dumps(self._get_label_list())}:".encode())
+        with open(gold_file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        cache_dir = self.config.get('gold_cache_dir', os.path.join(self.config['output_dir'], 'gold_cache'))
+        artifact_path = os.path.join(cache_dir, f"{os.path.basename(gold_file_path)}.{digest.hexdigest()[:16]}.npz")
+
+        if os.path.exists(artifact_path):
+            print(f"Loading compiled gold standard from: {artifact_path}")
+            with np.load(artifact_path) as artifact:
+                return {name: artifact[name] for name in artifact.files}
+
+        arrays = self._gold_arrays(load_dataset(gold_file_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written under a temporary name and renamed, so an interrupted run never leaves a partial artifact
+        temp_path = artifact_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, artifact_path)
+        print(f"Compiled gold standard saved to: {artifact_path}")
+        return arrays
 
     # --- LLM Output Processing ---
     def _normalize_dist(self, logits):
@@ -59,6 +97,15 @@ class DataProcessor:
         total = logits.sum()
         return (logits / total).tolist() if total > 0 else [0] * len(logits)
 
+    def _softmax_dist(self, logprobs):
+        """Renormalizes option log-probabilities into a probability distribution over the options."""
+        # null marks an option the server returned no log-probability for (older raw files hold -Infinity)
+        logprobs = np.array([-np.inf if value is None else value for value in logprobs], dtype=float)
+        if not np.isfinite(logprobs.max()):
+            return [0] * len(logprobs) # no option among the returned candidates
+        probs = np.exp(logprobs - logprobs.max())
+        return (probs / probs.sum()).tolist()
+
     def _process_scores(self, score_list):
         """Extracts the first digit from score strings."""
         processed = []
@@ -93,11 +140,14 @@ class DataProcessor:
 
     def process_llm_output(self, llm_output_file):
         """Processes the raw output from the evaluator LLM into a clean DataFrame."""
-        llm_data = load_dataset(llm_output_file)
+        llm_data = open_stage(llm_output_file, columns=RAW_OUTPUT_COLUMNS)
         processed_records = []
         for item in llm_data:
             record = item.copy()
-            if 'logits' in item:
+            if 'logprobs' in item:
+                record['distribution'] = self._softmax_dist(item['logprobs'])
+            elif 'logits' in item:
+                # Raw outputs written before log-probabilities were recorded
                 record['distribution'] = self._normalize_dist(item['logits'])
             if 'score' in item:
                 record['score'] = self._process_scores(item['score'])
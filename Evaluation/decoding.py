@@ -0,0 +1,82 @@
+import time
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList, StoppingCriteria, StoppingCriteriaList
+
+SCORE_DIGITS = ['1', '2', '3', '4', '5']
+
+def single_token_ids(tokenizer, strings):
+    """Returns the token ids of the strings that encode to exactly one token."""
+    token_ids = set()
+    for string in strings:
+        ids = tokenizer.encode(string, add_special_tokens=False)
+        if len(ids) == 1:
+            token_ids.add(ids[0])
+    return token_ids
+
+class AnswerCompleteCriteria(StoppingCriteria):
+    """Stops each sequence once more tokens can no longer change how DataProcessor parses its answer."""
+    def __init__(self, tokenizer, prompt_length, rank_type, labels):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.rank_type = rank_type
+        self.labels = set(labels)
+
+    def _is_complete(self, text):
+        if self.rank_type == 'full':
+            # _assign_scores_from_rank keeps the first occurrence of each letter, so a full permutation is final
+            return self.labels <= set(text.upper())
+        # _process_scores only reads the first non-space character
+        return bool(text.strip())
+
+    def __call__(self, input_ids, scores, **kwargs):
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        return torch.tensor([self._is_complete(text) for text in texts], dtype=torch.bool, device=input_ids.device)
+
+class FirstTokenTimer(StoppingCriteria):
+    """Never stops generation; notes when the first new token is ready, which ends the prefill."""
+    def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+class AllowedTokensLogitsProcessor(LogitsProcessor):
+    """Masks every token outside a fixed set, so only valid answer tokens can be produced."""
+    def __init__(self, allowed_token_ids):
+        self.allowed_token_ids = sorted(allowed_token_ids)
+
+    def __call__(self, input_ids, scores):
+        mask = torch.full_like(scores, float('-inf'))
+        mask[:, self.allowed_token_ids] = 0
+        return scores + mask
+
+class DecodingProfiles:
+    """Builds the generate() arguments for each rank type from its decoding profile."""
+    def __init__(self, profiles, tokenizer, labels):
+        self.tokenizer = tokenizer
+        self.labels = labels
+        self.profiles = profiles
+
+        # Answers may be produced with or without a leading space; anything else is masked when constrained
+        full_ids = single_token_ids(tokenizer, labels + [' ' + label for label in labels])
+        score_ids = single_token_ids(tokenizer, SCORE_DIGITS + [' ' + digit for digit in SCORE_DIGITS])
+        if self.profiles['score']['constrained'] and not score_ids:
+            raise ValueError("None of the score digits 1-5 is a single token; disable constrained decoding for 'score'.")
+        self.allowed_token_ids = {'full': full_ids, 'score': score_ids}
+
+    def generate_kwargs(self, rank_type, prompt_length):
+        """Returns max_new_tokens, stopping criteria and the optional logits processor for one generate call."""
+        profile = self.profiles[rank_type]
+        kwargs = {
+            'max_new_tokens': profile['max_new_tokens'],
+            'stopping_criteria': StoppingCriteriaList([
+                AnswerCompleteCriteria(self.tokenizer, prompt_length, rank_type, self.labels)
+            ]),
+        }
+        if profile['constrained']:
+            kwargs['logits_processor'] = LogitsProcessorList([
+                AllowedTokensLogitsProcessor(self.allowed_token_ids[rank_type])
+            ])
+        return kwargs
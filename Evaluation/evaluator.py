@@ -1,90 +1,134 @@
 import os
 import json
+import itertools
 from tqdm import tqdm
-from transformers import AutoModelForCausalLM, AutoTokenizer
 import prompt_factory_eval
+from backends import load_backend
+from response_cache import ResponseCache
+from shard_utils import global_index
+from stage_io import StageWriter
+from columnar import stage_options
+from telemetry import Telemetry
+
+# Judge calls per item, in the order their results appear in each output record
+RANK_TYPES = ['logits', 'full', 'score']
 
 class Evaluator:
-    def __init__(self, config):
+    def __init__(self, config, telemetry=None):
         self.config = config
         self.task_name = config['task_name']
-        print("Loading evaluation model... This may take a moment.")
-        self.model = AutoModelForCausalLM.from_pretrained(
-            config['model_name'],
-            cache_dir=config.get('cache_dir'),
-            torch_dtype="auto",
-            device_map="auto"
-        )
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            config['model_name'],
-            cache_dir=config.get('cache_dir')
-        )
-        print("Model loaded successfully.")
+        self.telemetry = telemetry or Telemetry(config, self.task_name)
+        self.option_labels = ['A', 'B', 'C', 'D', 'E'] if self.task_name == 'cqa' else ['A', 'B', 'C']
+        self.batch_window = config.get('batch_window', 64)
+        self.prefix_layout = config.get('prompt_layout', 'default') == 'prefix'
+        self.backend = load_backend(config, self.option_labels, telemetry=self.telemetry)
+        # Records whose prompts warm the backend up and measure the CPU profile's drift
+        self.warmup_samples = (config.get('cpu') or {}).get('warmup_samples', 8)
+
+        # Optional on-disk cache of judge responses, shared by all evaluation modes
+        cache_config = config.get('cache', {})
+        self.cache = None
+        if cache_config.get('enabled', False):
+            self.cache = ResponseCache(
+                cache_config.get('path', os.path.join(config['output_dir'], 'judge_cache.sqlite')),
+                max_size_mb=cache_config.get('max_size_mb'),
+                max_age_days=cache_config.get('max_age_days')
+            )
+
+    def _build_requests(self, item_data, add_explanations):
+        """Yields (rank_type, option index or None, prompt) for every judge call one item needs."""
+        for rank_type in RANK_TYPES:
+            prompts = prompt_factory_eval.generate_prompt(
+                self.task_name, rank_type, item_data, add_explanations, prefix_layout=self.prefix_layout
+            )
+            if rank_type == 'score':
+                for option, prompt in enumerate(prompts):
+                    yield rank_type, option, prompt
+            else:
+                yield rank_type, None, prompts
 
-    def _get_llm_response(self, input_prompt, rank_type):
-        """Gets logits, full text, or score from the LLM."""
-        messages = [{"role": "user", "content": input_prompt}]
-        text_template = self.tokenizer.apply_chat_template(
-            messages, tokenize=False, add_generation_prompt=True
-        )
-        model_inputs = self.tokenizer([text_template], return_tensors="pt").to(self.model.device)
+    def _evaluate_window(self, window):
+        """Evaluates a window of (record, add_explanations) pairs with one backend batch."""
+        requests = []
+        for pos, (result_record, add_explanations) in enumerate(window):
+            for rank_type, option, prompt in self._build_requests(result_record, add_explanations):
+                requests.append((pos, rank_type, option, prompt))
 
-        generated_ids = self.model.generate(
-            **model_inputs,
-            max_new_tokens=256,
-            output_logits=True,
-            return_dict_in_generate=True
-        )
+        responses = [None] * len(requests)
+        cache_keys = [None] * len(requests)
+        if self.cache:
+            for r, (_, rank_type, _, prompt) in enumerate(requests):
+                cache_keys[r] = ResponseCache.make_key(**self.backend.cache_fields(rank_type, prompt))
+                responses[r] = self.cache.get(cache_keys[r])
+                if responses[r] is not None:
+                    self.telemetry.record_cache_hit(self.config['model_name'])
 
-        if rank_type == 'logits':
-            # Token IDs for A, B, C, D, E for many tokenizers
-            token_ids = [32, 33, 34, 36, 35] # A, B, C, D, E
-            if self.task_name == 'cqa':
-                return [generated_ids.logits[0][0][tid].item() for tid in token_ids]
+        # Only cache misses reach the backend; the item position groups prompts that share a prefix
+        pending = [r for r, response in enumerate(responses) if response is None]
+        outputs = self.backend.batch([(requests[r][0], requests[r][1], requests[r][3]) for r in pending])
+        for r, output in zip(pending, outputs):
+            responses[r] = output
+            if self.cache:
+                self.cache.set(cache_keys[r], output)
+
+        # Requests are in item order, so scattering them back keeps the logits, full, score key order
+        for (pos, rank_type, option, _), response in zip(requests, responses):
+            result_record = window[pos][0]
+            if rank_type == 'logits':
+                result_record['logits'], result_record['logprobs'] = response
+            elif option is None:
+                result_record[rank_type] = response
+            elif option == 0:
+                result_record[rank_type] = [response]
             else:
-                return [generated_ids.logits[0][0][tid].item() for tid in token_ids[:3]]
-        
-        output_sequence = generated_ids.sequences
-        output_sequence = [
-            out_ids[len(in_ids):] for in_ids, out_ids in zip(model_inputs.input_ids, output_sequence)
+                result_record[rank_type].append(response)
+        return [result_record for result_record, _ in window]
+
+    def warm_up(self, baseline_data):
+        """Warms the backend up on the 'logits' prompts of the first records."""
+        samples = [
+            prompt_factory_eval.generate_prompt(self.task_name, 'logits', item_data, None, prefix_layout=self.prefix_layout)
+            for item_data in itertools.islice(baseline_data, self.warmup_samples)
         ]
-        response = self.tokenizer.batch_decode(output_sequence, skip_special_tokens=True)[0]
-        return response
+        self.backend.warm_up(samples)
+
+    def run_evaluation(self, baseline_data, explanation_data, output_file, resume=False):
+        """Runs the LLM-as-a-Judge evaluation, appending each finished record to `output_file`."""
+        self.warm_up(baseline_data)
+        with StageWriter(output_file, resume=resume, **stage_options(self.config)) as writer:
+            if writer.completed:
+                print(f"Resuming: {writer.completed} records already in {output_file}.")
+            window = []
+            remaining = itertools.islice(enumerate(baseline_data), writer.completed, None)
+            total = len(baseline_data) - writer.completed
+
+            with self.telemetry.stage(f"Evaluating {self.task_name}") as stage:
+                for i, item_data in tqdm(remaining, total=total, desc=f"Evaluating {self.task_name}"):
+                    result_record = item_data.copy()
+                    add_explanations = None
 
-    def run_evaluation(self, baseline_data, explanation_data, output_file):
-        """Runs the LLM-as-a-Judge evaluation."""
-        
-        all_results = []
-        
-        for i, item_data in tqdm(enumerate(baseline_data), total=len(baseline_data), desc=f"Evaluating {self.task_name}"):
-            result_record = item_data.copy()
-            add_explanations = None
-            
-            if explanation_data:
-                explanation_record = explanation_data[i].get('filtered_evidence')
-                if not explanation_record:
-                    print(f"Warning: No filtered evidence found for item {i}. Skipping explanation.")
-                else:
-                    # Using a simple representation of explanations
-                    add_explanations = json.dumps(explanation_record)
+                    if explanation_data:
+                        # Sharded runs join on the record's global index rather than its position in the shard
+                        index = global_index(item_data, i)
+                        explanation_record = explanation_data[index].get('filtered_evidence')
+                        if not explanation_record:
+                            print(f"Warning: No filtered evidence found for item {index}. Skipping explanation.")
+                        else:
+                            # Using a simple representation of explanations
+                            add_explanations = json.dumps(explanation_record)
 
-            # Evaluate for each ranking type: logits, full, score
-            for rank_type in ['logits', 'full', 'score']:
-                prompts = prompt_factory_eval.generate_prompt(
-                    self.task_name, rank_type, item_data, add_explanations
-                )
-                
-                if rank_type == 'score':
-                    scores = [self._get_llm_response(p, rank_type) for p in prompts]
-                    result_record[rank_type] = scores
-                else:
-                    response = self._get_llm_response(prompts, rank_type)
-                    result_record[rank_type] = response
-            
-            all_results.append(result_record)
+                    # Judge calls are collected over a window of items and run in batches across items and rank types
+                    window.append((result_record, add_explanations))
+                    if len(window) >= self.batch_window:
+                        for record in self._evaluate_window(window):
+                            writer.write(record)
+                        window = []
+                if window:
+                    for record in self._evaluate_window(window):
+                        writer.write(record)
+                stage.items += writer.next_index - writer.completed
 
-        # Save raw results
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for record in all_results:
-                f.write(json.dumps(record) + '\n')
-        print(f"Raw evaluation results saved to {output_file}")
\ No newline at end of file
+        if self.cache:
+            self.cache.report(f"Evaluating {self.task_name}")
+            self.cache.evict()
+        print(f"Raw evaluation results saved to {output_file}")
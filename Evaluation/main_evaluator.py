@@ -3,27 +3,53 @@ import yaml
 import os
 import pandas as pd
 from evaluator import Evaluator
-from data_loader import load_dataset
+from data_loader import JsonlReader
+from columnar import stage_options, stage_exists, open_stage, export_jsonl, parquet_path
+from shard_utils import ShardedRecords, parse_shard, shard_output_path, merge_shards
 from data_processor import DataProcessor
 from metrics_calculator import MetricsCalculator
+from telemetry import Telemetry
 
 def main():
     parser = argparse.ArgumentParser(description="Run the HLV Evaluation Pipeline.")
     parser.add_argument('--config', type=str, required=True, help='Path to the evaluation configuration file.')
-    parser.add_argument('--mode', type=str, required=True, choices=['baseline', 'with_explanations', 'calculate'], help='Execution mode.')
+    parser.add_argument('--mode', type=str, required=True, choices=['baseline', 'with_explanations', 'merge', 'calculate', 'export'], help='Execution mode.')
+    parser.add_argument('--shard', type=str, default=None, help="Evaluate only shard k of N ('k/N', 0-based), writing a per-shard raw output file.")
+    parser.add_argument('--num_shards', type=int, default=None, help="Number of shards to combine in 'merge' mode.")
+    parser.add_argument('--resume', action='store_true', help='Continue from the last record already in the raw output file.')
+    parser.add_argument('--no_cache', action='store_true', help='Bypass the judge response cache for this run.')
     
     args = parser.parse_args()
 
     with open(args.config, 'r') as f:
         config = yaml.safe_load(f)
 
+    if args.no_cache:
+        config.setdefault('cache', {})['enabled'] = False
+
     task_name = config['task_name']
     output_dir = config['output_dir']
     os.makedirs(output_dir, exist_ok=True)
-    
+
+    telemetry = Telemetry(config, f"{task_name}_{args.mode}")
+    if args.shard:
+        telemetry.report_file = shard_output_path(telemetry.report_file, parse_shard(args.shard))
+        if telemetry.prometheus_file:
+            telemetry.prometheus_file = shard_output_path(telemetry.prometheus_file, parse_shard(args.shard))
+    # The run report is written even if the run fails, so the failed run can be inspected
+    try:
+        run_mode(args, parser, config, telemetry)
+    finally:
+        telemetry.write_report()
+
+def run_mode(args, parser, config, telemetry):
+    """Runs the selected evaluation mode."""
+    task_name = config['task_name']
+    output_dir = config['output_dir']
+
     if args.mode in ['baseline', 'with_explanations']:
         print(f"--- Running Evaluation in '{args.mode}' mode ---")
-        evaluator = Evaluator(config)
+        evaluator = Evaluator(config, telemetry=telemetry)
         
         if args.mode == 'baseline':
             input_file = config['input_baseline_file']
@@ -34,12 +60,45 @@ def main():
             explanation_file = config['input_explanation_file']
             output_file = os.path.join(output_dir, f"{task_name}_with_explanations_raw_output.jsonl")
             print(f"Loading explanations from: {explanation_file}")
-            explanation_data = load_dataset(explanation_file)
+            # Only the filtered evidence is used, so a Parquet explanation file skips the reasoning text
+            explanation_data = open_stage(explanation_file, columns=['filtered_evidence'])
 
         print(f"Loading baseline data from: {input_file}")
-        baseline_data = load_dataset(input_file)
+        baseline_reader = JsonlReader(input_file)
+        baseline_data = baseline_reader
+
+        if args.shard:
+            shard = parse_shard(args.shard)
+            print(f"Evaluating shard {shard[0]} of {shard[1]}...")
+            baseline_data = ShardedRecords(baseline_data, shard)
+            output_file = shard_output_path(output_file, shard)
         
-        evaluator.run_evaluation(baseline_data, explanation_data, output_file)
+        try:
+            evaluator.run_evaluation(baseline_data, explanation_data, output_file, resume=args.resume)
+        finally:
+            baseline_reader.close()
+            if explanation_data is not None:
+                explanation_data.close()
+
+    elif args.mode == 'merge':
+        if not args.num_shards:
+            parser.error("--num_shards is required in 'merge' mode.")
+        print(f"--- Merging {args.num_shards} shards ---")
+        with JsonlReader(config['input_baseline_file']) as baseline_data:
+            total = len(baseline_data)
+        for setting_name, setting_details in config['evaluation_settings'].items():
+            raw_llm_output_file = os.path.join(output_dir, setting_details['raw_output_file'])
+            if not stage_exists(shard_output_path(raw_llm_output_file, (0, args.num_shards))):
+                print(f"Warning: No shard outputs found for setting '{setting_name}'. Skipping.")
+                continue
+            merge_shards(raw_llm_output_file, args.num_shards, expected_total=total, **stage_options(config))
+
+    elif args.mode == 'export':
+        print("--- Exporting Parquet raw outputs to JSONL ---")
+        for setting_name, setting_details in config['evaluation_settings'].items():
+            raw_llm_output_file = os.path.join(output_dir, setting_details['raw_output_file'])
+            if os.path.exists(parquet_path(raw_llm_output_file)):
+                print(f"Exported {export_jsonl(raw_llm_output_file)}")
 
     elif args.mode == 'calculate':
         print("--- Running Metric Calculation ---")
@@ -49,28 +108,71 @@ def main():
         # 1. Process Gold Standard Data
         gold_standard_file = config['gold_standard_file']
         print(f"Processing gold standard data from: {gold_standard_file}")
-        processed_gold_df = processor.process_gold_standard(gold_standard_file)
+        with telemetry.stage("Gold standard") as stage:
+            gold_data = processor.compile_gold_standard(gold_standard_file)
+            stage.items += len(gold_data['id'])
 
         # 2. Process LLM outputs for all settings and calculate metrics
         all_metrics_results = {}
+        processed_settings = {}
         evaluation_settings = config['evaluation_settings']
+        bootstrap_config = config.get('bootstrap', {})
+        num_resamples = bootstrap_config.get('num_resamples', 0)
+        seed = bootstrap_config.get('seed', 0)
 
         for setting_name, setting_details in evaluation_settings.items():
             raw_llm_output_file = os.path.join(output_dir, setting_details['raw_output_file'])
-            if not os.path.exists(raw_llm_output_file):
+            if not stage_exists(raw_llm_output_file):
                 print(f"Warning: Raw output file not found for setting '{setting_name}'. Skipping.")
                 continue
 
             print(f"\nProcessing and calculating metrics for: {setting_name}")
-            processed_llm_df = processor.process_llm_output(raw_llm_output_file)
+            with telemetry.stage("Process raw outputs") as stage:
+                llm_data = calculator.as_arrays(processor.process_llm_output(raw_llm_output_file))
+                num_items = len(next(iter(llm_data.values())))
+                stage.items += num_items
+            processed_settings[setting_name] = llm_data
             
             # Calculate metrics
-            metrics = calculator.calculate_all_metrics(processed_llm_df, processed_gold_df)
+            with telemetry.stage("Metrics") as stage:
+                metrics = calculator.calculate_all_metrics(llm_data, gold_data)
+                stage.items += num_items
+            if num_resamples > 0:
+                print(f"Bootstrapping {num_resamples} resamples...")
+                with telemetry.stage("Bootstrap") as stage:
+                    intervals = calculator.bootstrap_confidence_intervals(
+                        llm_data, gold_data, num_resamples,
+                        confidence=bootstrap_config.get('confidence', 0.95), seed=seed,
+                        dcor_resamples=bootstrap_config.get('dcor_resamples', 0),
+                        workers=bootstrap_config.get('workers', 1)
+                    )
+                    stage.items += num_resamples
+                for metric_name, (low, high) in intervals.items():
+                    metrics[f"{metric_name}_CI_Low"] = low
+                    metrics[f"{metric_name}_CI_High"] = high
             all_metrics_results[setting_name] = metrics
 
-        # 3. Save results to Excel
+        # 3. Paired significance tests of each setting against the reference setting
+        reference_setting = bootstrap_config.get('reference_setting', 'baseline')
+        if num_resamples > 0 and reference_setting in processed_settings:
+            for setting_name, llm_data in processed_settings.items():
+                if setting_name == reference_setting:
+                    continue
+                print(f"Paired permutation test: {setting_name} vs {reference_setting}")
+                with telemetry.stage("Permutation test") as stage:
+                    p_values = calculator.paired_permutation_test(
+                        llm_data, processed_settings[reference_setting], gold_data, num_resamples, seed=seed
+                    )
+                    stage.items += num_resamples
+                for metric_name, p_value in p_values.items():
+                    all_metrics_results[setting_name][f"{metric_name}_p_vs_{reference_setting}"] = p_value
+
+        # 4. Save results to Excel, with each metric's CI and p-value columns next to it
         output_excel_path = os.path.join(output_dir, f"{task_name}_metrics_report.xlsx")
         df_results = pd.DataFrame.from_dict(all_metrics_results, orient='index')
+        suffixes = ['', '_CI_Low', '_CI_High', f'_p_vs_{reference_setting}']
+        metric_names = [column for column in df_results.columns if not column.endswith(tuple(suffixes[1:]))]
+        df_results = df_results[[name + suffix for name in metric_names for suffix in suffixes if name + suffix in df_results.columns]]
         df_results.to_excel(output_excel_path)
         print(f"\nMetrics report saved successfully to: {output_excel_path}")
 
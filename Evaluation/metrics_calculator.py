@@ -1,19 +1,30 @@
+import multiprocessing
 import numpy as np
 import pandas as pd
-from scipy.stats import spearmanr, kendalltau
+from concurrent.futures import ProcessPoolExecutor
+from scipy.stats import rankdata
 from scipy.special import rel_entr
-from sklearn.metrics import mean_absolute_error, root_mean_squared_error, r2_score
+from sklearn.metrics import r2_score
 from dcor import distance_correlation
 
+# Per-item matrix columns shared by the compiled gold standard and processed LLM outputs
+METRIC_COLUMNS = ['distribution', 'score', 'rank']
+
+# Upper bound on item draws (resamples x items) held at once, which caps memory per resample batch
+RESAMPLE_BATCH_ENTRIES = 2_000_000
+
+def _resampled_distance_correlations(gold_dist, model_dist, indices):
+    """Distance correlation of each resample of item indices; module level so process pools can run it."""
+    return [distance_correlation(gold_dist[idx], model_dist[idx]) for idx in indices]
+
 class MetricsCalculator:
+    # Divergences work row-wise over (n_items, n_options) matrices, or on single distributions
     def _kl_divergence(self, p, q, epsilon=1e-10):
-        p = np.asarray(p, dtype=np.float64)
-        q = np.asarray(q, dtype=np.float64)
-        p = np.clip(p, epsilon, 1)
-        q = np.clip(q, epsilon, 1)
-        p /= p.sum()
-        q /= q.sum()
-        return np.sum(rel_entr(p, q))
+        p = np.clip(np.asarray(p, dtype=np.float64), epsilon, 1)
+        q = np.clip(np.asarray(q, dtype=np.float64), epsilon, 1)
+        p /= p.sum(axis=-1, keepdims=True)
+        q /= q.sum(axis=-1, keepdims=True)
+        return np.sum(rel_entr(p, q), axis=-1)
 
     def _jensen_shannon(self, p, q):
         p = np.asarray(p, dtype=np.float64)
@@ -22,52 +33,217 @@ class MetricsCalculator:
         return np.sqrt((self._kl_divergence(p, m) + self._kl_divergence(q, m)) / 2)
 
     def _tvd(self, p, q):
-        return np.sum(np.abs(np.array(p) - np.array(q))) / 2
+        return np.sum(np.abs(np.asarray(p) - np.asarray(q)), axis=-1) / 2
+
+    def _row_pearson(self, x, y):
+        """Row-wise Pearson correlation, with the same operation order as np.corrcoef(x, y)[1, 0]."""
+        x = x - x.mean(axis=1, keepdims=True)
+        y = y - y.mean(axis=1, keepdims=True)
+        fact = 1 / (x.shape[1] - 1)
+        cov = np.einsum('ij,ij->i', y, x) * fact
+        var_x = np.einsum('ij,ij->i', x, x) * fact
+        var_y = np.einsum('ij,ij->i', y, y) * fact
+        return np.clip(cov / np.sqrt(var_y) / np.sqrt(var_x), -1, 1)
 
-    def calculate_distribution_metrics(self, model_df, gold_df):
+    def _spearman_rows(self, gold, model):
+        """Spearman correlation of each pair of rows: Pearson correlation of their average ranks."""
+        return self._row_pearson(rankdata(gold, axis=1), rankdata(model, axis=1))
+
+    def _kendall_tau_b_rows(self, gold, model):
+        """Kendall's tau-b of each pair of rows, from the signs of all pairwise differences."""
+        i, j = np.triu_indices(gold.shape[1], k=1)
+        gold_signs = np.sign(gold[:, i] - gold[:, j]).astype(np.int64)
+        model_signs = np.sign(model[:, i] - model[:, j]).astype(np.int64)
+        # concordant minus discordant pairs, over pairs untied in each ranking (as scipy's kendalltau)
+        con_minus_dis = (gold_signs * model_signs).sum(axis=1)
+        tau = con_minus_dis / np.sqrt(np.abs(gold_signs).sum(axis=1)) / np.sqrt(np.abs(model_signs).sum(axis=1))
+        return np.clip(tau, -1., 1.)
+
+    def as_arrays(self, data):
+        """Dense (n_items, n_options) matrices per metric column, from compiled arrays or a processed DataFrame."""
+        if isinstance(data, pd.DataFrame):
+            return {column: np.vstack(data[column].to_list()).astype(float) for column in METRIC_COLUMNS if column in data.columns}
+        return data
+
+    def calculate_distribution_metrics(self, model_data, gold_data):
         metrics = {}
-        gold_dist = np.vstack(gold_df['distribution'].to_list())
-        model_dist = np.vstack(model_df['distribution'].to_list())
+        gold_dist = gold_data['distribution']
+        model_dist = model_data['distribution']
         
-        metrics['KL_Divergence'] = np.mean([self._kl_divergence(p, q) for p, q in zip(model_dist, gold_dist)])
-        metrics['Jensen_Shannon'] = np.mean([self._jensen_shannon(p, q) for p, q in zip(model_dist, gold_dist)])
-        metrics['Total_Variation_Distance'] = np.mean([self._tvd(p, q) for p, q in zip(model_dist, gold_dist)])
+        metrics['KL_Divergence'] = np.mean(self._kl_divergence(model_dist, gold_dist))
+        metrics['Jensen_Shannon'] = np.mean(self._jensen_shannon(model_dist, gold_dist))
+        metrics['Total_Variation_Distance'] = np.mean(self._tvd(model_dist, gold_dist))
         metrics['Distance_Correlation'] = distance_correlation(gold_dist, model_dist)
         return metrics
 
-    def calculate_score_metrics(self, model_df, gold_df):
+    def calculate_score_metrics(self, model_data, gold_data):
         metrics = {}
-        gold_flat = gold_df['score'].explode().astype(float).to_list()
-        model_flat = model_df['score'].explode().astype(float).to_list()
+        gold_scores = gold_data['score']
+        model_scores = model_data['score']
         
-        metrics['RMSE_Avg'] = np.mean([root_mean_squared_error(g, p) for g, p in zip(gold_df['score'], model_df['score'])])
-        metrics['MAE_Avg'] = np.mean([mean_absolute_error(g, p) for g, p in zip(gold_df['score'], model_df['score'])])
-        metrics['R2_Score_Overall'] = r2_score(gold_flat, model_flat)
+        # Per-item RMSE and MAE over the options, then averaged over items
+        errors = gold_scores - model_scores
+        metrics['RMSE_Avg'] = np.mean(np.sqrt(np.mean(errors ** 2, axis=1)))
+        metrics['MAE_Avg'] = np.mean(np.mean(np.abs(errors), axis=1))
+        metrics['R2_Score_Overall'] = r2_score(gold_scores.ravel(), model_scores.ravel())
         return metrics
 
-    def calculate_rank_metrics(self, model_df, gold_df):
+    def calculate_rank_metrics(self, model_data, gold_data):
         metrics = {}
-        spearman_corrs, kendall_taus = [], []
+        gold_ranks = gold_data['rank']
+        model_ranks = model_data['rank']
 
-        for gold_rank, model_rank in zip(gold_df['rank'], model_df['rank']):
-            if len(set(gold_rank)) > 1 and len(set(model_rank)) > 1:
-                spearman_corrs.append(spearmanr(gold_rank, model_rank)[0])
-                kendall_taus.append(kendalltau(gold_rank, model_rank)[0])
-        
-        metrics['Spearman_Avg'] = np.nanmean(spearman_corrs)
-        metrics['Kendall_Tau_Avg'] = np.nanmean(kendall_taus)
+        # Correlations are undefined for constant rankings, so those items are left out
+        varied = (gold_ranks.min(axis=1) != gold_ranks.max(axis=1)) & (model_ranks.min(axis=1) != model_ranks.max(axis=1))
+        gold_ranks, model_ranks = gold_ranks[varied], model_ranks[varied]
+
+        metrics['Spearman_Avg'] = np.nanmean(self._spearman_rows(gold_ranks, model_ranks))
+        metrics['Kendall_Tau_Avg'] = np.nanmean(self._kendall_tau_b_rows(gold_ranks, model_ranks))
         return metrics
 
-    def calculate_all_metrics(self, model_df, gold_df):
+    def calculate_all_metrics(self, model_data, gold_data):
+        """Computes every metric both sides have columns for; each side is a processed DataFrame or a dict of arrays."""
+        model_data, gold_data = self.as_arrays(model_data), self.as_arrays(gold_data)
         all_metrics = {}
-        if 'distribution' in model_df.columns and 'distribution' in gold_df.columns:
-            all_metrics.update(self.calculate_distribution_metrics(model_df, gold_df))
-        if 'score' in model_df.columns and 'score' in gold_df.columns:
-            all_metrics.update(self.calculate_score_metrics(model_df, gold_df))
-        if 'rank' in model_df.columns and 'rank' in gold_df.columns:
-            # Gold standard needs a 'rank' column, which can be derived from 'score' or 'distribution'
-            if 'rank' not in gold_df.columns and 'score' in gold_df.columns:
-                gold_df['rank'] = gold_df['score'].apply(lambda x: np.argsort(-np.array(x)).tolist())
-            if 'rank' in gold_df.columns:
-                all_metrics.update(self.calculate_rank_metrics(model_df, gold_df))
-        return all_metrics
\ No newline at end of file
+        if 'distribution' in model_data and 'distribution' in gold_data:
+            all_metrics.update(self.calculate_distribution_metrics(model_data, gold_data))
+        if 'score' in model_data and 'score' in gold_data:
+            all_metrics.update(self.calculate_score_metrics(model_data, gold_data))
+        if 'rank' in model_data and 'rank' in gold_data:
+            all_metrics.update(self.calculate_rank_metrics(model_data, gold_data))
+        return all_metrics
+
+    # --- Resampling ---
+    def _item_terms(self, model_data, gold_data):
+        """Per-item terms whose means give each metric, plus per-item sums for R2 and the distributions for distance correlation."""
+        model_data, gold_data = self.as_arrays(model_data), self.as_arrays(gold_data)
+        terms, r2_terms, distributions = {}, None, None
+        if 'distribution' in model_data and 'distribution' in gold_data:
+            gold_dist = gold_data['distribution']
+            model_dist = model_data['distribution']
+            terms['KL_Divergence'] = self._kl_divergence(model_dist, gold_dist)
+            terms['Jensen_Shannon'] = self._jensen_shannon(model_dist, gold_dist)
+            terms['Total_Variation_Distance'] = self._tvd(model_dist, gold_dist)
+            distributions = (gold_dist, model_dist)
+        if 'score' in model_data and 'score' in gold_data:
+            gold_scores = gold_data['score']
+            model_scores = model_data['score']
+            errors = gold_scores - model_scores
+            terms['RMSE_Avg'] = np.sqrt(np.mean(errors ** 2, axis=1))
+            terms['MAE_Avg'] = np.mean(np.abs(errors), axis=1)
+            # R2 over all scores = 1 - SS_res / SS_tot, both built from per-item sums
+            r2_terms = np.column_stack([
+                (errors ** 2).sum(axis=1), gold_scores.sum(axis=1), (gold_scores ** 2).sum(axis=1),
+                np.full(len(gold_scores), gold_scores.shape[1], dtype=float)
+            ])
+        if 'rank' in model_data and 'rank' in gold_data:
+            gold_ranks = gold_data['rank']
+            model_ranks = model_data['rank']
+            # Items with a constant ranking get NaN and are left out of the means, as in calculate_rank_metrics
+            varied = (gold_ranks.min(axis=1) != gold_ranks.max(axis=1)) & (model_ranks.min(axis=1) != model_ranks.max(axis=1))
+            for name, func in [('Spearman_Avg', self._spearman_rows), ('Kendall_Tau_Avg', self._kendall_tau_b_rows)]:
+                terms[name] = np.full(len(gold_ranks), np.nan)
+                terms[name][varied] = func(gold_ranks[varied], model_ranks[varied])
+        return terms, r2_terms, distributions
+
+    def _term_matrix(self, terms, r2_terms, num_items):
+        """Stacks the per-item terms, their presence flags and the R2 sums into one (n_items, n_columns) matrix."""
+        values = np.column_stack(list(terms.values())) if terms else np.empty((num_items, 0))
+        present = np.isfinite(values)
+        columns = [np.where(present, values, 0.), present.astype(float)]
+        if r2_terms is not None:
+            columns.append(r2_terms)
+        return np.hstack(columns)
+
+    def _aggregate(self, names, has_r2, sums):
+        """Metric values from weighted sums of the term matrix, one row per resample."""
+        num_terms = len(names)
+        results = {}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # Resamples without a single varied ranking have no defined correlation (NaN)
+            means = sums[:, :num_terms] / sums[:, num_terms:2 * num_terms]
+            for column, name in enumerate(names):
+                results[name] = means[:, column]
+            if has_r2:
+                ss_res, sum_y, sum_yy, count = sums[:, 2 * num_terms:].T
+                results['R2_Score_Overall'] = 1 - ss_res / (sum_yy - sum_y ** 2 / count)
+        return results
+
+    def _resample_batches(self, num_resamples, num_items):
+        """Splits the resamples into batches of at most RESAMPLE_BATCH_ENTRIES item draws."""
+        batch_size = max(1, RESAMPLE_BATCH_ENTRIES // max(num_items, 1))
+        for start in range(0, num_resamples, batch_size):
+            yield min(batch_size, num_resamples - start)
+
+    def _distance_correlation_resamples(self, distributions, indices, workers):
+        if workers <= 1:
+            return np.array(_resampled_distance_correlations(*distributions, indices))
+        chunks = np.array_split(indices, workers * 4)
+        # Fresh interpreters, since forking after numba (used by dcor) has started its threads can deadlock
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_resampled_distance_correlations, *distributions, chunk) for chunk in chunks if len(chunk)]
+            return np.concatenate([future.result() for future in futures])
+
+    def bootstrap_confidence_intervals(self, model_data, gold_data, num_resamples=10000, confidence=0.95, seed=0,
+                                       dcor_resamples=0, workers=1):
+        """Percentile bootstrap CIs of every metric, resampling items with replacement.
+
+        Distance correlation does not decompose into per-item terms, so it is recomputed on
+        each of its own `dcor_resamples` resamples (skipped when 0), across `workers` processes.
+        """
+        terms, r2_terms, distributions = self._item_terms(model_data, gold_data)
+        num_items = len(next(iter(self.as_arrays(gold_data).values())))
+        matrix = self._term_matrix(terms, r2_terms, num_items)
+        rng = np.random.default_rng(seed)
+        samples = {}
+        for batch_size in self._resample_batches(num_resamples, num_items):
+            # Every metric is linear in how often each item is drawn, so a resample is one row of counts
+            idx = rng.integers(0, num_items, size=(batch_size, num_items))
+            idx += np.arange(batch_size)[:, None] * num_items
+            counts = np.bincount(idx.ravel(), minlength=batch_size * num_items).reshape(batch_size, num_items)
+            for name, values in self._aggregate(list(terms), r2_terms is not None, counts @ matrix).items():
+                samples.setdefault(name, []).append(values)
+        if distributions is not None and dcor_resamples > 0:
+            idx = rng.integers(0, num_items, size=(dcor_resamples, num_items))
+            samples['Distance_Correlation'] = [self._distance_correlation_resamples(distributions, idx, workers)]
+
+        alpha = (1 - confidence) / 2
+        intervals = {}
+        for name, values in samples.items():
+            values = np.concatenate(values)
+            values = values[np.isfinite(values)]
+            intervals[name] = tuple(np.quantile(values, [alpha, 1 - alpha])) if len(values) else (np.nan, np.nan)
+        return intervals
+
+    def paired_permutation_test(self, model_data, reference_data, gold_data, num_resamples=10000, seed=0):
+        """Two-sided p-values for the metric differences between two settings judged on the same items.
+
+        Under the null hypothesis the two settings are exchangeable per item, so each resample
+        swaps the settings' per-item terms on a random half of the items.
+        """
+        terms, r2_terms, _ = self._item_terms(model_data, gold_data)
+        ref_terms, ref_r2_terms, _ = self._item_terms(reference_data, gold_data)
+        num_items = len(next(iter(self.as_arrays(gold_data).values())))
+        matrix = self._term_matrix(terms, r2_terms, num_items)
+        ref_matrix = self._term_matrix(ref_terms, ref_r2_terms, num_items)
+        names, has_r2 = list(terms), r2_terms is not None
+
+        def differences(swap):
+            # Swapping item i moves its terms between the two settings' sums
+            shift = swap @ (ref_matrix - matrix)
+            model = self._aggregate(names, has_r2, matrix.sum(axis=0) + shift)
+            reference = self._aggregate(names, has_r2, ref_matrix.sum(axis=0) - shift)
+            return {name: model[name] - reference[name] for name in model}
+
+        observed = {name: abs(diff[0]) for name, diff in differences(np.zeros((1, num_items))).items()}
+        rng = np.random.default_rng(seed)
+        exceed = dict.fromkeys(observed, 0)
+        for batch_size in self._resample_batches(num_resamples, num_items):
+            swap = (rng.random((batch_size, num_items)) < 0.5).astype(float)
+            for name, diff in differences(swap).items():
+                # Small tolerance so resamples tying the observed difference count despite rounding
+                exceed[name] += np.count_nonzero(np.abs(diff) >= observed[name] - 1e-12)
+        return {
+            name: (exceed[name] + 1) / (num_resamples + 1) if np.isfinite(observed[name]) else np.nan
+            for name in observed
+        }
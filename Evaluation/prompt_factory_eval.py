@@ -1,8 +1,11 @@
-def generate_prompt(task, rank_type, item_data, add_explanations=None):
+def generate_prompt(task, rank_type, item_data, add_explanations=None, prefix_layout=False):
     """
     Generates prompts for the LLM-as-a-Judge based on the task and evaluation type.
+    With `prefix_layout`, score prompts put everything they share (explanations, rating scale)
+    before the answer being rated, so the evaluator can reuse the shared prefix's KV cache.
     """
     explanation_text = f"\\nExplanations: {add_explanations}" if add_explanations else ""
+    rating_scale = "Plausibility Ratings:\\n1 = Impossible\\n2 = Technically Possible\\n3 = Plausible\\n4 = Likely\\n5 = Very Likely"
 
     if task == 'VariErrNLI':
         premise = item_data['premise']
@@ -16,8 +19,12 @@ def generate_prompt(task, rank_type, item_data, add_explanations=None):
             return f"Please assess whether the following statement is true (entailment), undetermined (neutral), or false (contradiction) given the context below. Consider relevant perspectives, possible explanations, or reasoning patterns in the following explanations. Rank all the following options from most appropriate to least appropriate. Only output the letters representing the options, separated by spaces.\\n{context}\\n{options}{explanation_text}\\nAnswer:"
         elif rank_type == 'score':
             prompts = []
+            instruction = "Please rate the following answer based on its plausibility in representing the relationship between the context and the statement on the 5-Point Scale rating as below. Consider relevant perspectives, possible explanations, or reasoning patterns in the following explanations. Only output a single integer corresponding to your evaluation."
             for label in ['Entailment', 'Neutral', 'Contradiction']:
-                prompts.append(f"Please rate the following answer based on its plausibility in representing the relationship between the context and the statement on the 5-Point Scale rating as below. Consider relevant perspectives, possible explanations, or reasoning patterns in the following explanations. Only output a single integer corresponding to your evaluation.\\n{context}\\nAnswer: {label}\\nPlausibility Ratings:\\n1 = Impossible\\n2 = Technically Possible\\n3 = Plausible\\n4 = Likely\\n5 = Very Likely{explanation_text}\\nRating:")
+                if prefix_layout:
+                    prompts.append(f"{instruction}\\n{context}{explanation_text}\\n{rating_scale}\\nAnswer: {label}\\nRating:")
+                else:
+                    prompts.append(f"{instruction}\\n{context}\\nAnswer: {label}\\n{rating_scale}{explanation_text}\\nRating:")
             return prompts
 
     elif task in ['cqa', 'siqa']:
@@ -32,8 +39,12 @@ def generate_prompt(task, rank_type, item_data, add_explanations=None):
             return f"Please read the following, consider relevant perspectives, possible explanations, or reasoning patterns in the following explanations. Rank all the following options from best to worst base on relevance and appropriateness. Only output the letters representing the options, separated by spaces.\\n{context}\\n{options}{explanation_text}\\nAnswer:"
         elif rank_type == 'score':
             prompts = []
+            instruction = "Please read the following, consider relevant perspectives, possible explanations, or reasoning patterns in the following explanations. Rate the plausibility of the answer on the 5-Point Scale rating as below. Only output a single integer corresponding to your evaluation."
             for ans_text in answers.values():
-                prompts.append(f"Please read the following, consider relevant perspectives, possible explanations, or reasoning patterns in the following explanations. Rate the plausibility of the answer on the 5-Point Scale rating as below. Only output a single integer corresponding to your evaluation.\\n{context}\\nAnswer: {ans_text}\\nPlausibility Ratings:\\n1 = Impossible\\n2 = Technically Possible\\n3 = Plausible\\n4 = Likely\\n5 = Very Likely{explanation_text}\\nRating:")
+                if prefix_layout:
+                    prompts.append(f"{instruction}\\n{context}{explanation_text}\\n{rating_scale}\\nAnswer: {ans_text}\\nRating:")
+                else:
+                    prompts.append(f"{instruction}\\n{context}\\nAnswer: {ans_text}\\n{rating_scale}{explanation_text}\\nRating:")
             return prompts
     
     raise ValueError(f"Unknown task for prompt generation: {task}")
\ No newline at end of file
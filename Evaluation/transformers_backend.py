@@ -0,0 +1,265 @@
+import copy
+import time
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+# Prefix reuse needs a cache object that can be copied and expanded per batch (transformers >= 4.42)
+try:
+    from transformers import DynamicCache
+except ImportError:
+    DynamicCache = None
+from backends import profile_settings
+from decoding import DecodingProfiles, FirstTokenTimer
+from cpu_inference import cpu_settings, apply_thread_settings, optimize_model, drift_report
+
+class TransformersBackend:
+    """Runs the judge model in-process with transformers, using padded batches and a shared-prefix KV cache."""
+    def __init__(self, config, labels, telemetry=None):
+        self.config = config
+        self.labels = labels
+        self.telemetry = telemetry
+        # The CPU profile loads the model in full precision and converts it in warm_up, after the drift reference
+        self.cpu = cpu_settings(config)
+        if self.cpu:
+            apply_thread_settings(self.cpu)
+        self.warmed_up = not self.cpu
+        print("Loading evaluation model... This may take a moment.")
+        self.model = AutoModelForCausalLM.from_pretrained(
+            config['model_name'],
+            cache_dir=config.get('cache_dir'),
+            torch_dtype=torch.float32 if self.cpu else "auto",
+            device_map=None if self.cpu else "auto"
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(
+            config['model_name'],
+            cache_dir=config.get('cache_dir')
+        )
+        # Batched generation pads on the left, so every prompt ends right where generation starts
+        self.tokenizer.padding_side = 'left'
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.batch_size = config.get('batch_size', 8)
+        self.prefix_cache = config.get('prefix_cache', True)
+        if self.prefix_cache and not hasattr(DynamicCache, 'batch_repeat_interleave'):
+            print("Note: this transformers version cannot reuse a prefix KV cache (needs >= 4.42); prefix_cache is ignored.")
+            self.prefix_cache = False
+        self.option_token_ids = self._option_token_ids()
+        self.decoding = DecodingProfiles(profile_settings(config), self.tokenizer, labels)
+        print("Model loaded successfully.")
+
+    def _option_token_ids(self):
+        """Looks up the token id of each option letter in the loaded tokenizer."""
+        token_ids = []
+        for label in self.labels:
+            ids = self.tokenizer.encode(label, add_special_tokens=False)
+            if len(ids) != 1:
+                raise ValueError(f"Option letter '{label}' is not a single token for {self.config['model_name']}: {ids}")
+            token_ids.append(ids[0])
+        return token_ids
+
+    def _chat_text(self, input_prompt):
+        """Renders one prompt with the chat template."""
+        messages = [{"role": "user", "content": input_prompt}]
+        return self.tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+
+    def _chat_input_ids(self, input_prompt):
+        """Applies the chat template and tokenizes one prompt."""
+        return self.tokenizer(self._chat_text(input_prompt))['input_ids']
+
+    def cache_fields(self, rank_type, input_prompt):
+        """Returns everything that determines the response to one prompt, for the judge cache key."""
+        params = {'labels': self.labels} if rank_type == 'logits' else self.decoding.profiles[rank_type]
+        fields = {
+            'backend': 'transformers', 'model': self.config['model_name'], 'rank_type': rank_type,
+            'prompt': self._chat_text(input_prompt), 'params': params
+        }
+        if self.cpu:
+            # Quantized and bfloat16 models answer slightly differently from the full-precision one
+            fields['precision'] = self.cpu['precision']
+        return fields
+
+    def _pad(self, input_ids):
+        return self.tokenizer.pad(
+            {'input_ids': input_ids}, padding=True, return_tensors="pt"
+        ).to(self.model.device)
+
+    def _record_prefill(self, start, tokens):
+        if self.telemetry:
+            self.telemetry.record_timing('judge_prefill', time.perf_counter() - start, tokens)
+
+    def _generate(self, input_ids, attention_mask, rank_type, past_key_values=None):
+        """Runs one generate call with the rank type's decoding profile and decodes only the new tokens."""
+        prompt_length = input_ids.shape[1]
+        generate_kwargs = self.decoding.generate_kwargs(rank_type, prompt_length)
+        # Runs after the answer check, whose decode waits for the GPU, so the timestamp is not early
+        timer = FirstTokenTimer()
+        generate_kwargs['stopping_criteria'].append(timer)
+        cached_length = 0
+        if past_key_values is not None:
+            # Only passed when set: older versions of generate() treat an explicit None as a legacy cache
+            generate_kwargs['past_key_values'] = past_key_values
+            cached_length = past_key_values.get_seq_length()
+        start = time.perf_counter()
+        generated_ids = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            return_dict_in_generate=True,
+            pad_token_id=self.tokenizer.pad_token_id,
+            **generate_kwargs
+        )
+
+        output_sequences = generated_ids.sequences[:, prompt_length:]
+        if self.telemetry and timer.first_token_at is not None:
+            # Prefill is everything up to the first new token; tokens already in the prefix cache are not counted
+            self.telemetry.record_timing(
+                'judge_prefill', timer.first_token_at - start, int(attention_mask[:, cached_length:].sum())
+            )
+            self.telemetry.record_timing(
+                'judge_decode', time.perf_counter() - timer.first_token_at,
+                int((output_sequences != self.tokenizer.pad_token_id).sum())
+            )
+        return self.tokenizer.batch_decode(output_sequences, skip_special_tokens=True)
+
+    def _generate_ids(self, input_ids, rank_type):
+        """Gets the full text or score answers for a batch of tokenized prompts in one generate call."""
+        model_inputs = self._pad(input_ids)
+        return self._generate(model_inputs.input_ids, model_inputs.attention_mask, rank_type)
+
+    def _shared_prefix_length(self, input_ids):
+        """Length of the prompts' common token prefix, leaving at least one token of each prompt to prefill."""
+        limit = min(len(ids) for ids in input_ids) - 1
+        length = 0
+        while length < limit and len({ids[length] for ids in input_ids}) == 1:
+            length += 1
+        return length
+
+    def _generate_ids_with_prefix(self, input_ids, rank_type):
+        """Like _generate_ids, but prefills the prompts' common prefix once and reuses its KV cache."""
+        prefix_length = self._shared_prefix_length(input_ids)
+        if len(input_ids) < 2 or prefix_length == 0:
+            return self._generate_ids(input_ids, rank_type)
+
+        prefix = input_ids[0][:prefix_length]
+        start = time.perf_counter()
+        with torch.no_grad():
+            # An explicit cache object, so versions that default to legacy tuples also return a DynamicCache
+            prefix_cache = self.model(
+                input_ids=torch.tensor([prefix], device=self.model.device),
+                past_key_values=DynamicCache(), use_cache=True
+            ).past_key_values
+        self._record_prefill(start, prefix_length)
+
+        responses = []
+        pad_token_id = self.tokenizer.pad_token_id
+        for start in range(0, len(input_ids), self.batch_size):
+            suffixes = [ids[prefix_length:] for ids in input_ids[start:start + self.batch_size]]
+            width = max(len(suffix) for suffix in suffixes)
+            # Padding goes between the prefix and each suffix, so every prompt still ends where generation starts
+            batch_ids = [prefix + [pad_token_id] * (width - len(suffix)) + suffix for suffix in suffixes]
+            attention_mask = [[1] * prefix_length + [0] * (width - len(suffix)) + [1] * len(suffix) for suffix in suffixes]
+            past_key_values = copy.deepcopy(prefix_cache)
+            past_key_values.batch_repeat_interleave(len(suffixes))
+            responses.extend(self._generate(
+                torch.tensor(batch_ids, device=self.model.device),
+                torch.tensor(attention_mask, device=self.model.device),
+                rank_type,
+                past_key_values=past_key_values
+            ))
+        return responses
+
+    def _score_ids(self, input_ids):
+        """Returns (logits, log-probabilities) of the option letters as the next token, in one forward pass."""
+        model_inputs = self._pad(input_ids)
+        # Left padding shifts each prompt, so positions are counted from its first real token
+        position_ids = (model_inputs.attention_mask.cumsum(-1) - 1).clamp(min=0)
+        start = time.perf_counter()
+        with torch.no_grad():
+            logits = self.model(**model_inputs, position_ids=position_ids).logits[:, -1, :].float()
+        logprobs = torch.log_softmax(logits, dim=-1)
+        results = [
+            (row_logits[self.option_token_ids].tolist(), row_logprobs[self.option_token_ids].tolist())
+            for row_logits, row_logprobs in zip(logits, logprobs)
+        ]
+        # The scoring pass is a prefill with no decode steps
+        self._record_prefill(start, int(model_inputs.attention_mask.sum()))
+        return results
+
+    def warm_up(self, sample_prompts):
+        """Applies the CPU profile, checks its drift from full precision on `sample_prompts` and warms the model up."""
+        if self.warmed_up:
+            return
+        self.warmed_up = True
+        # Warm-up passes would skew the judge's prefill and decode timings
+        telemetry, self.telemetry = self.telemetry, None
+        input_ids = [self._chat_input_ids(prompt) for prompt in sample_prompts]
+        batches = [input_ids[start:start + self.batch_size] for start in range(0, len(input_ids), self.batch_size)]
+        reference = None
+        if batches and self.cpu['precision'] != 'float32':
+            reference = [result for batch in batches for result in self._score_ids(batch)]
+        precision = optimize_model(self.model, self.cpu)
+
+        start = time.perf_counter()
+        converted = [result for batch in batches for result in self._score_ids(batch)]
+        if batches:
+            # One short generate call, so compilation and the decode path are warm too
+            self._generate_ids(batches[0], 'score')
+            print(f"Warm-up on {len(input_ids)} prompts took {time.perf_counter() - start:.2f}s.")
+        self.telemetry = telemetry
+
+        if reference and precision != 'float32':
+            drift = drift_report(reference, converted)
+            print(
+                f"{precision} drift from float32 on {drift['samples']} 'logits' prompts: "
+                f"mean KL {drift['mean_kl']:.4g}, max KL {drift['max_kl']:.4g}, "
+                f"max probability difference {drift['max_abs_prob_diff']:.4f}, "
+                f"top-1 agreement {drift['top1_agreement']:.1%}"
+            )
+
+    def generate_text(self, input_prompts, rank_type, shared_prefix=False):
+        """Generates answers for one batch of prompts; `shared_prefix` reuses their common prefix's KV cache."""
+        self.warm_up([])
+        input_ids = [self._chat_input_ids(prompt) for prompt in input_prompts]
+        if shared_prefix and self.prefix_cache:
+            return self._generate_ids_with_prefix(input_ids, rank_type)
+        return self._generate_ids(input_ids, rank_type)
+
+    def next_token_logprobs(self, input_prompts):
+        """Returns (logits, log-probabilities) of each option letter as the next token, for one batch of prompts."""
+        self.warm_up([])
+        return self._score_ids([self._chat_input_ids(prompt) for prompt in input_prompts])
+
+    def batch(self, requests):
+        """Answers (group, rank_type, prompt) requests with length-sorted, left-padded batches, in request order."""
+        # Without an explicit warm-up the CPU profile is still applied, just without the drift check
+        self.warm_up([])
+        requests = [(group, rank_type, self._chat_input_ids(prompt)) for group, rank_type, prompt in requests]
+        responses = [None] * len(requests)
+        if self.prefix_cache:
+            # A group's score prompts differ only near the end, so each group shares one prefix prefill
+            score_groups = {}
+            for r, (group, rank_type, _) in enumerate(requests):
+                if rank_type == 'score':
+                    score_groups.setdefault(group, []).append(r)
+            for members in score_groups.values():
+                outputs = self._generate_ids_with_prefix([requests[r][2] for r in members], 'score')
+                for r, output in zip(members, outputs):
+                    responses[r] = output
+
+        # Similar lengths share a batch, which keeps padding to a minimum
+        order = sorted(range(len(requests)), key=lambda r: len(requests[r][2]), reverse=True)
+        order = [r for r in order if responses[r] is None]
+        # Each rank type has its own decoding profile; 'logits' only needs the next-token distribution
+        for rank_type in ['logits', 'full', 'score']:
+            members = [r for r in order if requests[r][1] == rank_type]
+            for start in range(0, len(members), self.batch_size):
+                batch = members[start:start + self.batch_size]
+                batch_ids = [requests[r][2] for r in batch]
+                if rank_type == 'logits':
+                    outputs = self._score_ids(batch_ids)
+                else:
+                    outputs = self._generate_ids(batch_ids, rank_type)
+                for r, output in zip(batch, outputs):
+                    responses[r] = output
+        return responses
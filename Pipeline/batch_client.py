@@ -0,0 +1,52 @@
+import os
+import json
+import time
+
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+def submit_batch(client, request_file, endpoint, completion_window):
+    """Uploads a batch request JSONL file and creates a batch job for it."""
+    with open(request_file, 'rb') as f:
+        uploaded = client.files.create(file=f, purpose='batch')
+    return client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint=endpoint,
+        completion_window=completion_window
+    )
+
+def wait_for_batch(client, batch_id, poll_interval):
+    """Polls a batch job until it reaches a terminal status."""
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+        print(f"Batch {batch_id}: {batch.status}{progress}")
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+def download_batch_results(client, batch):
+    """Returns {custom_id: response body} for every request that succeeded in the batch."""
+    results = {}
+    if not batch.output_file_id:
+        return results
+    content = client.files.content(batch.output_file_id).text
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            continue
+        results[record['custom_id']] = response['body']
+    return results
+
+def load_batch_state(state_file):
+    if not os.path.exists(state_file):
+        return None
+    with open(state_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_batch_state(state_file, state):
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
@@ -0,0 +1,156 @@
+import os
+import json
+import bisect
+import itertools
+from data_loader import JsonlReader, decode_json, INDEX_SUFFIX
+
+# pyarrow is only needed for the 'parquet' stage format
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+STAGE_FORMATS = ['jsonl', 'parquet']
+PARQUET_SUFFIX = '.parquet'
+ROW_GROUP_SIZE = 4096
+# Schema metadata: fields stored as JSON text (anything but a string in every record), and the JSONL export setting
+JSON_FIELDS_KEY = b'stage_json_fields'
+ENSURE_ASCII_KEY = b'stage_ensure_ascii'
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("The 'parquet' stage format needs pyarrow: pip install pyarrow")
+
+def stage_options(config):
+    """StageWriter keyword arguments from the config's `stage_format` and `keep_jsonl` options."""
+    return {'stage_format': config.get('stage_format', 'jsonl'), 'keep_jsonl': config.get('keep_jsonl', False)}
+
+def parquet_path(path):
+    """Returns the compacted counterpart of a stage file, e.g. out.jsonl -> out.parquet."""
+    return os.path.splitext(path)[0] + PARQUET_SUFFIX
+
+def stage_exists(path):
+    return os.path.exists(path) or os.path.exists(parquet_path(path))
+
+def open_stage(path, columns=None):
+    """Opens a stage file: its Parquet version when present (decoding only `columns`), otherwise the JSONL file."""
+    if os.path.exists(parquet_path(path)):
+        return ParquetRecords(parquet_path(path), columns)
+    return JsonlReader(path)
+
+def compact_stage(path, ensure_ascii=True, keep_jsonl=False):
+    """Rewrites a finished JSONL stage file as zstd-compressed Parquet with the same fields, one column each."""
+    require_pyarrow()
+    # Pass 1: field order, and whether each field is a string in every record (stored as is, never parsed)
+    fields = {}
+    for position, record in enumerate(JsonlReader(path, persist_index=False)):
+        for name, value in record.items():
+            if name not in fields:
+                fields[name] = position == 0 and isinstance(value, str)
+        for name, is_text in fields.items():
+            if is_text and not isinstance(record.get(name), str):
+                fields[name] = False
+
+    # Pass 2: every other field is JSON text, with null marking a field the record does not have
+    schema = pa.schema(
+        [(name, pa.string()) for name in fields],
+        metadata={
+            JSON_FIELDS_KEY: json.dumps([name for name, is_text in fields.items() if not is_text]),
+            ENSURE_ASCII_KEY: json.dumps(ensure_ascii),
+        }
+    )
+    output_path = parquet_path(path)
+    temp_path = output_path + '.tmp'
+    records = iter(JsonlReader(path, persist_index=False))
+    with pq.ParquetWriter(temp_path, schema, compression='zstd') as writer:
+        while True:
+            chunk = list(itertools.islice(records, ROW_GROUP_SIZE))
+            if not chunk:
+                break
+            columns = [
+                [record[name] for record in chunk] if is_text else
+                [json.dumps(record[name], ensure_ascii=False) if name in record else None for record in chunk]
+                for name, is_text in fields.items()
+            ]
+            writer.write_table(pa.Table.from_arrays([pa.array(column, pa.string()) for column in columns], schema=schema))
+    os.replace(temp_path, output_path)
+
+    if not keep_jsonl:
+        for stale in [path, path + INDEX_SUFFIX]:
+            if os.path.exists(stale):
+                os.remove(stale)
+    return output_path
+
+def export_jsonl(path, ensure_ascii=None):
+    """Writes the JSONL version of a compacted stage file next to it, e.g. for tools that expect JSONL."""
+    records = ParquetRecords(parquet_path(path))
+    if ensure_ascii is None:
+        ensure_ascii = records.ensure_ascii
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=ensure_ascii) + '\n')
+    os.replace(temp_path, path)
+    return path
+
+class ParquetRecords:
+    """Read-only records of a compacted stage file that decode only the requested columns."""
+    def __init__(self, file_path, columns=None):
+        require_pyarrow()
+        self.file_path = file_path
+        self._file = pq.ParquetFile(file_path)
+        metadata = self._file.schema_arrow.metadata or {}
+        self._json_fields = set(json.loads(metadata.get(JSON_FIELDS_KEY, b'[]')))
+        self.ensure_ascii = json.loads(metadata.get(ENSURE_ASCII_KEY, b'true'))
+        # Columns the file does not have are skipped, as a JSONL record would just lack the key
+        self.columns = [name for name in self._file.schema_arrow.names if columns is None or name in columns]
+        sizes = [self._file.metadata.row_group(g).num_rows for g in range(self._file.num_row_groups)]
+        self._group_starts = list(itertools.accumulate(sizes, initial=0))
+        self._group = (None, None) # (row group number, its column value lists)
+
+    def _column_values(self, table):
+        return [(name, name in self._json_fields, table.column(name).to_pylist()) for name in self.columns]
+
+    def _record(self, columns, row):
+        # Built fresh on every access, since stages mutate the records they are given
+        record = {}
+        for name, is_json, values in columns:
+            value = values[row]
+            if is_json:
+                if value is not None:
+                    record[name] = decode_json(value)
+            else:
+                record[name] = value
+        return record
+
+    def __len__(self):
+        return self._group_starts[-1]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        group = bisect.bisect_right(self._group_starts, i) - 1
+        # Consecutive lookups mostly fall in the same row group, so its decoded columns are kept
+        if self._group[0] != group:
+            self._group = (group, self._column_values(self._file.read_row_group(group, columns=self.columns)))
+        return self._record(self._group[1], i - self._group_starts[group])
+
+    def __iter__(self):
+        for batch in self._file.iter_batches(batch_size=ROW_GROUP_SIZE, columns=self.columns):
+            columns = self._column_values(batch)
+            for row in range(batch.num_rows):
+                yield self._record(columns, row)
+
+    def close(self):
+        """Releases the Parquet file handle."""
+        self._file.close()
+        self._group = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
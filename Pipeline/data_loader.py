@@ -1,13 +1,124 @@
+import os
 import json
-import codecs
+import mmap
+import struct
+from array import array
+
+# orjson is several times faster than the stdlib parser; fall back to json when it is missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+INDEX_SUFFIX = '.idx'
+INDEX_HEADER = struct.Struct('<QQ') # source file size, source mtime_ns
+
+def decode_json(line):
+    """Decodes one JSON document, using orjson when available."""
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            pass # e.g. NaN/Infinity, which only the stdlib parser accepts
+    return json.loads(line)
 
 def load_dataset(file_path):
     """Loads a .jsonl or multi-line .json file where each line is a JSON object."""
-    data = []
-    with codecs.open(file_path, 'r', 'utf-8') as f:
-        for line in f:
+    return list(JsonlReader(file_path))
+
+class JsonlReader:
+    """Lazy .jsonl reader: streams records in order, or seeks to record i through a byte-offset index."""
+    def __init__(self, file_path, persist_index=True):
+        self.file_path = file_path
+        # The index is built on first random access and saved as `<file>.idx` for later runs
+        self.persist_index = persist_index
+        self._offsets = None
+        self._file = None
+        self._mmap = None
+
+    def __iter__(self):
+        with open(self.file_path, 'rb') as f:
+            for line in f:
+                record = self._decode_line(line)
+                if record is not None:
+                    yield record
+
+    def _decode_line(self, line):
+        """Decodes one line, or returns None (with a warning) for lines load_dataset would skip."""
+        if not line.strip():
+            return None
+        try:
+            return decode_json(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print(f"Warning: Could not decode JSON from line in {self.file_path}. Skipping.")
+            return None
+
+    def _index_path(self):
+        return self.file_path + INDEX_SUFFIX
+
+    def _source_stamp(self):
+        stat = os.stat(self.file_path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load_index(self):
+        """Reads the persisted index if it still matches the source file's size and mtime."""
+        try:
+            with open(self._index_path(), 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) != INDEX_HEADER.size or INDEX_HEADER.unpack(header) != self._source_stamp():
+                    return None
+                offsets = array('Q')
+                offsets.frombytes(f.read())
+                return offsets
+        except (OSError, ValueError):
+            return None
+
+    def _build_index(self):
+        """Scans the file once, recording the byte offset of every decodable record."""
+        offsets = array('Q')
+        position = 0
+        with open(self.file_path, 'rb') as f:
+            for line in f:
+                if self._decode_line(line) is not None:
+                    offsets.append(position)
+                position += len(line)
+        if self.persist_index:
             try:
-                data.append(json.loads(line))
-            except json.JSONDecodeError:
-                print(f"Warning: Could not decode JSON from line in {file_path}. Skipping.")
-    return data
\ No newline at end of file
+                with open(self._index_path(), 'wb') as f:
+                    f.write(INDEX_HEADER.pack(*self._source_stamp()))
+                    offsets.tofile(f)
+            except OSError:
+                pass # read-only location: keep the index in memory only
+        return offsets
+
+    def _ensure_index(self):
+        if self._offsets is None:
+            self._offsets = (self._load_index() if self.persist_index else None) or self._build_index()
+        return self._offsets
+
+    def __len__(self):
+        return len(self._ensure_index())
+
+    def __getitem__(self, i):
+        offsets = self._ensure_index()
+        start = offsets[i] # raises IndexError like a list
+        # Mapped on the first lookup (and again after close), so len() alone holds no file open
+        if self._mmap is None:
+            self._file = open(self.file_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        end = self._mmap.find(b'\n', start)
+        return decode_json(self._mmap[start:end if end != -1 else len(self._mmap)])
+
+    def close(self):
+        """Releases the file handle and mapping held for random access."""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
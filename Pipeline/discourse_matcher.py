@@ -0,0 +1,79 @@
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+
+NGRAM_SIZE = 3
+SEED_CANDIDATES = 3
+
+def _ngrams(text):
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+class DiscourseMatcher:
+    """Finds the best-matching discourse unit for a sentence, pruning candidates that cannot win."""
+    def __init__(self, units, threshold=0.6):
+        self.units = list(units)
+        self.threshold = threshold
+        # One matcher per unit with the unit as seq2, so difflib's index of it is built only once
+        self._matchers = [None] * len(self.units)
+        # Character n-gram index, used only to pick likely winners to evaluate first
+        self._index = defaultdict(list)
+        for idx, unit in enumerate(self.units):
+            for gram in _ngrams(unit):
+                self._index[gram].append(idx)
+
+    def _matcher(self, idx):
+        matcher = self._matchers[idx]
+        if matcher is None:
+            matcher = SequenceMatcher(None)
+            matcher.set_seq2(self.units[idx])
+            self._matchers[idx] = matcher
+        return matcher
+
+    def _beats(self, score, idx, best_score, best_idx):
+        """Whether `score` at position `idx` would replace the current best in a full in-order scan."""
+        if score <= self.threshold:
+            return False
+        return score > best_score or (score == best_score and best_idx is not None and idx < best_idx)
+
+    def _ratio(self, idx, check_snt, best_score, best_idx):
+        """Returns ratio() for unit `idx` if it beats the current best, checking quick_ratio() first."""
+        matcher = self._matcher(idx)
+        matcher.set_seq1(check_snt)
+        if not self._beats(matcher.quick_ratio(), idx, best_score, best_idx):
+            return None
+        ratio = matcher.ratio()
+        return ratio if self._beats(ratio, idx, best_score, best_idx) else None
+
+    def best_match(self, check_snt):
+        """Returns the first unit with the highest ratio() above the threshold, as a full scan would."""
+        if not self.units or not check_snt:
+            return None
+        len_a = len(check_snt)
+        # Same formula as SequenceMatcher.real_quick_ratio(), an upper bound on ratio()
+        bounds = sorted(
+            (-(2.0 * min(len_a, len(unit)) / (len_a + len(unit))), idx)
+            for idx, unit in enumerate(self.units)
+        )
+        best_score, best_idx = 0, None
+
+        # Score the units sharing the most n-grams first: a high running best lets the bounds below prune more
+        overlap = Counter()
+        for gram in _ngrams(check_snt):
+            overlap.update(self._index.get(gram, ()))
+        seeds = [idx for idx, _ in overlap.most_common(SEED_CANDIDATES)]
+        for idx in seeds:
+            ratio = self._ratio(idx, check_snt, best_score, best_idx)
+            if ratio is not None:
+                best_score, best_idx = ratio, idx
+
+        for neg_bound, idx in bounds:
+            # Bounds only decrease from here on, so nothing later can win either
+            if not self._beats(-neg_bound, idx, best_score, best_idx):
+                if -neg_bound <= self.threshold or -neg_bound < best_score:
+                    break
+                continue
+            if idx in seeds:
+                continue
+            ratio = self._ratio(idx, check_snt, best_score, best_idx)
+            if ratio is not None:
+                best_score, best_idx = ratio, idx
+        return self.units[best_idx] if best_idx is not None else None
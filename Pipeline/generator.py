@@ -1,131 +1,522 @@
 import os
 import json
 import time
-from openai import OpenAI
+import asyncio
+import itertools
+from openai import OpenAI, AsyncOpenAI
 from tqdm import tqdm
 import prompt_manager
+from stage_io import StageWriter
+from columnar import stage_options
+from response_cache import ResponseCache
+from telemetry import Telemetry
+from batch_client import submit_batch, wait_for_batch, download_batch_results, load_batch_state, save_batch_state
+from rate_limiter import ModelRateLimiter, is_retryable, is_rate_limited, retry_after_seconds, backoff_delay
+
+def parse_structured_evidence(text):
+    """Decodes a fused Stage 2 answer into {"Option X": {"support": [...], "oppose": [...]}}; None if it is not valid."""
+    if not text:
+        return None
+    # Reasoning models often wrap the JSON in a Markdown code fence or a sentence
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    try:
+        evidence = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(evidence, dict) or not evidence:
+        return None
+    for value in evidence.values():
+        if not isinstance(value, dict):
+            return None
+        for sentiment in ['support', 'oppose']:
+            sentences = value.get(sentiment, [])
+            if not isinstance(sentences, list) or not all(isinstance(sentence, str) for sentence in sentences):
+                return None
+    return evidence
 
 class Generator:
-    def __init__(self, config):
+    def __init__(self, config, telemetry=None):
         self.config = config
         self.task_name = config['task_name']
+        self.telemetry = telemetry or Telemetry(config, self.task_name)
+        # Retries are handled by _call_api, so the client's own retry loop is disabled
         self.client = OpenAI(
             api_key=self.config.get('api_key'),
-            base_url=self.config.get('base_url')
+            base_url=self.config.get('base_url'),
+            max_retries=0
         )
+        # Async execution: items run concurrently, bounded per model by max_in_flight
+        self.async_mode = config.get('async_mode', False)
+        self.max_in_flight = config.get('max_in_flight', {})
+        self.async_client = None
+        self.rate_limiters = {}
+        self.retry_config = config.get('retry', {})
+        # Fused mode: Stage 2 already answers with the structured JSON, and Stage 3 only handles records where it failed
+        self.fused = config.get('structuring_stage_3', {}).get('mode') == 'fused'
+        self.fused_fallbacks = 0
         os.makedirs(self.config['output_dir'], exist_ok=True)
 
+        # Optional on-disk response cache in front of _call_api
+        cache_config = config.get('cache', {})
+        self.cache = None
+        if cache_config.get('enabled', False):
+            self.cache = ResponseCache(
+                cache_config.get('path', os.path.join(self.config['output_dir'], 'api_cache.sqlite')),
+                max_size_mb=cache_config.get('max_size_mb'),
+                max_age_days=cache_config.get('max_age_days')
+            )
+
+    def _parse_response(self, content, reasoning, json_mode):
+        """Returns (content, reasoning), or the decoded JSON content in JSON mode."""
+        if json_mode:
+            return json.loads(content), None
+        return content, reasoning
+
+    def _cache_key(self, model, messages, response_format):
+        return ResponseCache.make_key(
+            model=model, messages=messages,
+            response_format=response_format, base_url=self.config.get('base_url')
+        )
+
+    def _get_limiter(self, model):
+        """Returns the rate limiter for `model`, built from the `rate_limits` config on first use."""
+        if model not in self.rate_limiters:
+            limits = self.config.get('rate_limits', {}).get(model, {})
+            self.rate_limiters[model] = ModelRateLimiter(
+                rpm=limits.get('rpm'),
+                tpm=limits.get('tpm'),
+                max_in_flight=self.max_in_flight.get(model, 8),
+                initial_in_flight=limits.get('initial_in_flight')
+            )
+        return self.rate_limiters[model]
+
+    def _estimate_tokens(self, messages):
+        # Rough prompt size (~4 characters per token), corrected with response.usage afterwards
+        return sum(len(m.get('content') or '') for m in messages) // 4
+
+    def _retry_delay(self, model, error, limiter, attempt, max_retries):
+        """Returns the backoff before the next attempt; fatal errors are re-raised."""
+        if not is_retryable(error):
+            self.telemetry.record_failure(model)
+            raise error
+        self.telemetry.record_retry(model)
+        retry_after = retry_after_seconds(error)
+        if is_rate_limited(error):
+            limiter.on_rate_limited(retry_after)
+        delay = backoff_delay(
+            attempt,
+            self.retry_config.get('base_delay', 1.0),
+            self.retry_config.get('max_delay', 120.0),
+            retry_after
+        )
+        print(f"API call failed with error: {error}. Retrying in {delay:.1f}s ({attempt+1}/{max_retries})...")
+        return delay
+
+    def _give_up(self, model, error, max_retries):
+        """Handles exhausted retries: invalid JSON yields (None, None), anything else aborts the stage."""
+        if isinstance(error, json.JSONDecodeError):
+            print(f"Warning: {model} did not return valid JSON after {max_retries} retries. Storing null.")
+            return None, None
+        raise RuntimeError(f"API call to {model} failed after {max_retries} retries. Re-run with --resume.") from error
+
+    def _complete(self, response, limiter, estimated_tokens, json_mode, cache_key):
+        """Parses a successful response, updates the limiter and stores it in the cache."""
+        usage = getattr(response, 'usage', None)
+        limiter.record_usage(estimated_tokens, getattr(usage, 'total_tokens', None))
+        message = response.choices[0].message
+        content = message.content
+        reasoning = getattr(message, 'reasoning_content', None)
+        result = self._parse_response(content, reasoning, json_mode)
+        limiter.on_success()
+        if self.cache:
+            self.cache.set(cache_key, {'content': content, 'reasoning': reasoning})
+        return result
+
     def _call_api(self, model, messages, json_mode=False):
-        """Encapsulates API calls with retries and JSON mode support."""
-        retries = 3
-        for i in range(retries):
+        """Encapsulates API calls with rate limiting, retries and JSON mode support."""
+        response_format = {'type': 'json_object'} if json_mode else None
+        cache_key = None
+        if self.cache:
+            cache_key = self._cache_key(model, messages, response_format)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.telemetry.record_cache_hit(model)
+                return self._parse_response(cached['content'], cached['reasoning'], json_mode)
+
+        limiter = self._get_limiter(model)
+        estimated_tokens = self._estimate_tokens(messages)
+        max_retries = self.retry_config.get('max_retries', 8)
+        for attempt in range(max_retries + 1):
+            time.sleep(limiter.reserve(estimated_tokens))
             try:
-                response_format = {'type': 'json_object'} if json_mode else None
+                start = time.perf_counter()
                 response = self.client.chat.completions.create(
                     model=model,
                     messages=messages,
                     response_format=response_format
                 )
-                content = response.choices[0].message.content
-                if json_mode:
-                    return json.loads(content), None
+                self.telemetry.record_call(model, time.perf_counter() - start, getattr(response, 'usage', None))
+                return self._complete(response, limiter, estimated_tokens, json_mode, cache_key)
+            except Exception as e:
+                if attempt == max_retries:
+                    self.telemetry.record_failure(model)
+                    if not is_retryable(e):
+                        raise
+                    return self._give_up(model, e, max_retries)
+                time.sleep(self._retry_delay(model, e, limiter, attempt, max_retries))
+
+    async def _acall_api(self, model, messages, json_mode=False):
+        """Async counterpart of _call_api; concurrency adapts to the provider's 429 responses."""
+        response_format = {'type': 'json_object'} if json_mode else None
+        cache_key = None
+        if self.cache:
+            cache_key = self._cache_key(model, messages, response_format)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.telemetry.record_cache_hit(model)
+                return self._parse_response(cached['content'], cached['reasoning'], json_mode)
+
+        limiter = self._get_limiter(model)
+        estimated_tokens = self._estimate_tokens(messages)
+        max_retries = self.retry_config.get('max_retries', 8)
+        for attempt in range(max_retries + 1):
+            await limiter.acquire()
+            try:
+                await asyncio.sleep(limiter.reserve(estimated_tokens))
+                start = time.perf_counter()
+                response = await self.async_client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    response_format=response_format
+                )
+                self.telemetry.record_call(model, time.perf_counter() - start, getattr(response, 'usage', None))
+                return self._complete(response, limiter, estimated_tokens, json_mode, cache_key)
+            except Exception as e:
+                if attempt == max_retries:
+                    self.telemetry.record_failure(model)
+                    if not is_retryable(e):
+                        raise
+                    return self._give_up(model, e, max_retries)
+                delay = self._retry_delay(model, e, limiter, attempt, max_retries)
+            finally:
+                await limiter.release()
+            await asyncio.sleep(delay)
+
+    def _run_items_async(self, worker, data, desc, writer, total=None):
+        """Runs the async `worker` over items concurrently and writes results in input order."""
+        # Bound the number of admitted-but-unwritten items so memory stays flat on long runs
+        window = self.config.get('async_window', 4 * max(self.max_in_flight.values(), default=8))
+
+        async def run_one(index, item):
+            return index, await worker(item)
+
+        async def run_all():
+            for limiter in self.rate_limiters.values():
+                limiter.reset_async_state()
+            async with AsyncOpenAI(
+                api_key=self.config.get('api_key'),
+                base_url=self.config.get('base_url'),
+                max_retries=0
+            ) as client:
+                self.async_client = client
+                with tqdm(total=total, desc=desc) as pbar:
+                    pending = set()
+
+                    async def drain():
+                        nonlocal pending
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            index, result = task.result()
+                            writer.write_at(index, result)
+                            pbar.update(1)
+
+                    for index, item in enumerate(data, start=writer.next_index):
+                        while index - writer.next_index >= window:
+                            await drain()
+                        pending.add(asyncio.create_task(run_one(index, item)))
+                    while pending:
+                        await drain()
+            self.async_client = None
+        asyncio.run(run_all())
+
+    def _run_stage(self, sync_worker, async_worker, data, desc, output_file, resume, ensure_ascii=True):
+        """Runs a per-item stage, appending each finished record to `output_file`."""
+        with StageWriter(output_file, resume=resume, ensure_ascii=ensure_ascii, **stage_options(self.config)) as writer:
+            if writer.completed:
+                print(f"Resuming: {writer.completed} records already in {output_file}.")
+            total = len(data) - writer.completed if hasattr(data, '__len__') else None
+            remaining = itertools.islice(data, writer.completed, None)
+            with self.telemetry.stage(desc) as stage:
+                if self.async_mode:
+                    self._run_items_async(async_worker, remaining, desc, writer, total)
                 else:
-                    reasoning = getattr(response.choices[0].message, 'reasoning_content', None)
-                    return content, reasoning
-            except (Exception, json.JSONDecodeError) as e:
-                print(f"API call failed with error: {e}. Retrying ({i+1}/{retries})...")
-                time.sleep(5)
-        return None, None
-
-    def run_generation_stage_1_and_2(self, data):
-        """Runs Stage 1 (Generation) and Stage 2 (Extraction) together."""
-        print("\nRunning Generation Stages 1 & 2...")
+                    for item in tqdm(remaining, total=total, desc=desc):
+                        writer.write(sync_worker(item))
+                stage.items += writer.next_index - writer.completed
+        if self.cache:
+            self.cache.report(desc)
+            self.cache.evict()
+
+    def _build_prompt_s1(self, item, prompt_key_s1):
+        """Builds the Stage 1 prompt for a single item based on the task."""
+        if self.task_name == 'CommonsenseQA':
+            return prompt_manager.get_prompt(
+                prompt_key_s1,
+                question=item['question'],
+                answerA=item['answerA'], answerB=item['answerB'], answerC=item['answerC'],
+                answerD=item['answerD'], answerE=item['answerE']
+            )
+        elif self.task_name == 'SocialIQA':
+            return prompt_manager.get_prompt(
+                prompt_key_s1,
+                context=item['context'],
+                question=item['question'],
+                answerA=item['answerA'], answerB=item['answerB'], answerC=item['answerC']
+            )
+        elif self.task_name == 'VariErrNLI':
+            return prompt_manager.get_prompt(
+                prompt_key_s1,
+                premise=item['premise'],
+                hypothesis=item['hypothesis']
+            )
+        raise ValueError(f"Task '{self.task_name}' not configured for Stage 1&2.")
+
+    def _build_prompt_s2(self, reasoning):
+        """Builds the Stage 2 prompt; fused mode asks for the structured JSON instead of a Markdown list."""
         config_s12 = self.config['generation_stage_1_and_2']
-        model_s1 = config_s12['model_s1']
-        model_s2 = config_s12['model_s2']
-        prompt_key_s1 = config_s12['prompt_template_key_s1']
-        prompt_key_s2 = config_s12['prompt_template_key_s2']
-
-        results = []
-        for item in tqdm(data, desc=self.task_name + " Stages 1&2"):
-            # Prepare prompts based on task
-            if self.task_name == 'CommonsenseQA':
-                prompt_s1 = prompt_manager.get_prompt(
-                    prompt_key_s1,
-                    question=item['question'],
-                    answerA=item['answerA'], answerB=item['answerB'], answerC=item['answerC'],
-                    answerD=item['answerD'], answerE=item['answerE']
-                )
-            elif self.task_name == 'SocialIQA':
-                prompt_s1 = prompt_manager.get_prompt(
-                    prompt_key_s1,
-                    context=item['context'],
-                    question=item['question'],
-                    answerA=item['answerA'], answerB=item['answerB'], answerC=item['answerC']
-                )
-            elif self.task_name == 'VariErrNLI':
-                prompt_s1 = prompt_manager.get_prompt(
-                    prompt_key_s1,
-                    premise=item['premise'],
-                    hypothesis=item['hypothesis']
-                )
-            else:
-                raise ValueError(f"Task '{self.task_name}' not configured for Stage 1&2.")
+        if self.fused:
+            template_key = config_s12.get('prompt_template_key_s2_fused', 's2_structured_extraction_prompt')
+        else:
+            template_key = config_s12['prompt_template_key_s2']
+        return prompt_manager.get_prompt(template_key, reasoning=reasoning)
 
-            # Stage 1: Initial reasoning generation
-            messages = [{"role": "user", "content": prompt_s1}]
-            answer_q, reasoning_q = self._call_api(model_s1, messages)
+    def _attach_fused_evidence(self, item):
+        """In fused mode, stores Stage 2's answer as the record's structured evidence if it is valid JSON of the right shape."""
+        if self.fused:
+            evidence = parse_structured_evidence(item['AnswerS'])
+            if evidence is not None:
+                item['structured_evidence'] = evidence
 
-            item['InputQ'] = prompt_s1
-            item['AnswerQ'] = answer_q
-            item['ReasoningQ'] = reasoning_q
+    def _generate_item_s12(self, item):
+        """Runs Stage 1 and Stage 2 sequentially for a single item."""
+        config_s12 = self.config['generation_stage_1_and_2']
+        prompt_s1 = self._build_prompt_s1(item, config_s12['prompt_template_key_s1'])
+
+        # Stage 1: Initial reasoning generation
+        messages = [{"role": "user", "content": prompt_s1}]
+        answer_q, reasoning_q = self._call_api(config_s12['model_s1'], messages)
+
+        item['InputQ'] = prompt_s1
+        item['AnswerQ'] = answer_q
+        item['ReasoningQ'] = reasoning_q
+
+        # Stage 2: Extraction of supporting/opposing sentences
+        prompt_s2 = self._build_prompt_s2(reasoning_q)
+        messages.append({'role': 'assistant', 'content': answer_q})
+        messages.append({'role': 'user', 'content': prompt_s2})
+        answer_s, reasoning_s = self._call_api(config_s12['model_s2'], messages)
+
+        item['InputS'] = prompt_s2
+        item['AnswerS'] = answer_s
+        item['ReasoningS'] = reasoning_s
+        self._attach_fused_evidence(item)
+        return item
+
+    async def _agenerate_item_s12(self, item):
+        """Async counterpart of _generate_item_s12; Stage 2 still waits for Stage 1."""
+        config_s12 = self.config['generation_stage_1_and_2']
+        prompt_s1 = self._build_prompt_s1(item, config_s12['prompt_template_key_s1'])
+
+        messages = [{"role": "user", "content": prompt_s1}]
+        answer_q, reasoning_q = await self._acall_api(config_s12['model_s1'], messages)
 
-            # Stage 2: Extraction of supporting/opposing sentences
-            prompt_s2 = prompt_manager.get_prompt(prompt_key_s2, reasoning=reasoning_q)
-            messages.append({'role': 'assistant', 'content': answer_q})
-            messages.append({'role': 'user', 'content': prompt_s2})
-            answer_s, reasoning_s = self._call_api(model_s2, messages)
+        item['InputQ'] = prompt_s1
+        item['AnswerQ'] = answer_q
+        item['ReasoningQ'] = reasoning_q
 
-            item['InputS'] = prompt_s2
-            item['AnswerS'] = answer_s
-            item['ReasoningS'] = reasoning_s
-            
-            results.append(item)
+        prompt_s2 = self._build_prompt_s2(reasoning_q)
+        messages.append({'role': 'assistant', 'content': answer_q})
+        messages.append({'role': 'user', 'content': prompt_s2})
+        answer_s, reasoning_s = await self._acall_api(config_s12['model_s2'], messages)
 
+        item['InputS'] = prompt_s2
+        item['AnswerS'] = answer_s
+        item['ReasoningS'] = reasoning_s
+        self._attach_fused_evidence(item)
+        return item
+
+    def run_generation_stage_1_and_2(self, data, resume=False):
+        """Runs Stage 1 (Generation) and Stage 2 (Extraction) together."""
+        print("\nRunning Generation Stages 1 & 2...")
+        config_s12 = self.config['generation_stage_1_and_2']
         output_file = os.path.join(self.config['output_dir'], config_s12['output_file'])
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for res in results:
-                f.write(json.dumps(res) + '\n')
+
+        self._run_stage(
+            self._generate_item_s12, self._agenerate_item_s12, data,
+            self.task_name + " Stages 1&2", output_file, resume
+        )
         print(f"Stages 1 & 2 results saved to {output_file}")
-        return results
+        return output_file
+
+    def _structure_messages(self, item):
+        """Builds the Stage 3 messages for an item, or None if there is nothing to structure."""
+        user_prompt = item.get('AnswerS')
+        if not user_prompt:
+            return None
+        system_prompt = prompt_manager.get_prompt(self.config['structuring_stage_3']['prompt_template_key'])
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def _needs_structuring(self, item):
+        """Whether Stage 3 has to call the API for an item; in fused mode only when Stage 2's JSON was not valid."""
+        if not self.fused:
+            return True
+        if 'structured_evidence' in item:
+            return False
+        self.fused_fallbacks += 1
+        return True
 
-    def run_structuring_stage_3(self, input_data):
+    def _structure_item(self, item):
+        """Runs Stage 3 for a single item."""
+        if not self._needs_structuring(item):
+            return item
+        messages = self._structure_messages(item)
+        if messages is None:
+            item['structured_evidence'] = {}
+            return item
+        structured_json, _ = self._call_api(self.config['structuring_stage_3']['model'], messages, json_mode=True)
+        item['structured_evidence'] = structured_json
+        return item
+
+    async def _astructure_item(self, item):
+        """Async counterpart of _structure_item."""
+        if not self._needs_structuring(item):
+            return item
+        messages = self._structure_messages(item)
+        if messages is None:
+            item['structured_evidence'] = {}
+            return item
+        structured_json, _ = await self._acall_api(self.config['structuring_stage_3']['model'], messages, json_mode=True)
+        item['structured_evidence'] = structured_json
+        return item
+
+    def _run_structuring_batch(self, input_data, output_file, resume):
+        """Runs Stage 3 through an OpenAI-style Batch API, writes the results in input order and returns their number."""
+        config_s3 = self.config['structuring_stage_3']
+        model = config_s3['model']
+        response_format = {'type': 'json_object'}
+        endpoint = config_s3.get('batch_endpoint', '/v1/chat/completions')
+        request_file = output_file + '.batch_requests.jsonl'
+        state_file = output_file + '.batch_state.json'
+
+        with StageWriter(output_file, resume=resume, ensure_ascii=False, **stage_options(self.config)) as writer:
+            if writer.completed:
+                print(f"Resuming: {writer.completed} records already in {output_file}.")
+
+            # 1. Build the request file (custom_id = record index), skipping empty and cached records
+            state = load_batch_state(state_file) if resume else None
+            if state is None:
+                num_requests = 0
+                with open(request_file, 'w', encoding='utf-8') as f:
+                    for i, item in enumerate(input_data):
+                        if i < writer.completed:
+                            continue
+                        messages = self._structure_messages(item)
+                        if messages is None:
+                            continue
+                        if self.cache and self.cache.contains(self._cache_key(model, messages, response_format)):
+                            continue
+                        request = {
+                            'custom_id': str(i),
+                            'method': 'POST',
+                            'url': endpoint,
+                            'body': {'model': model, 'messages': messages, 'response_format': response_format}
+                        }
+                        f.write(json.dumps(request, ensure_ascii=False) + '\n')
+                        num_requests += 1
+
+                # 2. Submit the batch and remember its id so an interrupted run can re-attach to it
+                state = {'batch_id': None}
+                if num_requests:
+                    print(f"Submitting {num_requests} Stage 3 requests as a batch...")
+                    batch = submit_batch(
+                        self.client, request_file, endpoint, config_s3.get('completion_window', '24h')
+                    )
+                    state['batch_id'] = batch.id
+                save_batch_state(state_file, state)
+            else:
+                print(f"Re-attaching to batch {state['batch_id']}...")
+
+            # 3. Poll until the batch finishes and download its results
+            results = {}
+            if state['batch_id']:
+                batch = wait_for_batch(self.client, state['batch_id'], config_s3.get('poll_interval', 60))
+                results = download_batch_results(self.client, batch)
+            with open(request_file, 'r', encoding='utf-8') as f:
+                requested_ids = {json.loads(line)['custom_id'] for line in f}
+
+            # 4. Ingest in input order; cached and failed records are resolved with regular API calls
+            fallbacks = 0
+            for i, item in enumerate(tqdm(input_data, desc=self.task_name + " Stage 3 (batch)")):
+                if i < writer.completed:
+                    continue
+                structured_json = None
+                body = results.pop(str(i), None)
+                if body is not None:
+                    usage = body.get('usage') or {}
+                    self.telemetry.record_tokens(
+                        model, usage.get('prompt_tokens'), usage.get('completion_tokens'),
+                        (usage.get('completion_tokens_details') or {}).get('reasoning_tokens')
+                    )
+                    content = body['choices'][0]['message']['content']
+                    try:
+                        structured_json = json.loads(content)
+                    except json.JSONDecodeError:
+                        pass
+                if structured_json is not None:
+                    item['structured_evidence'] = structured_json
+                    if self.cache:
+                        cache_key = self._cache_key(model, self._structure_messages(item), response_format)
+                        self.cache.set(cache_key, {'content': content, 'reasoning': None})
+                else:
+                    fallbacks += str(i) in requested_ids
+                    item = self._structure_item(item)
+                writer.write(item)
+            written = writer.next_index - writer.completed
+
+        if fallbacks:
+            print(f"{fallbacks} records were missing from the batch output and were structured with regular API calls.")
+        if self.cache:
+            self.cache.report(self.task_name + " Stage 3 (batch)")
+            self.cache.evict()
+        os.remove(state_file)
+        os.remove(request_file)
+        return written
+
+    def report_fused_fallbacks(self):
+        """Prints how many records fused mode had to structure with a separate Stage 3 call."""
+        if self.fused_fallbacks:
+            print(f"{self.fused_fallbacks} records had no valid structured JSON from Stage 2 and were structured with Stage 3 calls.")
+        self.fused_fallbacks = 0
+
+    def run_structuring_stage_3(self, input_data, resume=False):
         """Runs Stage 3: Converts Stage 2's Markdown text to structured JSON."""
         print("\nRunning Structuring Stage 3...")
         config_s3 = self.config['structuring_stage_3']
-        model = config_s3['model']
-        system_prompt = prompt_manager.get_prompt(config_s3['prompt_template_key'])
-
-        results = []
-        for item in tqdm(input_data, desc=self.task_name + " Stage 3"):
-            user_prompt = item.get('AnswerS')
-            if not user_prompt:
-                item['structured_evidence'] = {}
-                results.append(item)
-                continue
-
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            
-            structured_json, _ = self._call_api(model, messages, json_mode=True)
-            item['structured_evidence'] = structured_json
-            results.append(item)
-        
         output_file = os.path.join(self.config['output_dir'], config_s3['output_file'])
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for res in results:
-                f.write(json.dumps(res, ensure_ascii=False) + '\n')
+
+        if config_s3.get('mode') == 'batch':
+            with self.telemetry.stage(self.task_name + " Stage 3 (batch)") as stage:
+                stage.items += self._run_structuring_batch(input_data, output_file, resume)
+        else:
+            self._run_stage(
+                self._structure_item, self._astructure_item, input_data,
+                self.task_name + " Stage 3", output_file, resume, ensure_ascii=False
+            )
+            self.report_fused_fallbacks()
         print(f"Stage 3 structured results saved to {output_file}")
-        return results
\ No newline at end of file
+        return output_file
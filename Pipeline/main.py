@@ -2,76 +2,127 @@ import argparse
 import yaml
 import os
 from generator import Generator
-from data_loader import load_dataset
+from data_loader import JsonlReader
+from columnar import stage_options, stage_exists, open_stage, export_jsonl, parquet_path
 from post_processor import PostProcessor
+from streaming import StreamingPipeline, STAGES
+from shard_utils import ShardedRecords, parse_shard, shard_output_path, merge_shards
+from telemetry import Telemetry
 
-def main():
-    parser = argparse.ArgumentParser(description="A multi-stage pipeline for generating and processing MCQA explanations.")
-    parser.add_argument('--config', type=str, required=True, help='Path to the task configuration file.')
-    parser.add_argument('--start_stage', type=int, default=1, help='Which stage to start from (1 to 5).')
-
-    args = parser.parse_args()
-
-    # load config
-    with open(args.config, 'r') as f:
-        config = yaml.safe_load(f)
-
-    gen = Generator(config)
-    processor = PostProcessor(config)
-
+def run_stages(args, config, gen, processor, shard):
+    """Runs the configured stages one after another, each reading the previous stage's output file."""
     # --- Stage 1 & 2: Generation & Evidence Extraction ---
     if args.start_stage <= 2 and 'generation_stage_1_and_2' in config:
-        print(f"Loading dataset from {config['input_file']}...")
-        dataset = load_dataset(config['input_file'])
-        gen.run_generation_stage_1_and_2(dataset)
+        print(f"Reading dataset from {config['input_file']}...")
+        with JsonlReader(config['input_file']) as dataset:
+            gen.run_generation_stage_1_and_2(ShardedRecords(dataset, shard) if shard else dataset, resume=args.resume)
 
     # --- Stage 3: Structuring ---
     if args.start_stage <= 3 and 'structuring_stage_3' in config:
         stage2_config = config.get('generation_stage_1_and_2', {})
         stage2_output_path = os.path.join(config['output_dir'], stage2_config.get('output_file'))
         
-        if not os.path.exists(stage2_output_path):
+        if not stage_exists(stage2_output_path):
             raise FileNotFoundError(f"Stage 2 output not found at {stage2_output_path}. Please run stages 1 & 2 first.")
         
-        print(f"Loading data from {stage2_output_path} for Stage 3...")
-        stage2_results = load_dataset(stage2_output_path)
-        gen.run_structuring_stage_3(stage2_results)
+        print(f"Reading data from {stage2_output_path} for Stage 3...")
+        with open_stage(stage2_output_path) as stage2_results:
+            gen.run_structuring_stage_3(stage2_results, resume=args.resume)
 
     # --- Stage 4: Normalization ---
     if args.start_stage <= 4 and 'post_processing_stage_4' in config:
         stage3_config = config.get('structuring_stage_3', {})
         stage3_output_path = os.path.join(config['output_dir'], stage3_config.get('output_file'))
 
-        if not os.path.exists(stage3_output_path):
+        if not stage_exists(stage3_output_path):
             raise FileNotFoundError(f"Stage 3 output not found at {stage3_output_path}. Please run stage 3 first.")
 
-        print(f"Loading data from {stage3_output_path} for Stage 4...")
-        stage3_results = load_dataset(stage3_output_path)
-
-        print(f"Loading original dataset from {config['input_file']} for key normalization...")
-        original_dataset = load_dataset(config['input_file'])
-
-        processor.run_normalization(stage3_results, original_dataset)
+        print(f"Reading data from {stage3_output_path} for Stage 4...")
+        print(f"Reading original dataset from {config['input_file']} for key normalization...")
+        with open_stage(stage3_output_path) as stage3_results, JsonlReader(config['input_file']) as original_dataset:
+            processor.run_normalization(stage3_results, original_dataset, resume=args.resume)
 
     # --- Stage 5: Filtering ---
     if args.start_stage <= 5 and 'filtering_stage_5' in config:
         stage4_config = config.get('post_processing_stage_4', {})
         stage4_output_path = os.path.join(config['output_dir'], stage4_config.get('output_file'))
 
-        if not os.path.exists(stage4_output_path):
+        if not stage_exists(stage4_output_path):
             raise FileNotFoundError(f"Stage 4 output not found at {stage4_output_path}. Please run stage 4 first.")
 
-        print(f"Loading data from {stage4_output_path} for Stage 5...")
-        stage4_results = load_dataset(stage4_output_path)
-
+        print(f"Reading data from {stage4_output_path} for Stage 5...")
         discourse_file_path = config['filtering_stage_5']['discourse_file']
         if not os.path.exists(discourse_file_path):
              raise FileNotFoundError(f"Discourse file not found at {discourse_file_path}.")
-        print(f"Loading discourse units from {discourse_file_path}...")
-        discourse_data = load_dataset(discourse_file_path)
+        print(f"Reading discourse units from {discourse_file_path}...")
+        with open_stage(stage4_output_path) as stage4_results, JsonlReader(discourse_file_path) as discourse_data:
+            processor.run_filtering(stage4_results, discourse_data, resume=args.resume)
+
+def main():
+    parser = argparse.ArgumentParser(description="A multi-stage pipeline for generating and processing MCQA explanations.")
+    parser.add_argument('--config', type=str, required=True, help='Path to the task configuration file.')
+    parser.add_argument('--start_stage', type=int, default=1, help='Which stage to start from (1 to 5).')
+    parser.add_argument('--resume', action='store_true', help='Continue each stage from the last record already in its output file.')
+    parser.add_argument('--no_cache', action='store_true', help='Bypass the API response cache for this run.')
+    parser.add_argument('--stream', action='store_true', help='Pass each record through all stages as soon as it is ready, instead of running stage by stage.')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for Stages 4 and 5.')
+    parser.add_argument('--shard', type=str, default=None, help="Process only shard k of N ('k/N', 0-based), writing per-shard output files.")
+    parser.add_argument('--merge', type=int, default=None, metavar='N', help='Merge the per-shard outputs of N shards into the configured output files and exit.')
+    parser.add_argument('--export_jsonl', action='store_true', help='Write a JSONL copy of every Parquet stage output and exit.')
+
+    args = parser.parse_args()
 
-        processor.run_filtering(stage4_results, discourse_data)
+    # load config
+    with open(args.config, 'r') as f:
+        config = yaml.safe_load(f)
 
+    if args.no_cache:
+        config.setdefault('cache', {})['enabled'] = False
+
+    if args.export_jsonl:
+        for _, key, ensure_ascii in STAGES:
+            if key not in config:
+                continue
+            output_path = os.path.join(config['output_dir'], config[key]['output_file'])
+            if os.path.exists(parquet_path(output_path)):
+                print(f"Exported {export_jsonl(output_path, ensure_ascii=ensure_ascii)}")
+        return
+
+    if args.merge:
+        # Every record appears in exactly one shard, so the merged files must cover the full input
+        with JsonlReader(config['input_file']) as dataset:
+            total = len(dataset)
+        for _, key, ensure_ascii in STAGES:
+            if key not in config:
+                continue
+            output_path = os.path.join(config['output_dir'], config[key]['output_file'])
+            merge_shards(output_path, args.merge, expected_total=total, ensure_ascii=ensure_ascii, **stage_options(config))
+        print("All shards merged successfully.")
+        return
+
+    shard = parse_shard(args.shard) if args.shard else None
+    if shard:
+        print(f"Running shard {shard[0]} of {shard[1]}...")
+        for _, key, _ in STAGES:
+            if key in config:
+                config[key]['output_file'] = shard_output_path(config[key]['output_file'], shard)
+
+    telemetry = Telemetry(config, config['task_name'])
+    if shard:
+        telemetry.report_file = shard_output_path(telemetry.report_file, shard)
+        if telemetry.prometheus_file:
+            telemetry.prometheus_file = shard_output_path(telemetry.prometheus_file, shard)
+    gen = Generator(config, telemetry=telemetry)
+    processor = PostProcessor(config, workers=args.workers, telemetry=telemetry)
+
+    # The run report is written even if a stage fails, so the failed run can be inspected
+    try:
+        if args.stream:
+            StreamingPipeline(config, gen, processor).run(start_stage=args.start_stage, resume=args.resume, shard=shard)
+        else:
+            run_stages(args, config, gen, processor, shard)
+    finally:
+        telemetry.write_report()
     print("All tasks finished successfully.")
 
 if __name__ == '__main__':
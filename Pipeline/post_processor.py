@@ -1,132 +1,200 @@
-import json
+import re
+import itertools
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 import os
-from difflib import SequenceMatcher
+from discourse_matcher import DiscourseMatcher
+from stage_io import StageWriter
+from columnar import stage_options
+from shard_utils import global_index
+from telemetry import Telemetry
 
 class PostProcessor:
-    def __init__(self, config):
+    def __init__(self, config, workers=1, telemetry=None):
         self.config = config
         self.task_name = config['task_name']
+        self.telemetry = telemetry or Telemetry(config, self.task_name)
         self.standard_keys = config.get('post_processing_stage_4', {}).get('standard_keys', [])
+        # Stages 4 and 5 are per-record and CPU-bound, so they can be spread over a process pool
+        self.workers = workers
+        self.chunksize = config.get('worker_chunksize', 32)
+        self.dropped_keys = Counter()
 
-    def _normalize_single_dict(self, original_dict, original_data_record=None):
-        """Normalizes the keys of a single JSON object (dictionary)."""
-        key_map = {}
-        for i, key in enumerate(self.standard_keys):
-            key_map[key] = [f'({key})', f'{key}.', f'Option {key}']
+        # Task-static key variations are compiled once; only answer texts vary per record.
+        # One alternation over all keys would need a lookahead at every position to keep key priority, and
+        # recompiling per record to include the answers; both measured slower than these per-key searches.
+        self._key_patterns = []
+        for key in self.standard_keys:
+            variations = [f'({key})', f'{key}.', f'Option {key}']
             if self.task_name == 'VariErrNLI':
                 conditions = {'A': 'entailment', 'B': 'neutral', 'C': 'contradiction'}
                 if key in conditions:
-                    key_map[key].append(conditions[key])
-            elif (self.task_name in ['SocialIQA', 'CommonsenseQA']) and original_data_record:
-                answer_key = f'answer{key.upper()}' # CQA uses answerA, answerB...
-                if answer_key in original_data_record:
-                    key_map[key].append(original_data_record[answer_key].lower())
+                    variations.append(conditions[key])
+            pattern = re.compile('|'.join(re.escape(var.lower()) for var in variations))
+            self._key_patterns.append((key, pattern, f'answer{key.upper()}'))
 
-        normalized_dict = {}
+    def __getstate__(self):
+        # Pool workers get a pickled copy; telemetry holds a lock and is only updated in the main process
+        state = self.__dict__.copy()
+        state['telemetry'] = None
+        return state
+
+    def _map_records(self, func, tasks):
+        """Yields func(record, extra) for each (record, extra) task in order, using a process pool when workers > 1."""
+        if self.workers <= 1:
+            for record, extra in tasks:
+                yield func(record, extra)
+            return
+
+        # Submit bounded windows so only a few chunks per worker are held in memory at once
+        window = self.workers * self.chunksize * 4
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                batch = list(itertools.islice(tasks, window))
+                if not batch:
+                    break
+                batch_records, batch_extras = zip(*batch)
+                yield from executor.map(func, batch_records, batch_extras, chunksize=self.chunksize)
+
+    def _normalize_single_dict(self, original_dict, original_data_record=None):
+        """Normalizes the keys of a single JSON object; returns it with the list of dropped keys."""
         if not isinstance(original_dict, dict):
-            return {}
-            
+            return {}, []
+
+        # Answer texts (CQA uses answerA, answerB...) are the only per-record variations
+        use_answers = self.task_name in ['SocialIQA', 'CommonsenseQA'] and bool(original_data_record)
+        answers = [
+            original_data_record[answer_key].lower() if use_answers and answer_key in original_data_record else None
+            for _, _, answer_key in self._key_patterns
+        ]
+        # Fallback for keys that match nothing: a missing answer field reads as '', which matches any key
+        fallback_key = None
+        if use_answers:
+            fallback_key = next(
+                (key for key, _, answer_key in self._key_patterns if answer_key not in original_data_record), None
+            )
+
+        normalized_dict = {}
+        dropped = []
         for original_key, value in original_dict.items():
-            found = False
-            for std_key, variations in key_map.items():
-                if any(var.lower() in original_key.lower() for var in variations):
-                    normalized_dict[std_key] = value
-                    found = True
-                    break
-            if not found:
-                # Fallback for keys that don't match standard patterns but might contain the answer text
-                if (self.task_name in ['SocialIQA', 'CommonsenseQA']) and original_data_record:
-                     for std_key in self.standard_keys:
-                         ans_key = f'answer{std_key.upper()}'
-                         if original_data_record.get(ans_key, '').lower() in original_key.lower():
-                             normalized_dict[std_key] = value
-                             found = True
-                             break
-                if not found:
-                    print(f"Warning: Could not normalize key '{original_key}'. It will be dropped.")
-
-        return normalized_dict
-
-    def run_normalization(self, structured_data, original_data):
+            original_key_lower = original_key.lower()
+            std_key = next(
+                (key for (key, pattern, _), answer in zip(self._key_patterns, answers)
+                 if pattern.search(original_key_lower) or (answer is not None and answer in original_key_lower)),
+                fallback_key
+            )
+            if std_key is None:
+                dropped.append(original_key)
+            else:
+                normalized_dict[std_key] = value
+        return normalized_dict, dropped
+
+    def _normalize_item(self, item, original_data_record=None):
+        """Runs Stage 4 for a single record; returns the record and the keys that were dropped."""
+        dropped = []
+        if 'structured_evidence' in item:
+            item['normalized_evidence'], dropped = self._normalize_single_dict(item['structured_evidence'], original_data_record)
+        item.pop('structured_evidence', None)
+        return item, dropped
+
+    def report_dropped_keys(self):
+        """Prints one summary of the keys that could not be normalized, instead of a line per key."""
+        total = sum(self.dropped_keys.values())
+        if total:
+            examples = ", ".join(f"'{key}' ({count}x)" for key, count in self.dropped_keys.most_common(5))
+            print(f"Warning: {total} keys could not be normalized and were dropped. Most common: {examples}")
+        self.dropped_keys.clear()
+
+    def run_normalization(self, structured_data, original_data, resume=False):
         """Runs Stage 4: Normalization of JSON keys."""
         print("\nRunning Normalization Stage 4...")
-        original_data_map = {i: item for i, item in enumerate(original_data)}
-        
-        normalized_results = []
-        for i, item in tqdm(enumerate(structured_data), total=len(structured_data), desc=self.task_name + " Stage 4"):
-            if 'structured_evidence' in item:
-                normalized_evidence = self._normalize_single_dict(item['structured_evidence'], original_data_map.get(i))
-                item['normalized_evidence'] = normalized_evidence
-            item.pop('structured_evidence', None)
-            normalized_results.append(item)
 
         output_config = self.config['post_processing_stage_4']
         output_file = os.path.join(self.config['output_dir'], output_config['output_file'])
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for res in normalized_results:
-                f.write(json.dumps(res, ensure_ascii=False) + '\n')
-        
+        with StageWriter(output_file, resume=resume, ensure_ascii=False, **stage_options(self.config)) as writer:
+            if writer.completed:
+                print(f"Resuming: {writer.completed} records already in {output_file}.")
+            def tasks():
+                # Join on the record's global index, which differs from its position in sharded runs
+                for i in range(writer.completed, len(structured_data)):
+                    item = structured_data[i]
+                    index = global_index(item, i)
+                    yield item, original_data[index] if index < len(original_data) else None
+
+            results = self._map_records(self._normalize_item, tasks())
+            total = len(structured_data) - writer.completed
+            with self.telemetry.stage(self.task_name + " Stage 4") as stage:
+                for item, dropped in tqdm(results, total=total, desc=self.task_name + " Stage 4"):
+                    self.dropped_keys.update(dropped)
+                    writer.write(item)
+                    stage.items += 1
+        self.report_dropped_keys()
+
         print(f"Stage 4 normalized results saved to {output_file}")
-        return normalized_results
+        return output_file
 
     def _find_best_match(self, check_snt, discourse_units):
         """Finds the best matching sentence in discourse units using SequenceMatcher."""
-        if not discourse_units or not check_snt:
-            return None
-        best_score = 0
-        output_match_snt = None
-        for unit in discourse_units:
-            matcher = SequenceMatcher(None, check_snt, unit)
-            ratio = matcher.ratio()
-            if ratio > best_score and ratio > 0.6: # Similarity threshold
-                best_score = ratio
-                output_match_snt = unit
-        return output_match_snt
+        return DiscourseMatcher(discourse_units).best_match(check_snt)
 
     def _filter_dict_with_discourse_units(self, normalized_dict, discourse_units):
         """Filters a single normalized dictionary using discourse units."""
         filtered_dict = {}
         if not normalized_dict or not isinstance(normalized_dict, dict):
             return filtered_dict
-            
+
+        # Shared across all sentences of the record so per-unit matcher state is reused
+        matcher = DiscourseMatcher(discourse_units)
         for key, value in normalized_dict.items():
             filtered_dict[key] = {'support': [], 'oppose': []}
             if isinstance(value, dict):
                 for sentiment in ['support', 'oppose']:
                     if value.get(sentiment) and isinstance(value[sentiment], list):
                         for sentence in value[sentiment]:
-                            best_match = self._find_best_match(sentence, discourse_units)
+                            best_match = matcher.best_match(sentence)
                             if best_match:
                                 filtered_dict[key][sentiment].append(best_match)
         return filtered_dict
 
-    def run_filtering(self, normalized_data, discourse_data):
+    def _filter_item(self, item, discourse_record=None):
+        """Runs Stage 5 for a single record."""
+        normalized_evidence = item.get('normalized_evidence')
+        if discourse_record is not None:
+            segments = discourse_record.get('segments', [])
+            connectives = discourse_record.get('connectives', [])
+            # De-duplicated in first-seen order (not set order), so results don't depend on the hash seed
+            union_units = list(dict.fromkeys(segments + connectives))
+
+            filtered_evidence = self._filter_dict_with_discourse_units(normalized_evidence, union_units)
+            item['filtered_evidence'] = filtered_evidence
+        else:
+            item['filtered_evidence'] = {} # No discourse data available for this item
+
+        item.pop('normalized_evidence', None)
+        return item
+
+    def run_filtering(self, normalized_data, discourse_data, resume=False):
         """Runs Stage 5: Filtering evidence against discourse units."""
         print("\nRunning Filtering Stage 5...")
-        
-        filtered_results = []
-        for i, item in tqdm(enumerate(normalized_data), total=len(normalized_data), desc=self.task_name + " Stage 5"):
-            normalized_evidence = item.get('normalized_evidence')
-            if i < len(discourse_data):
-                discourse_record = discourse_data[i]
-                segments = discourse_record.get('segments', [])
-                connectives = discourse_record.get('connectives', [])
-                union_units = list(set(segments) | set(connectives))
-                
-                filtered_evidence = self._filter_dict_with_discourse_units(normalized_evidence, union_units)
-                item['filtered_evidence'] = filtered_evidence
-            else:
-                item['filtered_evidence'] = {} # No discourse data available for this item
-
-            item.pop('normalized_evidence', None)
-            filtered_results.append(item)
 
         output_config = self.config['filtering_stage_5']
         output_file = os.path.join(self.config['output_dir'], output_config['output_file'])
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for res in filtered_results:
-                f.write(json.dumps(res, ensure_ascii=False) + '\n')
-        
+        with StageWriter(output_file, resume=resume, ensure_ascii=False, **stage_options(self.config)) as writer:
+            if writer.completed:
+                print(f"Resuming: {writer.completed} records already in {output_file}.")
+            def tasks():
+                for i in range(writer.completed, len(normalized_data)):
+                    item = normalized_data[i]
+                    index = global_index(item, i)
+                    yield item, discourse_data[index] if index < len(discourse_data) else None
+
+            results = self._map_records(self._filter_item, tasks())
+            total = len(normalized_data) - writer.completed
+            with self.telemetry.stage(self.task_name + " Stage 5") as stage:
+                for item in tqdm(results, total=total, desc=self.task_name + " Stage 5"):
+                    writer.write(item)
+                    stage.items += 1
+
         print(f"Stage 5 filtered results saved to {output_file}")
-        return filtered_results
\ No newline at end of file
+        return output_file
@@ -30,21 +30,38 @@ Answer:""",
 {reasoning}
 Please extract and list all the sentences from the aforementioned reasoning process that support each option separately.""",
 
+    # --- Fused Stage 2 Prompt (structuring_stage_3 mode "fused") ---
+    "s2_structured_extraction_prompt": """The content of your reasoning process is below:
+{reasoning}
+Please extract and list all the sentences from the aforementioned reasoning process that support or oppose each option separately. Output only a JSON object in which each option has two keys: support and oppose. Each key should map to a list of sentences from the reasoning process that either support or oppose that option.
+
+EXAMPLE JSON OUTPUT:
+{{
+  "Option A": {{
+    "support": ["SentenceA.1","SentenceA.2"],
+    "oppose": ["SentenceA.3"]
+  }},
+  "Option B": {{
+    "support": ["SentenceB.1"],
+    "oppose": []
+  }}
+}}""",
+
     # --- Stage 3 Prompt ---
     "markdown_to_structured_json": """
     Convert the given markdown into a structured JSON where each option has two keys: support and oppose. Each key should map to a list of statements from the markdown that either support or oppose that option.
 
     EXAMPLE JSON OUTPUT:
-    {
-      "Option A": {
+    {{
+      "Option A": {{
         "support": ["SentenceA.1","SentenceA.2"],
         "oppose": ["SentenceA.3"]
-      },
-      "Option B": {
+      }},
+      "Option B": {{
         "support": ["SentenceB.1"],
         "oppose": []
-      }
-    }
+      }}
+    }}
     """
 }
 
@@ -0,0 +1,123 @@
+import time
+import random
+import asyncio
+import email.utils
+import json
+import openai
+
+# HTTP status codes worth retrying; everything else (400, 401, 403, 404, 422, ...) is fatal
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+def is_retryable(error):
+    """Splits API errors into retryable (transient, rate limits, bad JSON output) and fatal ones."""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, json.JSONDecodeError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+def is_rate_limited(error):
+    return isinstance(error, openai.APIStatusError) and error.status_code == 429
+
+def retry_after_seconds(error):
+    """Reads the server's Retry-After hint (seconds or HTTP date) from an API error, if present."""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get('retry-after-ms'):
+        try:
+            return float(headers['retry-after-ms']) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+def backoff_delay(attempt, base_delay, max_delay, retry_after=None):
+    """Exponential backoff with full jitter, never shorter than the server's Retry-After."""
+    delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`; reservations may go into debt."""
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Takes `amount` tokens and returns how many seconds the caller must wait before using them."""
+        self._refill()
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def adjust(self, amount):
+        """Returns (positive) or takes (negative) tokens after the real usage is known."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+class ModelRateLimiter:
+    """Per-model requests/tokens-per-minute budgets plus an adaptive (AIMD) concurrency limit."""
+    def __init__(self, rpm=None, tpm=None, max_in_flight=8, initial_in_flight=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_in_flight = max_in_flight
+        self.limit = float(initial_in_flight or max(1, max_in_flight // 4))
+        self.blocked_until = 0.0
+        self.in_flight = 0
+        self._condition = None
+
+    def reserve(self, estimated_tokens):
+        """Reserves one request and `estimated_tokens`; returns the required wait in seconds."""
+        wait = max(0.0, self.blocked_until - time.monotonic())
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        if self.tokens and actual_tokens is not None:
+            self.tokens.adjust(estimated_tokens - actual_tokens)
+
+    def on_success(self):
+        # Additive increase: roughly +1 slot per `limit` successful requests
+        self.limit = min(self.max_in_flight, self.limit + 1.0 / self.limit)
+
+    def on_rate_limited(self, retry_after=None):
+        # Multiplicative decrease, and pause every request to this model for the Retry-After period
+        self.limit = max(1.0, self.limit / 2)
+        if retry_after:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+    def reset_async_state(self):
+        """Drops loop-bound state so the limiter can be reused by a new event loop."""
+        self._condition = None
+        self.in_flight = 0
+
+    async def acquire(self):
+        """Waits for a free concurrency slot under the current adaptive limit."""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
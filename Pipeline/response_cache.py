@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+class ResponseCache:
+    """Persistent, content-addressed cache of API responses stored in SQLite."""
+    def __init__(self, path, max_size_mb=None, max_age_days=None):
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(**request):
+        """Hashes the request fields into a stable cache key."""
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the cached value for `key`, or None on a miss."""
+        row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return json.loads(row[0])
+
+    def contains(self, key):
+        """Checks for `key` without touching the hit/miss counters."""
+        return self.conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def set(self, key, value):
+        """Stores a JSON-serializable value under `key`."""
+        data = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+            (key, data, len(data.encode('utf-8')), now, now)
+        )
+        self.conn.commit()
+
+    def evict(self):
+        """Removes entries older than max_age_days, then least recently used ones above max_size_mb."""
+        removed = 0
+        if self.max_age_seconds:
+            cursor = self.conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+            )
+            removed += cursor.rowcount
+        if self.max_size_bytes:
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            excess = total - self.max_size_bytes
+            if excess > 0:
+                stale_keys = []
+                for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+                    if excess <= 0:
+                        break
+                    stale_keys.append((key,))
+                    excess -= size
+                self.conn.executemany("DELETE FROM responses WHERE key = ?", stale_keys)
+                removed += len(stale_keys)
+        self.conn.commit()
+        return removed
+
+    def report(self, label):
+        """Prints and resets the hit/miss counters."""
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        print(f"{label} cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)")
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,83 @@
+import os
+import heapq
+from columnar import stage_exists, open_stage
+from stage_io import StageWriter
+
+INDEX_FIELD = 'global_index'
+
+def parse_shard(spec):
+    """Parses a 'k/N' shard spec (0 <= k < N) into (k, N)."""
+    try:
+        k, n = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError(f"Invalid shard spec '{spec}'. Expected 'k/N', e.g. '0/4'.")
+    if n < 1 or not 0 <= k < n:
+        raise ValueError(f"Invalid shard spec '{spec}'. Shard k must satisfy 0 <= k < N.")
+    return k, n
+
+def shard_output_path(path, shard):
+    """Returns the per-shard variant of an output path, e.g. out.jsonl -> out.shard-0-of-4.jsonl."""
+    k, n = shard
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard-{k}-of-{n}{ext}"
+
+class ShardedRecords:
+    """Stable subset of a dataset: every record whose global index i satisfies i % N == k."""
+    # Each record is tagged with its position in the full dataset, so later stages join on it
+    def __init__(self, records, shard):
+        self.records = records
+        self.k, self.n = shard
+
+    def __len__(self):
+        return max(0, (len(self.records) - self.k + self.n - 1) // self.n)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        global_index = self.k + i * self.n
+        record = self.records[global_index]
+        record[INDEX_FIELD] = global_index
+        return record
+
+    def __iter__(self):
+        for global_index, record in enumerate(self.records):
+            if global_index % self.n == self.k:
+                record[INDEX_FIELD] = global_index
+                yield record
+
+def global_index(record, position):
+    """Returns the record's global index, falling back to its position for unsharded files."""
+    return record.get(INDEX_FIELD, position)
+
+def merge_shards(output_path, num_shards, expected_total=None, ensure_ascii=True, stage_format='jsonl', keep_jsonl=False):
+    """Merges per-shard files into `output_path` in global-index order, verifying completeness."""
+    # Shard files are already sorted by global index, so a streaming k-way merge is enough.
+    # The index field is dropped, so the merged file matches an unsharded run.
+    shard_paths = [shard_output_path(output_path, (k, num_shards)) for k in range(num_shards)]
+    missing_files = [path for path in shard_paths if not stage_exists(path)]
+    if missing_files:
+        raise FileNotFoundError(f"Missing shard outputs: {', '.join(missing_files)}")
+
+    def keyed(path):
+        for position, record in enumerate(open_stage(path)):
+            if INDEX_FIELD not in record:
+                raise ValueError(f"Record {position} in {path} has no '{INDEX_FIELD}'.")
+            yield record[INDEX_FIELD], record
+
+    expected_index = 0
+    with StageWriter(output_path, ensure_ascii=ensure_ascii, stage_format=stage_format, keep_jsonl=keep_jsonl) as writer:
+        for index, record in heapq.merge(*(keyed(path) for path in shard_paths), key=lambda pair: pair[0]):
+            if index < expected_index:
+                raise ValueError(f"Duplicate record with global index {index} while merging {output_path}.")
+            if index > expected_index:
+                raise ValueError(f"Missing record with global index {expected_index} while merging {output_path}.")
+            record.pop(INDEX_FIELD)
+            writer.write(record)
+            expected_index += 1
+
+    if expected_total is not None and expected_index != expected_total:
+        raise ValueError(f"Merged {expected_index} records into {output_path}, expected {expected_total}.")
+    print(f"Merged {num_shards} shards ({expected_index} records) into {output_path}")
+    return expected_index
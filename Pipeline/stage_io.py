@@ -0,0 +1,84 @@
+import os
+import json
+from columnar import STAGE_FORMATS, require_pyarrow, parquet_path, compact_stage, export_jsonl
+
+def count_completed_records(file_path):
+    """Counts complete JSON records in a stage output file, truncating a partially written last line."""
+    if not os.path.exists(file_path):
+        return 0
+    completed = 0
+    valid_end = 0
+    with open(file_path, 'rb+') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                json.loads(line)
+            except json.JSONDecodeError:
+                break
+            completed += 1
+            valid_end += len(line)
+        f.truncate(valid_end)
+    return completed
+
+class StageWriter:
+    """Appends stage records to a JSONL file and flushes after every record.
+
+    With stage_format 'parquet', the finished file is compacted to Parquet when the writer's
+    `with` block exits without an error; the JSONL file is kept only with `keep_jsonl`.
+    """
+    def __init__(self, output_file, resume=False, ensure_ascii=True, stage_format='jsonl', keep_jsonl=False):
+        if stage_format not in STAGE_FORMATS:
+            raise ValueError(f"Unknown stage_format '{stage_format}'. Expected one of {STAGE_FORMATS}.")
+        if stage_format == 'parquet':
+            require_pyarrow()
+        self.output_file = output_file
+        self.ensure_ascii = ensure_ascii
+        self.stage_format = stage_format
+        self.keep_jsonl = keep_jsonl
+
+        # Records are always appended to JSONL; a compacted file from an earlier run is turned back into it
+        compacted = parquet_path(output_file)
+        if os.path.exists(compacted):
+            if resume and not os.path.exists(output_file):
+                export_jsonl(output_file, ensure_ascii=ensure_ascii)
+            os.remove(compacted)
+        self.completed = count_completed_records(output_file) if resume else 0
+        self.next_index = self.completed
+        self._pending = {}
+        self._file = open(output_file, 'a' if resume else 'w', encoding='utf-8')
+
+    def _write_line(self, line):
+        self._file.write(line + '\n')
+        self._file.flush()
+        self.next_index += 1
+
+    def write(self, record):
+        """Writes the next record and flushes it to disk."""
+        self._write_line(json.dumps(record, ensure_ascii=self.ensure_ascii))
+
+    def write_at(self, index, record):
+        """Buffers a record finished out of order and writes every record that is now in sequence."""
+        # Serialize right away: later stages may keep mutating the same dict
+        self._pending[index] = json.dumps(record, ensure_ascii=self.ensure_ascii)
+        while self.next_index in self._pending:
+            self._write_line(self._pending.pop(self.next_index))
+
+    def close(self):
+        if self._pending:
+            print(f"Warning: {len(self._pending)} out-of-order records were not written to {self.output_file}.")
+        self._file.close()
+
+    def compact(self):
+        """Converts the finished output to the configured stage format."""
+        if self.stage_format == 'parquet':
+            compacted = compact_stage(self.output_file, ensure_ascii=self.ensure_ascii, keep_jsonl=self.keep_jsonl)
+            print(f"Compacted {self.output_file} into {compacted}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if exc_type is None and not self._pending:
+            self.compact()
@@ -0,0 +1,155 @@
+import os
+from tqdm import tqdm
+from data_loader import JsonlReader
+from stage_io import StageWriter
+from columnar import stage_options, stage_exists, open_stage
+from shard_utils import ShardedRecords, global_index
+
+# (stage number, config key, output ensure_ascii) in pipeline order
+STAGES = [
+    (2, 'generation_stage_1_and_2', True),
+    (3, 'structuring_stage_3', False),
+    (4, 'post_processing_stage_4', False),
+    (5, 'filtering_stage_5', False),
+]
+
+class StreamingPipeline:
+    """Chains the configured stages per record, so each record moves to the next stage as soon as it is ready."""
+    def __init__(self, config, generator, processor):
+        self.config = config
+        self.task_name = config['task_name']
+        self.gen = generator
+        self.processor = processor
+        self.writers = {}
+        self.original_data = []
+        self.discourse_data = []
+
+    def _stage_output_path(self, config_key):
+        return os.path.join(self.config['output_dir'], self.config[config_key]['output_file'])
+
+    def _records(self, stages, source):
+        """Yields (index, record, stages still to run) for every unfinished record."""
+        stage_nums = [num for num, _, _ in stages]
+        last_writer = self.writers[stage_nums[-1]]
+        # On resume, a record continues from the latest stage output that already contains it
+        saved = {
+            num: iter(JsonlReader(self.writers[num].output_file))
+            for num in stage_nums if self.writers[num].completed
+        }
+        for i, record in enumerate(source):
+            remaining = stage_nums
+            for pos, num in enumerate(stage_nums):
+                if i < self.writers[num].completed:
+                    record = next(saved[num])
+                    remaining = stage_nums[pos + 1:]
+            if i < last_writer.completed:
+                continue
+            yield i, record, remaining
+
+    def _run_cpu_stage(self, num, record, position):
+        # Originals and discourse units are joined on the global index, which differs from position in sharded runs
+        index = global_index(record, position)
+        if num == 4:
+            original = self.original_data[index] if index < len(self.original_data) else None
+            record, dropped = self.processor._normalize_item(record, original)
+            self.processor.dropped_keys.update(dropped)
+            return record
+        discourse_record = self.discourse_data[index] if index < len(self.discourse_data) else None
+        return self.processor._filter_item(record, discourse_record)
+
+    def _process(self, task):
+        """Runs every remaining stage for one record, writing each stage's output as it goes."""
+        index, record, remaining = task
+        for num in remaining:
+            if num == 2:
+                record = self.gen._generate_item_s12(record)
+            elif num == 3:
+                record = self.gen._structure_item(record)
+            else:
+                record = self._run_cpu_stage(num, record, index)
+            self.writers[num].write_at(index, record)
+        return record
+
+    async def _aprocess(self, task):
+        """Async counterpart of _process; the final stage is written by Generator._run_items_async."""
+        index, record, remaining = task
+        for num in remaining:
+            if num == 2:
+                record = await self.gen._agenerate_item_s12(record)
+            elif num == 3:
+                record = await self.gen._astructure_item(record)
+            else:
+                record = self._run_cpu_stage(num, record, index)
+            if num != remaining[-1]:
+                self.writers[num].write_at(index, record)
+        return record
+
+    def run(self, start_stage=1, resume=False, shard=None):
+        """Runs every configured stage from `start_stage` on in a single streaming pass."""
+        stages = [stage for stage in STAGES if stage[1] in self.config and start_stage <= stage[0]]
+        if not stages:
+            return
+        print(f"\nRunning stages {', '.join(str(num) for num, _, _ in stages)} in streaming mode...")
+
+        # The first stage reads the previous stage's output, or the input file for Stages 1&2
+        first_num = stages[0][0]
+        if first_num == 2:
+            source_path = self.config['input_file']
+            readers = [JsonlReader(source_path)]
+            source = ShardedRecords(readers[0], shard) if shard else readers[0]
+        else:
+            previous_key = next(key for num, key, _ in STAGES if num == first_num - 1)
+            source_path = self._stage_output_path(previous_key)
+            if not stage_exists(source_path):
+                raise FileNotFoundError(f"Stage {first_num - 1} output not found at {source_path}.")
+            readers = [open_stage(source_path)]
+            source = readers[0]
+
+        if any(num == 3 for num, _, _ in stages) and self.config['structuring_stage_3'].get('mode') == 'batch':
+            print("Note: Stage 3 batch mode is not available when streaming; records are structured online.")
+
+        if any(num == 4 for num, _, _ in stages):
+            self.original_data = JsonlReader(self.config['input_file'])
+            readers.append(self.original_data)
+        if any(num == 5 for num, _, _ in stages):
+            discourse_file_path = self.config['filtering_stage_5']['discourse_file']
+            if not os.path.exists(discourse_file_path):
+                raise FileNotFoundError(f"Discourse file not found at {discourse_file_path}.")
+            print(f"Reading discourse units from {discourse_file_path}...")
+            self.discourse_data = JsonlReader(discourse_file_path)
+            readers.append(self.discourse_data)
+
+        self.writers = {
+            num: StageWriter(self._stage_output_path(key), resume=resume, ensure_ascii=ensure_ascii, **stage_options(self.config))
+            for num, key, ensure_ascii in stages
+        }
+        last_writer = self.writers[stages[-1][0]]
+        try:
+            if last_writer.completed:
+                print(f"Resuming: {last_writer.completed} records already in {last_writer.output_file}.")
+            tasks = self._records(stages, source)
+            desc = self.task_name + " Streaming"
+            with self.gen.telemetry.stage(desc) as stage:
+                if self.gen.async_mode:
+                    self.gen._run_items_async(self._aprocess, tasks, desc, last_writer)
+                else:
+                    for task in tqdm(tasks, desc=desc):
+                        self._process(task)
+                stage.items += last_writer.next_index - last_writer.completed
+        finally:
+            for writer in self.writers.values():
+                writer.close()
+            # Random access keeps each reader's file mapped until it is closed
+            for reader in readers:
+                reader.close()
+        # Only reached when every stage finished, so the outputs are complete
+        for writer in self.writers.values():
+            writer.compact()
+
+        self.gen.report_fused_fallbacks()
+        self.processor.report_dropped_keys()
+        if self.gen.cache:
+            self.gen.cache.report(self.task_name + " Streaming")
+            self.gen.cache.evict()
+        for writer in self.writers.values():
+            print(f"Stage output saved to {writer.output_file}")
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import math
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets in the Prometheus textfile
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+PERCENTILES = [50, 95, 99]
+METRIC_PREFIX = 'hlv_'
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def label_value(value):
+    """Escapes a Prometheus label value."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class StageStats:
+    """Wall time and item count of one stage; `items` is set by the stage as it writes records."""
+    def __init__(self):
+        self.seconds = 0.0
+        self.items = 0
+
+class CallStats:
+    """Per-model API call counters, latencies and token usage."""
+    def __init__(self):
+        self.latencies = []
+        self.cache_hits = 0
+        self.retries = 0
+        self.failures = 0
+        self.tokens = {'prompt': 0, 'completion': 0, 'reasoning': 0}
+
+class Telemetry:
+    """Collects stage timings, API call latencies, retries and token usage, and writes the run report."""
+    def __init__(self, config, run_name):
+        telemetry_config = config.get('telemetry', {})
+        self.enabled = telemetry_config.get('enabled', False)
+        self.run_name = run_name
+        self.report_file = os.path.join(
+            config['output_dir'], telemetry_config.get('report_file', f"{run_name}_run_report.json")
+        )
+        self.prometheus_file = telemetry_config.get('prometheus_file')
+        self.started_at = time.time()
+        self.stages = {}
+        self.calls = {}
+        self.timings = {}
+        # Backends record calls from worker threads
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """Times a stage; repeated stages with the same name add up."""
+        stats = self.stages.setdefault(name, StageStats())
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.seconds += time.perf_counter() - start
+
+    def _calls(self, model):
+        return self.calls.setdefault(model, CallStats())
+
+    def record_call(self, model, seconds, usage=None):
+        """Records one successful API call with its latency and the response's `usage` object."""
+        with self._lock:
+            self._calls(model).latencies.append(seconds)
+        if usage is not None:
+            details = getattr(usage, 'completion_tokens_details', None)
+            self.record_tokens(
+                model, getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None),
+                getattr(details, 'reasoning_tokens', None)
+            )
+
+    def record_tokens(self, model, prompt=None, completion=None, reasoning=None):
+        """Adds token counts reported by the server; missing counts are skipped."""
+        with self._lock:
+            tokens = self._calls(model).tokens
+            tokens['prompt'] += prompt or 0
+            tokens['completion'] += completion or 0
+            tokens['reasoning'] += reasoning or 0
+
+    def record_cache_hit(self, model):
+        with self._lock:
+            self._calls(model).cache_hits += 1
+
+    def record_retry(self, model):
+        with self._lock:
+            self._calls(model).retries += 1
+
+    def record_failure(self, model):
+        """Records a call that failed for good (fatal error or retries exhausted)."""
+        with self._lock:
+            self._calls(model).failures += 1
+
+    def record_timing(self, name, seconds, tokens=0):
+        """Adds to a named phase timer, e.g. the judge's prefill and decode time."""
+        with self._lock:
+            timing = self.timings.setdefault(name, {'seconds': 0.0, 'count': 0, 'tokens': 0})
+            timing['seconds'] += seconds
+            timing['count'] += 1
+            timing['tokens'] += tokens
+
+    def report(self):
+        """Builds the run report as a JSON-serializable dict."""
+        stages = {
+            name: {
+                'wall_seconds': round(stats.seconds, 3),
+                'items': stats.items,
+                'items_per_second': round(stats.items / stats.seconds, 3) if stats.seconds else None,
+            }
+            for name, stats in self.stages.items()
+        }
+        calls = {}
+        for model, stats in self.calls.items():
+            latencies = sorted(stats.latencies)
+            calls[model] = {
+                'calls': len(latencies),
+                'cache_hits': stats.cache_hits,
+                'retries': stats.retries,
+                'failures': stats.failures,
+                'latency_seconds': {
+                    **{f'p{q}': percentile(latencies, q) for q in PERCENTILES},
+                    'mean': sum(latencies) / len(latencies) if latencies else None,
+                    'max': latencies[-1] if latencies else None,
+                },
+                'tokens': dict(stats.tokens),
+            }
+        timings = {
+            name: {**timing, 'tokens_per_second': round(timing['tokens'] / timing['seconds'], 3) if timing['seconds'] else None}
+            for name, timing in self.timings.items()
+        }
+        return {
+            'run': self.run_name,
+            'started_at': self.started_at,
+            'wall_seconds': round(time.time() - self.started_at, 3),
+            'stages': stages,
+            'calls': calls,
+            'timings': timings,
+        }
+
+    def _prometheus_lines(self, report):
+        run = f'run="{label_value(self.run_name)}"'
+        lines = [
+            f'# TYPE {METRIC_PREFIX}run_wall_seconds gauge',
+            f'{METRIC_PREFIX}run_wall_seconds{{{run}}} {report["wall_seconds"]}',
+        ]
+        # Samples of one metric family must form a single group
+        for metric in ['wall_seconds', 'items']:
+            lines.append(f'# TYPE {METRIC_PREFIX}stage_{metric} gauge')
+            for name, stage in report['stages'].items():
+                lines.append(f'{METRIC_PREFIX}stage_{metric}{{{run},stage="{label_value(name)}"}} {stage[metric]}')
+
+        lines.append(f'# TYPE {METRIC_PREFIX}api_call_latency_seconds histogram')
+        for model, stats in self.calls.items():
+            labels = f'{run},model="{label_value(model)}"'
+            for bound in LATENCY_BUCKETS:
+                count = sum(1 for latency in stats.latencies if latency <= bound)
+                lines.append(f'{METRIC_PREFIX}api_call_latency_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{METRIC_PREFIX}api_call_latency_seconds_bucket{{{labels},le="+Inf"}} {len(stats.latencies)}')
+            lines.append(f'{METRIC_PREFIX}api_call_latency_seconds_sum{{{labels}}} {sum(stats.latencies)}')
+            lines.append(f'{METRIC_PREFIX}api_call_latency_seconds_count{{{labels}}} {len(stats.latencies)}')
+        for metric, field in [('api_cache_hits', 'cache_hits'), ('api_retries', 'retries'), ('api_failures', 'failures')]:
+            lines.append(f'# TYPE {METRIC_PREFIX}{metric}_total counter')
+            for model, stats in self.calls.items():
+                lines.append(f'{METRIC_PREFIX}{metric}_total{{{run},model="{label_value(model)}"}} {getattr(stats, field)}')
+        lines.append(f'# TYPE {METRIC_PREFIX}tokens_total counter')
+        for model, stats in self.calls.items():
+            for kind, count in stats.tokens.items():
+                lines.append(f'{METRIC_PREFIX}tokens_total{{{run},model="{label_value(model)}",type="{kind}"}} {count}')
+
+        lines.append(f'# TYPE {METRIC_PREFIX}phase_seconds gauge')
+        for name, timing in report['timings'].items():
+            lines.append(f'{METRIC_PREFIX}phase_seconds{{{run},phase="{label_value(name)}"}} {timing["seconds"]}')
+        return lines
+
+    def write_report(self):
+        """Writes the JSON run report and, if configured, the Prometheus textfile (both atomically)."""
+        if not self.enabled:
+            return
+        report = self.report()
+        outputs = [(self.report_file, json.dumps(report, indent=2))]
+        if self.prometheus_file:
+            outputs.append((self.prometheus_file, '\n'.join(self._prometheus_lines(report)) + '\n'))
+        for path, content in outputs:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # node_exporter's textfile collector must never see a half-written file
+            temp_path = path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        print(f"Run report saved to {self.report_file}")
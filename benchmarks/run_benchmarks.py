@@ -0,0 +1,249 @@
+import os
+import sys
+import copy
+import json
+import shutil
+import filecmp
+import argparse
+import subprocess
+import yaml
+from synthetic import TASKS, write_task_files
+from stub_server import start_server
+from tiny_model import build_tiny_model, MODEL_SIZES
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PIPELINE_DIR = os.path.join(REPO_DIR, 'Pipeline')
+EVALUATION_DIR = os.path.join(REPO_DIR, 'Evaluation')
+# Stages that finish faster than this are reported but too noisy to compare against the baseline
+MIN_WALL_SECONDS = 0.5
+
+def load_yaml(path):
+    with open(path, 'r') as f:
+        return yaml.safe_load(f)
+
+def write_yaml(path, config):
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+    return path
+
+# --- Configs ---
+def pipeline_config(task, paths, run_dir, base_url, args):
+    """The task's shipped Pipeline config, pointed at the synthetic data and the stub server."""
+    config = load_yaml(os.path.join(PIPELINE_DIR, 'configs', TASKS[task][0]))
+    config.update({
+        'input_file': paths['dataset'], 'output_dir': run_dir, 'base_url': base_url, 'api_key': 'stub',
+        'async_mode': True, 'stage_format': args.stage_format,
+        'cache': {'enabled': False},
+        'telemetry': {'enabled': True, 'report_file': 'pipeline_run_report.json'},
+        # Backoff stays short so injected errors do not dominate the timings; provider rate limits do not apply
+        'retry': {'max_retries': 8, 'base_delay': 0.05, 'max_delay': 1.0},
+    })
+    config.pop('rate_limits', None)
+    if args.max_in_flight:
+        config['max_in_flight'] = {model: args.max_in_flight for model in config.get('max_in_flight', {})}
+    # The stub finishes a batch after one status poll, so polling can be fast
+    config['structuring_stage_3'].update({'mode': args.stage3_mode, 'poll_interval': 0.1})
+    config['filtering_stage_5']['discourse_file'] = paths['discourse']
+    return config
+
+def with_suffix(filename, suffix):
+    name, ext = os.path.splitext(filename)
+    return f"{name}.{suffix}{ext}"
+
+def parallel_config(config, workers):
+    """Stages 4 and 5 of `config` with their own output files and run report, to re-run them with `workers` processes."""
+    config = copy.deepcopy(config)
+    for key in ['post_processing_stage_4', 'filtering_stage_5']:
+        config[key]['output_file'] = with_suffix(config[key]['output_file'], f"workers-{workers}")
+    config['telemetry']['report_file'] = f"pipeline_workers-{workers}_run_report.json"
+    return config
+
+def stage_file(run_dir, filename):
+    """Path of a finished stage file, which is Parquet when the stage format compacted it."""
+    path = os.path.join(run_dir, filename)
+    parquet = os.path.splitext(path)[0] + '.parquet'
+    return parquet if os.path.exists(parquet) else path
+
+def evaluation_config(task, paths, run_dir, explanation_file, base_url, model_dir, args):
+    """The shipped Evaluation config for the task's judge, with the tiny model or the stub server as backend."""
+    config = load_yaml(os.path.join(EVALUATION_DIR, 'configs_eval', 'qwen_eval_cqa.yaml'))
+    eval_task = TASKS[task][1]
+    config.update({
+        'task_name': eval_task, 'cache_dir': None,
+        'input_baseline_file': paths['dataset'], 'input_explanation_file': explanation_file,
+        'gold_standard_file': paths['gold'], 'output_dir': os.path.join(run_dir, 'evaluation'),
+        'stage_format': args.stage_format,
+        'evaluation_settings': {
+            setting: {'raw_output_file': f"{eval_task}_{setting}_raw_output.jsonl"} for setting in ['baseline', 'with_explanations']
+        },
+        'cache': {'enabled': False},
+        'telemetry': {'enabled': True},
+    })
+    config['bootstrap']['num_resamples'] = args.bootstrap_resamples
+    if args.judge_backend == 'openai':
+        config.update({'backend': 'openai', 'model_name': 'stub-judge', 'base_url': base_url, 'api_key': 'stub'})
+    else:
+        config.update({'backend': 'transformers', 'model_name': model_dir})
+        if args.cpu_precision:
+            config['cpu'] = {**config.get('cpu', {}), 'enabled': True, 'precision': args.cpu_precision}
+    return config
+
+# --- Runs ---
+def run_script(command, cwd, log_path, env=None):
+    """Runs one entry point as its own process, as a user would, with its output in a log file."""
+    with open(log_path, 'a', encoding='utf-8') as log:
+        log.write(f"$ {' '.join(command)}\n")
+        log.flush()
+        result = subprocess.run(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"'{' '.join(command)}' failed with exit code {result.returncode}; see {log_path}")
+
+def collect_stages(report_path, prefix, results):
+    """Adds every stage of a telemetry run report to `results`, keyed by `prefix/stage name`."""
+    with open(report_path, 'r') as f:
+        report = json.load(f)
+    for name, stage in report['stages'].items():
+        results[f"{prefix}/{name}"] = stage
+    return report
+
+def benchmark_task(task, num_items, server, model_dir, args, results):
+    """Runs Stages 1-5, both evaluation modes and 'calculate' on `num_items` synthetic records of one task."""
+    run_dir = os.path.join(args.work_dir, 'runs', f"{task}_{num_items}")
+    # Every run starts from scratch, so no stage resumes or reuses a compiled gold standard
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+    log_path = os.path.join(run_dir, 'benchmark.log')
+    paths = write_task_files(task, num_items, os.path.join(args.work_dir, 'data'), seed=args.seed)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    prefix = f"{task}/{num_items}"
+
+    print(f"\n[{prefix}] Pipeline Stages 1-5...")
+    config = pipeline_config(task, paths, run_dir, base_url, args)
+    config_path = write_yaml(os.path.join(run_dir, 'pipeline.yaml'), config)
+    command = [sys.executable, 'main.py', '--config', config_path, '--workers', str(args.workers[0])]
+    run_script(command + (['--stream'] if args.stream else []), PIPELINE_DIR, log_path)
+    report = collect_stages(os.path.join(run_dir, 'pipeline_run_report.json'), f"{prefix}/pipeline", results)
+    for model, calls in report['calls'].items():
+        print(f"  {model}: {calls['calls']} calls, {calls['retries']} retries, {calls['failures']} failures")
+
+    # Further worker counts re-run only the process-pool stages, on the same Stage 3 output
+    for workers in args.workers[1:]:
+        print(f"[{prefix}] Pipeline Stages 4-5 with {workers} workers...")
+        parallel = parallel_config(config, workers)
+        parallel_path = write_yaml(os.path.join(run_dir, f"pipeline_workers-{workers}.yaml"), parallel)
+        run_script([sys.executable, 'main.py', '--config', parallel_path, '--start_stage', '4', '--workers', str(workers)], PIPELINE_DIR, log_path)
+        collect_stages(os.path.join(run_dir, parallel['telemetry']['report_file']), f"{prefix}/pipeline_workers-{workers}", results)
+        expected = stage_file(run_dir, config['filtering_stage_5']['output_file'])
+        if not filecmp.cmp(expected, stage_file(run_dir, parallel['filtering_stage_5']['output_file']), shallow=False):
+            raise RuntimeError(f"Stage 5 output with {workers} workers differs from {expected}")
+
+    if args.skip_evaluation:
+        return
+    explanation_file = os.path.join(run_dir, config['filtering_stage_5']['output_file'])
+    eval_config = evaluation_config(task, paths, run_dir, explanation_file, base_url, model_dir, args)
+    eval_config_path = write_yaml(os.path.join(run_dir, 'evaluation.yaml'), eval_config)
+    # The evaluator imports the Pipeline's I/O modules
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [PIPELINE_DIR, os.environ.get('PYTHONPATH')]))}
+    for mode in ['baseline', 'with_explanations', 'calculate']:
+        print(f"[{prefix}] Evaluation '{mode}' mode...")
+        run_script([sys.executable, 'main_evaluator.py', '--config', eval_config_path, '--mode', mode], EVALUATION_DIR, log_path, env)
+        collect_stages(
+            os.path.join(eval_config['output_dir'], f"{eval_config['task_name']}_{mode}_run_report.json"),
+            f"{prefix}/{mode}", results
+        )
+
+# --- Regression check ---
+def compare(results, baseline, threshold):
+    """Prints each stage's throughput against the baseline; returns the stages that slowed down beyond `threshold`."""
+    regressions = []
+    print(f"\n{'Stage':<70} {'items/s':>12} {'baseline':>12} {'change':>9}")
+    for key, stage in results.items():
+        reference = baseline.get(key)
+        line = f"{key:<70} {stage['items_per_second'] or 0:>12.2f}"
+        if reference and reference.get('items_per_second') and stage['items_per_second']:
+            change = stage['items_per_second'] / reference['items_per_second'] - 1
+            line += f" {reference['items_per_second']:>12.2f} {change:>+8.1%}"
+            if min(stage['wall_seconds'], reference['wall_seconds']) < MIN_WALL_SECONDS:
+                line += "  (too short to compare)"
+            elif change < -threshold:
+                line += "  REGRESSION"
+                regressions.append(key)
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmarks for the Pipeline and the Evaluation.")
+    parser.add_argument('--tasks', nargs='+', default=['CommonsenseQA'], choices=list(TASKS), help='Dataset schemas to benchmark.')
+    parser.add_argument('--scales', nargs='+', type=int, default=[100, 1000], help='Numbers of synthetic records per run.')
+    parser.add_argument('--work_dir', type=str, default='./work', help='Directory for data, models, outputs and results.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data, the stub server and the tiny model.')
+    # Stub server
+    parser.add_argument('--latency', type=float, default=0.02, help='Mean stub response latency in seconds.')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of stub requests answered with HTTP 500.')
+    parser.add_argument('--rate_429', type=float, default=0.0, help='Fraction of stub requests answered with HTTP 429.')
+    parser.add_argument('--batch_error_rate', type=float, default=0.0, help="Fraction of Stage 3 batch requests that fail ('batch' mode).")
+    # Pipeline
+    parser.add_argument('--max_in_flight', type=int, default=None, help="Concurrent requests per model (default: the task config's).")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2],
+                        help='Worker processes for Stages 4 and 5; Stages 1-5 run with the first, and Stages 4-5 are re-run with each other.')
+    parser.add_argument('--stream', action='store_true', help='Run the Pipeline in streaming mode.')
+    parser.add_argument('--stage3_mode', type=str, default='online', choices=['online', 'batch', 'fused'],
+                        help="Stage 3 mode: 'batch' goes through the stub's Batch API, 'fused' structures in the Stage 2 call.")
+    parser.add_argument('--stage_format', type=str, default='jsonl', choices=['jsonl', 'parquet'], help='Stage file format.')
+    # Evaluation
+    parser.add_argument('--skip_evaluation', action='store_true', help='Benchmark only the Pipeline.')
+    parser.add_argument('--judge_backend', type=str, default='transformers', choices=['transformers', 'openai'],
+                        help="'transformers' runs the tiny random model; 'openai' sends judge calls to the stub server.")
+    parser.add_argument('--cpu_precision', type=str, default=None, choices=['float32', 'bfloat16', 'int8'],
+                        help="Run the tiny model with the Evaluation's CPU profile at this precision.")
+    parser.add_argument('--model_size', type=str, default='tiny', choices=list(MODEL_SIZES), help='Size of the random judge model.')
+    parser.add_argument('--bootstrap_resamples', type=int, default=1000, help="Bootstrap resamples in 'calculate' mode.")
+    # Regression check
+    parser.add_argument('--baseline', type=str, default='./baseline.json', help='Results of a reference run to compare against.')
+    parser.add_argument('--save_baseline', action='store_true', help='Save this run as the new baseline instead of comparing.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Largest allowed throughput drop per stage (0.2 = 20%%).')
+    args = parser.parse_args()
+
+    args.work_dir = os.path.abspath(args.work_dir)
+    os.makedirs(args.work_dir, exist_ok=True)
+    model_dir = None
+    if not args.skip_evaluation and args.judge_backend == 'transformers':
+        model_dir = build_tiny_model(os.path.join(args.work_dir, f"judge_{args.model_size}"), size=args.model_size, seed=args.seed)
+    server = start_server(
+        latency=args.latency, error_rate=args.error_rate, rate_429=args.rate_429, seed=args.seed,
+        batch_error_rate=args.batch_error_rate
+    )
+    print(f"Stub server listening on port {server.server_address[1]}.")
+
+    results = {}
+    try:
+        for task in args.tasks:
+            for num_items in args.scales:
+                benchmark_task(task, num_items, server, model_dir, args, results)
+    finally:
+        server.shutdown()
+
+    results_path = os.path.join(args.work_dir, 'results.json')
+    with open(results_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {results_path}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    else:
+        print(f"No baseline at {args.baseline}; run with --save_baseline to create one.")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} stages are more than {args.threshold:.0%} slower than the baseline.")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
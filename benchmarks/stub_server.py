@@ -0,0 +1,318 @@
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from email import policy
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from synthetic import QUESTION_LINE, reasoning_sentences
+
+SCORE_DIGITS = ['1', '2', '3', '4', '5']
+# Stage 2 output: one Markdown section per option, with support and oppose lists
+MARKDOWN_SECTION = re.compile(r'^### (Option [A-E])$', re.MULTILINE)
+
+def _hash(text):
+    return int(hashlib.md5(text.encode('utf-8')).hexdigest(), 16)
+
+def _labels(prompt):
+    """Option letters listed in a prompt; NLI and SIQA prompts have three, CQA prompts five."""
+    # Judge prompts separate their lines with a literal backslash-n
+    return ['A', 'B', 'C', 'D', 'E'] if re.search(r'(?:^|\n|\\n)E\. ', prompt) else ['A', 'B', 'C']
+
+def _tokens(text):
+    # Rough token count (~4 characters per token), as the Pipeline estimates prompt sizes
+    return max(1, len(text) // 4)
+
+def extraction_markdown(reasoning):
+    """Stage 2 answer: the reasoning's sentences listed under their option as support or oppose."""
+    sections = {}
+    for sentence in re.split(r'(?<=\.)\s+', reasoning.strip()):
+        match = re.match(r'Option ([A-E]) ', sentence)
+        if match:
+            side = 'oppose' if re.search(r'unlikely|does not fit', sentence) else 'support'
+            sections.setdefault(match.group(1), {'support': [], 'oppose': []})[side].append(sentence)
+    lines = []
+    for label, sides in sections.items():
+        lines.append(f"### Option {label}")
+        for side in ['support', 'oppose']:
+            lines.append(f"**{side.capitalize()}:**")
+            lines.extend(f"- {sentence}" for sentence in sides[side])
+    return '\n'.join(lines)
+
+def structured_json(markdown):
+    """Stage 3 answer: the Stage 2 Markdown as {"Option X": {"support": [...], "oppose": [...]}}."""
+    result = {}
+    parts = MARKDOWN_SECTION.split(markdown)
+    for key, body in zip(parts[1::2], parts[2::2]):
+        result[key] = {'support': [], 'oppose': []}
+        side = 'support'
+        for line in body.splitlines():
+            if line.startswith('**'):
+                side = 'oppose' if 'Oppose' in line else 'support'
+            elif line.startswith('- '):
+                result[key][side].append(line[2:])
+    return json.dumps(result)
+
+def respond(body):
+    """Builds the (content, reasoning_content, logprobs) of a chat request from its prompt alone."""
+    messages = body['messages']
+    prompt = messages[-1]['content']
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        return structured_json(prompt), None, None
+
+    if 'Please extract and list' in prompt:
+        reasoning = prompt.split('below:\n', 1)[-1].split('\nPlease extract', 1)[0]
+        markdown = extraction_markdown(reasoning)
+        if 'JSON' in prompt:
+            # Fused Stage 2 asks for the Stage 3 JSON directly; reasoning models tend to fence it
+            return f"```json\n{structured_json(markdown)}\n```", "I will group the sentences by option.", None
+        return markdown, "I will group the sentences by option.", None
+
+    labels = _labels(prompt)
+    h = _hash(prompt)
+    question = QUESTION_LINE.search(prompt)
+    if len(messages) == 1 and question and 'explanations' not in prompt:
+        # Stage 1: the answer letter, with reasoning the discourse file was built from
+        return labels[h % len(labels)], ' '.join(reasoning_sentences(question.group(1).strip(), labels)), None
+
+    # Judge calls: log-probabilities for 'logits', a digit for 'score', a ranking for 'full'
+    if body.get('logprobs'):
+        top = [
+            {'token': (' ' if i % 2 else '') + label, 'logprob': -((h >> (4 * i)) & 15) / 3.0, 'bytes': None}
+            for i, label in enumerate(labels)
+        ]
+        top.append({'token': 'The', 'logprob': -0.1, 'bytes': None})
+        content = max(top[:-1], key=lambda candidate: candidate['logprob'])['token'].strip()
+        return content, None, {'content': [{'token': content, 'logprob': -0.1, 'bytes': None, 'top_logprobs': top}]}
+    if prompt.rstrip().endswith('Rating:'):
+        return SCORE_DIGITS[h % 5], None, None
+    return ' '.join(sorted(labels, key=lambda label: _hash(label + prompt))), None, None
+
+def chat_completion(body, completion_id):
+    """The chat.completion object answering one request body."""
+    content, reasoning, logprobs = respond(body)
+    message = {'role': 'assistant', 'content': content}
+    if reasoning is not None:
+        message['reasoning_content'] = reasoning
+    choice = {'index': 0, 'finish_reason': 'stop', 'message': message}
+    if logprobs is not None:
+        choice['logprobs'] = logprobs
+    prompt_tokens = sum(_tokens(m.get('content') or '') for m in body['messages'])
+    reasoning_tokens = _tokens(reasoning) if reasoning else 0
+    return {
+        'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()),
+        'model': body.get('model', 'stub'), 'choices': [choice],
+        'usage': {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': _tokens(content) + reasoning_tokens,
+            'total_tokens': prompt_tokens + _tokens(content) + reasoning_tokens,
+            'completion_tokens_details': {'reasoning_tokens': reasoning_tokens},
+        },
+    }
+
+# --- Batch API ---
+def store_file(server, filename, content, purpose):
+    """Keeps an uploaded or generated file in memory; returns its file object with the content."""
+    with server.lock:
+        file_id = f"file-{len(server.files) + 1}"
+        server.files[file_id] = {
+            'id': file_id, 'object': 'file', 'bytes': len(content), 'created_at': int(time.time()),
+            'filename': filename, 'purpose': purpose, 'status': 'processed', 'content': content,
+        }
+    return server.files[file_id]
+
+def add_file(server, filename, records, purpose='batch_output'):
+    """Stores JSONL records as a file; returns its id."""
+    content = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+    return store_file(server, filename, content, purpose)['id']
+
+def file_object(stored):
+    """A stored file as the API describes it, without its content."""
+    return {key: value for key, value in stored.items() if key != 'content'}
+
+def run_batch(server, batch):
+    """Answers a batch's requests at once, as the provider would by its deadline; the batch reports it after some polls."""
+    settings = server.settings
+    with server.lock:
+        requests = [json.loads(line) for line in server.files[batch['input_file_id']]['content'].splitlines() if line.strip()]
+        draws = [server.rng.random() for _ in requests]
+    outputs, errors = [], []
+    for request, draw in zip(requests, draws):
+        if draw < settings['batch_expire_rate']:
+            # Not reached before the completion window closed; an expired batch leaves these out of both files
+            continue
+        if draw < settings['batch_expire_rate'] + settings['batch_error_rate']:
+            errors.append({
+                'id': f"batch_req_{request['custom_id']}", 'custom_id': request['custom_id'],
+                'response': {'status_code': 500, 'request_id': '', 'body': {'error': {'message': 'Simulated server error'}}},
+                'error': None,
+            })
+            continue
+        outputs.append({
+            'id': f"batch_req_{request['custom_id']}", 'custom_id': request['custom_id'],
+            'response': {'status_code': 200, 'request_id': '', 'body': chat_completion(request['body'], f"stub-batch-{request['custom_id']}")},
+            'error': None,
+        })
+    # Providers do not keep the input order in the output file
+    random.Random(batch['id']).shuffle(outputs)
+    expired = len(outputs) + len(errors) < len(requests)
+    batch.update({
+        'status': 'expired' if expired else 'completed',
+        'output_file_id': add_file(server, 'batch_output.jsonl', outputs) if outputs else None,
+        'error_file_id': add_file(server, 'batch_errors.jsonl', errors) if errors else None,
+        'request_counts': {'total': len(requests), 'completed': len(outputs), 'failed': len(errors)},
+    })
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible chat completions, files and batches endpoints with simulated latency, server errors and rate limits."""
+    server_version = 'StubOpenAI/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        self._send_bytes(status, json.dumps(payload).encode('utf-8'), 'application/json', headers)
+
+    def _send_bytes(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_found(self):
+        self._send_json(404, {'error': {'message': f"Not served by the stub: {self.command} {self.path}"}})
+
+    def _upload_file(self, data):
+        """POST /files: stores the multipart upload's `file` part."""
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode('utf-8') + data
+        )
+        parts = {part.get_param('name', header='content-disposition'): part for part in message.iter_parts()}
+        upload = parts['file']
+        purpose = parts['purpose'].get_payload(decode=True).decode('utf-8') if 'purpose' in parts else 'batch'
+        stored = store_file(self.server, upload.get_filename() or 'upload.jsonl', upload.get_payload(decode=True), purpose)
+        self._send_json(200, file_object(stored))
+
+    def _create_batch(self, body):
+        """POST /batches: answers every request right away, but reports progress only after `batch_polls` polls."""
+        if body.get('input_file_id') not in self.server.files:
+            self._send_json(404, {'error': {'message': f"No such file: {body.get('input_file_id')}"}})
+            return
+        total = sum(1 for line in self.server.files[body['input_file_id']]['content'].splitlines() if line.strip())
+        with self.server.lock:
+            batch_id = f"batch-{len(self.server.batches) + 1}"
+            batch = {
+                'id': batch_id, 'object': 'batch', 'endpoint': body['endpoint'], 'errors': None,
+                'input_file_id': body['input_file_id'], 'completion_window': body['completion_window'],
+                'status': 'validating', 'output_file_id': None, 'error_file_id': None, 'created_at': int(time.time()),
+                'request_counts': {'total': total, 'completed': 0, 'failed': 0},
+            }
+            self.server.batches[batch_id] = {'polls_left': self.server.settings['batch_polls'], 'result': None, 'batch': batch}
+        result = dict(batch)
+        run_batch(self.server, result)
+        self.server.batches[batch_id]['result'] = result
+        self._send_json(200, batch)
+
+    def _retrieve_batch(self, batch_id):
+        """GET /batches/{id}: in progress until its polls run out, then the finished batch."""
+        entry = self.server.batches.get(batch_id)
+        if entry is None:
+            self._not_found()
+            return
+        with self.server.lock:
+            if entry['polls_left'] > 0:
+                entry['polls_left'] -= 1
+                entry['batch']['status'] = 'in_progress'
+            else:
+                entry['batch'] = entry['result']
+        self._send_json(200, entry['batch'])
+
+    def do_GET(self):
+        parts = self.path.split('?', 1)[0].rstrip('/').split('/')
+        if len(parts) >= 2 and parts[-2] == 'batches':
+            self._retrieve_batch(parts[-1])
+        elif len(parts) >= 3 and parts[-3] == 'files' and parts[-1] == 'content' and parts[-2] in self.server.files:
+            self._send_bytes(200, self.server.files[parts[-2]]['content'], 'application/octet-stream')
+        elif len(parts) >= 2 and parts[-2] == 'files' and parts[-1] in self.server.files:
+            self._send_json(200, file_object(self.server.files[parts[-1]]))
+        else:
+            self._not_found()
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        path = self.path.split('?', 1)[0].rstrip('/')
+        if path.endswith('/files'):
+            self._upload_file(data)
+            return
+        if path.endswith('/batches'):
+            self._create_batch(json.loads(data))
+            return
+        if not path.endswith('/chat/completions'):
+            self._not_found()
+            return
+        body = json.loads(data)
+
+        settings = self.server.settings
+        with self.server.lock:
+            self.server.requests += 1
+            draw = self.server.rng.random()
+            latency = settings['latency'] * self.server.rng.uniform(0.5, 1.5)
+        time.sleep(latency)
+        if draw < settings['rate_429']:
+            self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit'}}, {'Retry-After': str(settings['retry_after'])})
+            return
+        if draw < settings['rate_429'] + settings['error_rate']:
+            self._send_json(500, {'error': {'message': 'Simulated server error', 'type': 'server_error'}})
+            return
+
+        self._send_json(200, chat_completion(body, f"stub-{self.server.requests}"))
+
+def start_server(port=0, latency=0.05, error_rate=0.0, rate_429=0.0, retry_after=0.1, seed=0,
+                 batch_error_rate=0.0, batch_expire_rate=0.0, batch_polls=1):
+    """Serves the stub in a background thread; returns the server, whose port is `server.server_address[1]`."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.settings = {
+        'latency': latency, 'error_rate': error_rate, 'rate_429': rate_429, 'retry_after': retry_after,
+        'batch_error_rate': batch_error_rate, 'batch_expire_rate': batch_expire_rate, 'batch_polls': batch_polls,
+    }
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.requests = 0
+    server.files = {}
+    server.batches = {}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server for offline benchmarks.")
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on (127.0.0.1).')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mean response latency in seconds, jittered by +-50%%.')
+    parser.add_argument('--error_rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 500.')
+    parser.add_argument('--rate_429', type=float, default=0.0, help='Fraction of requests answered with HTTP 429.')
+    parser.add_argument('--retry_after', type=float, default=0.1, help='Retry-After seconds sent with each 429.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for latency jitter and injected errors.')
+    parser.add_argument('--batch_error_rate', type=float, default=0.0, help='Fraction of batch requests that fail.')
+    parser.add_argument('--batch_expire_rate', type=float, default=0.0,
+                        help='Fraction of batch requests left unanswered; any such request makes the batch expire.')
+    parser.add_argument('--batch_polls', type=int, default=1, help='Status polls a batch stays in progress for.')
+    args = parser.parse_args()
+
+    server = start_server(
+        args.port, args.latency, args.error_rate, args.rate_429, args.retry_after, args.seed,
+        args.batch_error_rate, args.batch_expire_rate, args.batch_polls
+    )
+    print(f"Stub server listening on http://127.0.0.1:{server.server_address[1]}/v1 (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import os
+import re
+import json
+import random
+import hashlib
+import argparse
+
+# Pipeline task name -> (Pipeline config, Evaluation task name, option labels)
+TASKS = {
+    'CommonsenseQA': ('cqa_config.yaml', 'cqa', ['A', 'B', 'C', 'D', 'E']),
+    'SocialIQA': ('siqa_config.yaml', 'siqa', ['A', 'B', 'C']),
+    'VariErrNLI': ('varierr_config.yaml', 'VariErrNLI', ['A', 'B', 'C']),
+}
+NLI_ANSWERS = ['Entailment', 'Neutral', 'Contradiction']
+RATINGS = ["5 - Very Likely", "4 - Likely", "3 - Plausible", "2 - Technically Possible", "1 - Impossible"]
+CONNECTIVES = ['because', 'however', 'so', 'although', 'therefore', 'but']
+WORDS = (
+    "person house river market friend teacher child dog garden office road kitchen morning winter "
+    "book letter phone money door window school doctor store city table chair water coffee party "
+    "walks buys finds leaves opens closes helps asks waits carries sells reads writes plays cooks "
+    "quickly quietly early late alone together nearby outside inside again always rarely"
+).split()
+# Reasoning sentences name their option, so the stub server can split them into support and oppose lists
+SUPPORT_TEMPLATES = [
+    "Option {label} fits because the {a} {b} the {c} {d}.",
+    "Option {label} makes sense since a {a} usually {b} near the {c}.",
+]
+OPPOSE_TEMPLATES = [
+    "Option {label} seems unlikely because the {a} rarely {b} the {c}.",
+    "Option {label} does not fit, since no {a} {b} a {c} {d}.",
+]
+# The line of a Stage 1 prompt the reasoning is derived from, for every task's template
+QUESTION_LINE = re.compile(r'^(?:Question|Statement): (.*)$', re.MULTILINE)
+
+def _rng(text):
+    """A random generator seeded by a string, so the same text always gives the same output."""
+    return random.Random(int(hashlib.md5(text.encode('utf-8')).hexdigest(), 16))
+
+def _phrase(rng, min_words, max_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+def reasoning_sentences(question, labels):
+    """The reasoning the stub server returns for a question: one or two sentences per option."""
+    rng = _rng(question)
+    sentences = []
+    for label in labels:
+        for _ in range(rng.randint(1, 2)):
+            templates = SUPPORT_TEMPLATES if rng.random() < 0.6 else OPPOSE_TEMPLATES
+            words = {key: rng.choice(WORDS) for key in 'abcd'}
+            sentences.append(rng.choice(templates).format(label=label, **words))
+    return sentences
+
+def make_record(task, index, rng):
+    """One dataset record in the task's input schema."""
+    record = {'id': index}
+    if task == 'VariErrNLI':
+        record['premise'] = _phrase(rng, 8, 20).capitalize() + '.'
+        record['hypothesis'] = _phrase(rng, 5, 12).capitalize() + f' {index}.'
+        return record
+    if task == 'SocialIQA':
+        record['context'] = _phrase(rng, 10, 25).capitalize() + '.'
+    # The index keeps every question, and so every stub response, distinct
+    record['question'] = _phrase(rng, 6, 14).capitalize() + f' {index}?'
+    for label in TASKS[task][2]:
+        record[f'answer{label}'] = _phrase(rng, 1, 4)
+    return record
+
+def question_of(task, record):
+    return record['hypothesis'] if task == 'VariErrNLI' else record['question']
+
+def make_discourse_record(task, record, rng):
+    """Discourse units for Stage 5: the reasoning split at its connectives, plus unrelated segments."""
+    segments = []
+    for sentence in reasoning_sentences(question_of(task, record), TASKS[task][2]):
+        segments.extend(part.strip() for part in re.split(r'\b(?:because|since)\b', sentence) if part.strip())
+    segments.extend(_phrase(rng, 4, 10) for _ in range(rng.randint(2, 6)))
+    rng.shuffle(segments)
+    return {'segments': segments, 'connectives': rng.sample(CONNECTIVES, 3)}
+
+def make_gold_record(task, record, rng):
+    """Human judgements in the gold standard format read by Evaluation's DataProcessor."""
+    labels = TASKS[task][2]
+    gold = dict(record)
+    if task == 'VariErrNLI':
+        # The vote counts are keyed by answer text, so the NLI labels stand in as the answers
+        gold.update({f'answer{label}': answer for label, answer in zip(labels, NLI_ANSWERS)})
+    gold['votes_distribution'] = str({gold[f'answer{label}']: rng.randint(0, 10) for label in labels})
+    for label in labels:
+        gold[f'answer{label}_ratings'] = [{'rating': rng.choice(RATINGS)} for _ in range(rng.randint(1, 5))]
+    return gold
+
+def write_jsonl(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+def write_task_files(task, num_items, output_dir, seed=0):
+    """Writes the dataset, discourse and gold standard files of one task; returns their paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(f"{seed}:{task}")
+    records = [make_record(task, i, rng) for i in range(num_items)]
+    paths = {
+        'dataset': os.path.join(output_dir, f'{task}_{num_items}.jsonl'),
+        'discourse': os.path.join(output_dir, f'{task}_{num_items}_discourse.jsonl'),
+        'gold': os.path.join(output_dir, f'{task}_{num_items}_gold.jsonl'),
+    }
+    write_jsonl(paths['dataset'], records)
+    write_jsonl(paths['discourse'], [make_discourse_record(task, record, rng) for record in records])
+    write_jsonl(paths['gold'], [make_gold_record(task, record, rng) for record in records])
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(description="Write synthetic datasets, discourse files and gold standards.")
+    parser.add_argument('--task', type=str, default='CommonsenseQA', choices=list(TASKS), help='Dataset schema.')
+    parser.add_argument('--num_items', type=int, default=1000, help='Number of records.')
+    parser.add_argument('--output_dir', type=str, default='./work/data', help='Directory for the generated files.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    for kind, path in write_task_files(args.task, args.num_items, args.output_dir, seed=args.seed).items():
+        print(f"Wrote {kind} file to {path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import os
+import argparse
+
+# torch, transformers and tokenizers are only needed to benchmark the 'transformers' judge backend
+try:
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, decoders, trainers
+    from transformers import PreTrainedTokenizerFast, Qwen2Config, Qwen2ForCausalLM
+except ImportError:
+    torch = None
+
+from synthetic import WORDS, NLI_ANSWERS
+
+# Qwen-style chat markup, so prompts are rendered the way the real judge renders them
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|im_start|>{{ message['role'] }}\n{{ message['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n{% endif %}"
+)
+SPECIAL_TOKENS = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+# Same layer layout as Qwen2.5, scaled down so a judge call takes milliseconds on a CPU
+MODEL_SIZES = {
+    'tiny': {'hidden_size': 64, 'intermediate_size': 128, 'num_hidden_layers': 2, 'num_attention_heads': 4, 'num_key_value_heads': 2},
+    'small': {'hidden_size': 256, 'intermediate_size': 704, 'num_hidden_layers': 4, 'num_attention_heads': 8, 'num_key_value_heads': 2},
+}
+
+def build_tiny_model(output_dir, size='tiny', vocab_size=1024, seed=0):
+    """Saves a randomly initialised Qwen2 causal LM with a byte-level BPE tokenizer; reuses an existing one."""
+    if torch is None:
+        raise ImportError("The tiny judge model needs torch, transformers and tokenizers: pip install torch transformers tokenizers")
+    if os.path.exists(os.path.join(output_dir, 'config.json')):
+        return output_dir
+
+    # The byte-level alphabet keeps every option letter and score digit a single token
+    tokenizer = Tokenizer(models.BPE())
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=SPECIAL_TOKENS, initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    corpus = [' '.join(WORDS), ' '.join(NLI_ANSWERS), "Question: Answer: Rating: Explanations: support oppose Option"]
+    tokenizer.train_from_iterator(corpus * 8, trainer)
+    fast_tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer, eos_token="<|im_end|>", pad_token="<|endoftext|>")
+    fast_tokenizer.chat_template = CHAT_TEMPLATE
+    fast_tokenizer.save_pretrained(output_dir)
+
+    torch.manual_seed(seed)
+    config = Qwen2Config(
+        vocab_size=len(fast_tokenizer), max_position_embeddings=4096, tie_word_embeddings=True,
+        eos_token_id=fast_tokenizer.eos_token_id, pad_token_id=fast_tokenizer.pad_token_id, **MODEL_SIZES[size]
+    )
+    model = Qwen2ForCausalLM(config)
+    model.generation_config.do_sample = False
+    model.save_pretrained(output_dir)
+    return output_dir
+
+def main():
+    parser = argparse.ArgumentParser(description="Create a tiny randomly initialised judge model for offline benchmarks.")
+    parser.add_argument('--output_dir', type=str, default='./work/tiny_judge', help='Directory for the model and tokenizer.')
+    parser.add_argument('--size', type=str, default='tiny', choices=list(MODEL_SIZES), help='Model size.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the random weights.')
+    args = parser.parse_args()
+
+    print(f"Tiny judge model saved to {build_tiny_model(args.output_dir, size=args.size, seed=args.seed)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The projects use script-style imports, and the Evaluation also imports Pipeline modules
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ['Pipeline', 'Evaluation', 'benchmarks']:
+    sys.path.insert(0, os.path.join(ROOT, directory))
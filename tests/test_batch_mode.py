@@ -0,0 +1,82 @@
+import json
+import pytest
+from generator import Generator
+from stub_server import start_server, extraction_markdown
+from synthetic import reasoning_sentences
+
+LABELS = ['A', 'B', 'C', 'D', 'E']
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def stage2_records(num_items):
+    """Stage 2 output as the stub's reasoner writes it; one record has no extraction to structure."""
+    records = []
+    for i in range(num_items):
+        reasoning = ' '.join(reasoning_sentences(f'Question {i}?', LABELS))
+        records.append({'id': i, 'AnswerQ': LABELS[i % 5], 'AnswerS': extraction_markdown(reasoning)})
+    records[3]['AnswerS'] = ''
+    return records
+
+def make_config(output_dir, server, mode):
+    return {
+        'task_name': 'CommonsenseQA',
+        'output_dir': str(output_dir),
+        'api_key': 'stub',
+        'base_url': f"http://127.0.0.1:{server.server_address[1]}/v1",
+        'retry': {'max_retries': 3, 'base_delay': 0.01, 'max_delay': 0.1},
+        'structuring_stage_3': {
+            'model': 'deepseek-chat',
+            'prompt_template_key': 'markdown_to_structured_json',
+            'output_file': 'stage3_structured_output.jsonl',
+            'mode': mode,
+            'poll_interval': 0,
+        },
+    }
+
+def run_stage_3(output_dir, server, mode, records):
+    generator = Generator(make_config(output_dir, server, mode))
+    output_file = generator.run_structuring_stage_3([dict(record) for record in records])
+    return read_jsonl(output_file)
+
+@pytest.fixture(scope='module')
+def online_output(tmp_path_factory):
+    server = start_server(latency=0)
+    try:
+        return run_stage_3(tmp_path_factory.mktemp('online'), server, 'online', stage2_records(30))
+    finally:
+        server.shutdown()
+
+@pytest.mark.parametrize('batch_error_rate, batch_expire_rate', [(0.0, 0.0), (0.2, 0.0), (0.0, 0.2), (0.15, 0.15)])
+def test_batch_matches_online(tmp_path, online_output, batch_error_rate, batch_expire_rate):
+    server = start_server(latency=0, seed=1, batch_error_rate=batch_error_rate, batch_expire_rate=batch_expire_rate, batch_polls=2)
+    try:
+        output = run_stage_3(tmp_path, server, 'batch', stage2_records(30))
+        batch = server.batches['batch-1']['result']
+    finally:
+        server.shutdown()
+
+    # The output file lists results in random order, but Stage 3 writes them back in input order
+    assert output == online_output
+    assert [record['id'] for record in output] == list(range(30))
+    assert output[3]['structured_evidence'] == {}
+    assert output[0]['structured_evidence']['Option A']
+    # Only the record without an extraction is left out of the batch
+    counts = batch['request_counts']
+    assert counts['total'] == 29
+    assert batch['status'] == ('expired' if counts['completed'] + counts['failed'] < 29 else 'completed')
+    # Failed and expired requests are structured with regular calls, and nothing else is
+    assert server.requests == 29 - counts['completed']
+    # The request and state files are removed once the stage is written
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['stage3_structured_output.jsonl']
+
+def test_batch_that_failed_entirely(tmp_path, online_output):
+    server = start_server(latency=0, batch_error_rate=1.0)
+    try:
+        output = run_stage_3(tmp_path, server, 'batch', stage2_records(30))
+        assert server.batches['batch-1']['result']['output_file_id'] is None
+    finally:
+        server.shutdown()
+    assert output == online_output
+    assert server.requests == 29
@@ -0,0 +1,28 @@
+import json
+from data_loader import JsonlReader, INDEX_SUFFIX
+
+def write_jsonl(path, records):
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    return str(path)
+
+def test_len_holds_no_file_open(tmp_path):
+    path = write_jsonl(tmp_path / 'input.jsonl', [{'id': i} for i in range(5)])
+    reader = JsonlReader(path)
+    assert len(reader) == 5
+    assert reader._mmap is None and reader._file is None
+
+def test_context_manager_closes_the_mapping(tmp_path):
+    path = write_jsonl(tmp_path / 'input.jsonl', [{'id': i} for i in range(5)])
+    with JsonlReader(path) as reader:
+        assert reader[3] == {'id': 3}
+        mapped_file = reader._file
+    assert reader._mmap is None and mapped_file.closed
+    # A closed reader maps the file again on the next lookup
+    assert reader[4] == {'id': 4}
+    reader.close()
+
+def test_index_sidecar_is_written_next_to_the_source(tmp_path):
+    path = write_jsonl(tmp_path / 'input.jsonl', [{'id': i} for i in range(3)])
+    with JsonlReader(path) as reader:
+        assert reader[1] == {'id': 1}
+    assert (tmp_path / ('input.jsonl' + INDEX_SUFFIX)).exists()
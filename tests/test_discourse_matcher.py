@@ -0,0 +1,67 @@
+import random
+from difflib import SequenceMatcher
+import pytest
+from discourse_matcher import DiscourseMatcher
+
+def reference_best_match(check_snt, discourse_units):
+    """The original full scan of Stage 5: every unit's ratio(), first unit wins ties."""
+    if not discourse_units or not check_snt:
+        return None
+    best_score = 0
+    output_match_snt = None
+    for unit in discourse_units:
+        ratio = SequenceMatcher(None, check_snt, unit).ratio()
+        if ratio > best_score and ratio > 0.6:
+            best_score = ratio
+            output_match_snt = unit
+    return output_match_snt
+
+def assert_same(sentences, units):
+    matcher = DiscourseMatcher(units)
+    for sentence in sentences:
+        assert matcher.best_match(sentence) == reference_best_match(sentence, units), (sentence, units)
+
+def random_text(rng, alphabet, min_length, max_length):
+    return ''.join(rng.choice(alphabet) for _ in range(rng.randint(min_length, max_length)))
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_inputs(seed):
+    rng = random.Random(seed)
+    # A small alphabet gives many near-identical units, close scores and exact ties
+    alphabet = 'ab c' if seed % 2 else 'abcdefgh ij'
+    units = [random_text(rng, alphabet, 0, 30) for _ in range(rng.randint(1, 40))]
+    sentences = [random_text(rng, alphabet, 0, 30) for _ in range(30)]
+    # Sentences copied from units, with and without small edits, exercise the n-gram seeds
+    for unit in rng.sample(units, min(10, len(units))):
+        sentences.append(unit)
+        sentences.append(unit[:-2] + 'zz' if len(unit) > 2 else unit + 'z')
+    assert_same(sentences, units)
+
+def test_empty_inputs():
+    assert DiscourseMatcher([]).best_match('anything') is None
+    assert DiscourseMatcher(['a unit']).best_match('') is None
+    assert_same(['', 'a unit', 'x'], ['', 'a unit', ''])
+
+def test_tie_at_threshold_is_not_a_match():
+    # 2 * 3 matching characters / 10 characters = exactly 0.6, which is not above the threshold
+    assert SequenceMatcher(None, 'abcde', 'abcxy').ratio() == 0.6
+    assert DiscourseMatcher(['abcxy']).best_match('abcde') is None
+    assert_same(['abcde'], ['abcxy', 'xyabc', 'abcxyz'])
+
+def test_ties_keep_the_first_unit():
+    units = ['abcdxx', 'abcdyy', 'xxabcd', 'abcd zz']
+    assert SequenceMatcher(None, 'abcdef', units[0]).ratio() == SequenceMatcher(None, 'abcdef', units[1]).ratio()
+    assert DiscourseMatcher(units).best_match('abcdef') == 'abcdxx'
+    assert_same(['abcdef', 'abcd', 'zzabcd'], units)
+
+def test_repeated_units():
+    units = ['the cat sat on the mat', 'a dog barked', 'the cat sat on the mat', 'the cat sat on a mat']
+    assert_same(['the cat sat on the mat', 'the cat sat on a hat', 'a dog barks', 'unrelated'], units)
+    assert_same(['the cat sat'], ['the cat sat'] * 5)
+
+def test_reused_matcher_across_sentences():
+    # One matcher serves every sentence of a record, so state from earlier sentences must not leak
+    rng = random.Random(7)
+    units = [random_text(rng, 'abcdef ', 5, 25) for _ in range(25)]
+    sentences = [random_text(rng, 'abcdef ', 5, 25) for _ in range(200)]
+    assert_same(sentences, units)
@@ -0,0 +1,31 @@
+import json
+import pytest
+from evaluator import Evaluator
+from shard_utils import ShardedRecords
+from stub_server import start_server
+
+@pytest.fixture
+def server():
+    server = start_server(latency=0)
+    yield server
+    server.shutdown()
+
+def test_sharded_run_warns_with_the_global_index(server, tmp_path, capsys):
+    config = {
+        'task_name': 'cqa', 'backend': 'openai', 'model_name': 'stub-judge', 'api_key': 'stub',
+        'base_url': f"http://127.0.0.1:{server.server_address[1]}/v1", 'output_dir': str(tmp_path)
+    }
+    records = [
+        {'id': i, 'question': f'Where would you put book {i}?', 'answerA': 'shelf', 'answerB': 'river',
+         'answerC': 'oven', 'answerD': 'garden', 'answerE': 'school'}
+        for i in range(4)
+    ]
+    # Shard 1/2 holds records 1 and 3; only record 3 has no evidence
+    explanations = [{'filtered_evidence': {'A': {'support': ['a shelf holds books'], 'oppose': []}}} for _ in range(4)]
+    explanations[3]['filtered_evidence'] = {}
+    output_file = tmp_path / 'raw.shard-1-of-2.jsonl'
+
+    Evaluator(config).run_evaluation(ShardedRecords(records, (1, 2)), explanations, str(output_file))
+    warnings = [line for line in capsys.readouterr().out.splitlines() if line.startswith('Warning')]
+    assert warnings == ["Warning: No filtered evidence found for item 3. Skipping explanation."]
+    assert [json.loads(line)['id'] for line in output_file.read_text().splitlines()] == [1, 3]
@@ -0,0 +1,79 @@
+import random
+import pytest
+from post_processor import PostProcessor
+
+def reference_normalize(task_name, standard_keys, original_dict, original_data_record=None):
+    """The original Stage 4 key normalization: variations checked key by key, then the answer-text fallback."""
+    key_map = {}
+    for key in standard_keys:
+        key_map[key] = [f'({key})', f'{key}.', f'Option {key}']
+        if task_name == 'VariErrNLI':
+            conditions = {'A': 'entailment', 'B': 'neutral', 'C': 'contradiction'}
+            if key in conditions:
+                key_map[key].append(conditions[key])
+        elif task_name in ['SocialIQA', 'CommonsenseQA'] and original_data_record:
+            answer_key = f'answer{key.upper()}'
+            if answer_key in original_data_record:
+                key_map[key].append(original_data_record[answer_key].lower())
+
+    normalized_dict, dropped = {}, []
+    for original_key, value in original_dict.items():
+        found = False
+        for std_key, variations in key_map.items():
+            if any(var.lower() in original_key.lower() for var in variations):
+                normalized_dict[std_key] = value
+                found = True
+                break
+        if not found and task_name in ['SocialIQA', 'CommonsenseQA'] and original_data_record:
+            for std_key in standard_keys:
+                if original_data_record.get(f'answer{std_key.upper()}', '').lower() in original_key.lower():
+                    normalized_dict[std_key] = value
+                    found = True
+                    break
+        if not found:
+            dropped.append(original_key)
+    return normalized_dict, dropped
+
+TASKS = {
+    'CommonsenseQA': ['A', 'B', 'C', 'D', 'E'],
+    'SocialIQA': ['A', 'B', 'C'],
+    'VariErrNLI': ['A', 'B', 'C'],
+}
+# Short words and markup make answers overlap with each other and with the key variations
+WORDS = ['a', 'b', 'c', 'option', 'opt', 'apple', 'pie', 'app', '(', ')', '.', 'neutral', 'entail', 'entailment',
+         'contradiction', 'e', 'a.', '(c)', 'option b', 'the', 'x+y', '[z]', '']
+
+def random_text(rng, max_words):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(0, max_words)))
+
+def random_case(rng, standard_keys):
+    record = {'id': 0}
+    for key in standard_keys:
+        # Missing and empty answers both exercise the fallback
+        if rng.random() < 0.85:
+            record[f'answer{key}'] = random_text(rng, 3).upper() if rng.random() < 0.2 else random_text(rng, 3)
+    original_dict = {}
+    for _ in range(rng.randint(0, 6)):
+        original_dict[random_text(rng, 4)] = rng.randint(0, 100)
+    return original_dict, (record if rng.random() < 0.9 else None)
+
+@pytest.mark.parametrize('task_name', list(TASKS))
+def test_matches_reference(task_name):
+    standard_keys = TASKS[task_name]
+    processor = PostProcessor({'task_name': task_name, 'output_dir': '.', 'post_processing_stage_4': {'standard_keys': standard_keys}})
+    rng = random.Random(task_name)
+    for _ in range(5000):
+        original_dict, record = random_case(rng, standard_keys)
+        expected = reference_normalize(task_name, standard_keys, original_dict, record)
+        assert processor._normalize_single_dict(original_dict, record) == expected, (original_dict, record)
+
+def test_priority_follows_standard_key_order():
+    processor = PostProcessor({'task_name': 'CommonsenseQA', 'output_dir': '.', 'post_processing_stage_4': {'standard_keys': TASKS['CommonsenseQA']}})
+    record = {'answerA': 'pie', 'answerB': 'apple pie', 'answerC': 'x', 'answerD': 'y', 'answerE': 'z'}
+    # 'Option E' starts first in the key, but A's answer appears later and A comes first in priority
+    assert processor._normalize_single_dict({'Option E: apple pie': 1}, record) == ({'A': 1}, [])
+    assert processor._normalize_single_dict({'Option E': 1, 'nothing here': 2}, record) == ({'E': 1}, ['nothing here'])
+
+def test_no_standard_keys():
+    processor = PostProcessor({'task_name': 'CommonsenseQA', 'output_dir': '.', 'post_processing_stage_4': {'standard_keys': []}})
+    assert processor._normalize_single_dict({'Option A': 1}, {'answerA': 'x'}) == ({}, ['Option A'])
@@ -0,0 +1,38 @@
+import json
+import math
+import pytest
+from backends import OpenAIBackend
+from data_processor import DataProcessor
+from stub_server import start_server
+
+def reject_constant(name):
+    raise ValueError(f"not valid JSON: {name}")
+
+@pytest.fixture
+def server():
+    server = start_server(latency=0)
+    yield server
+    server.shutdown()
+
+def test_missing_option_logprobs_are_stored_as_null(server):
+    config = {'model_name': 'stub-judge', 'base_url': f"http://127.0.0.1:{server.server_address[1]}/v1", 'api_key': 'stub'}
+    # The stub only returns candidates for the options listed in the prompt, so D and E are missing
+    backend = OpenAIBackend(config, ['A', 'B', 'C', 'D', 'E'])
+    prompt = "Choose the most likely answer. Question: Where do cats sleep?\\nA. bed\\nB. roof\\nC. box\\nAnswer:"
+    logits, logprobs = backend.next_token_logprobs([prompt])[0]
+    assert logprobs[3:] == [None, None]
+    assert all(isinstance(value, float) and math.isfinite(value) for value in logprobs[:3])
+    assert logits == logprobs
+
+    # The raw output line is strict JSON, and the missing options read back with probability 0
+    line = json.dumps({'id': 0, 'logits': logits, 'logprobs': logprobs}, allow_nan=False)
+    record = json.loads(line, parse_constant=reject_constant)
+    distribution = DataProcessor({'task_name': 'cqa'})._softmax_dist(record['logprobs'])
+    assert distribution[3:] == [0.0, 0.0]
+    assert sum(distribution) == pytest.approx(1.0)
+
+def test_older_raw_outputs_with_infinity_still_read():
+    processor = DataProcessor({'task_name': 'cqa'})
+    record = json.loads('{"logprobs": [-0.5, -Infinity, -1.5]}')
+    assert processor._softmax_dist(record['logprobs'])[1] == 0.0
+    assert processor._softmax_dist([None, None, None]) == [0, 0, 0]
@@ -0,0 +1,55 @@
+import json
+import pytest
+from post_processor import PostProcessor
+from telemetry import Telemetry
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def make_config(output_dir):
+    return {
+        'task_name': 'CommonsenseQA',
+        'output_dir': str(output_dir),
+        'worker_chunksize': 2,
+        'telemetry': {'enabled': True},
+        'post_processing_stage_4': {'output_file': 'stage4.jsonl', 'standard_keys': ['A', 'B', 'C', 'D', 'E']},
+        'filtering_stage_5': {'output_file': 'stage5.jsonl'},
+    }
+
+def make_records(num_items):
+    structured, original, discourse = [], [], []
+    for i in range(num_items):
+        original.append({'id': i, 'question': f'Question {i}?', 'answerA': f'apple {i}', 'answerB': f'bread {i}'})
+        structured.append({'id': i, 'structured_evidence': {
+            '(A)': {'support': [f'The apple {i} is red and sweet.'], 'oppose': []},
+            f'bread {i}': {'support': [], 'oppose': [f'Bread {i} is not a fruit at all.']},
+            'unrelated': {'support': ['nothing'], 'oppose': []},
+        }})
+        discourse.append({
+            'segments': [f'The apple {i} is red and sweet', f'bread {i} is not a fruit', 'something else entirely'],
+            'connectives': ['because', 'so'],
+        })
+    return structured, original, discourse
+
+def run_stages_4_and_5(output_dir, workers):
+    output_dir.mkdir()
+    config = make_config(output_dir)
+    telemetry = Telemetry(config, 'test')
+    processor = PostProcessor(config, workers=workers, telemetry=telemetry)
+    structured, original, discourse = make_records(20)
+    stage4_file = processor.run_normalization(structured, original)
+    stage5_file = processor.run_filtering(read_jsonl(stage4_file), discourse)
+    return read_jsonl(stage4_file), read_jsonl(stage5_file), telemetry
+
+@pytest.mark.parametrize('workers', [2])
+def test_parallel_stages_match_sequential(tmp_path, workers):
+    sequential = run_stages_4_and_5(tmp_path / 'sequential', workers=1)
+    parallel = run_stages_4_and_5(tmp_path / 'parallel', workers=workers)
+    assert parallel[0] == sequential[0]
+    assert parallel[1] == sequential[1]
+    assert parallel[1][3]['filtered_evidence']['A']['support'] == ['The apple 3 is red and sweet']
+    # Telemetry stays in the main process and still counts every record
+    stages = parallel[2].report()['stages']
+    assert stages['CommonsenseQA Stage 4']['items'] == 20
+    assert stages['CommonsenseQA Stage 5']['items'] == 20
@@ -0,0 +1,61 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('transformers')
+import transformers_backend
+from transformers_backend import TransformersBackend
+from tiny_model import build_tiny_model
+from prompt_factory_eval import generate_prompt
+
+LABELS = ['A', 'B', 'C', 'D', 'E']
+ITEM = {'id': 0, 'question': 'Where would you put a book?', 'answerA': 'shelf', 'answerB': 'river',
+        'answerC': 'oven', 'answerD': 'garden', 'answerE': 'school'}
+
+@pytest.fixture(scope='module')
+def model_dir(tmp_path_factory):
+    return build_tiny_model(str(tmp_path_factory.mktemp('judge')))
+
+def make_backend(model_dir, **overrides):
+    return TransformersBackend({'model_name': model_dir, 'batch_size': 2, **overrides}, LABELS)
+
+def score_prompts():
+    return generate_prompt('cqa', 'score', ITEM, None, prefix_layout=True)
+
+def test_prefix_cache_matches_full_prefill(model_dir):
+    backend = make_backend(model_dir)
+    if not backend.prefix_cache:
+        pytest.skip('this transformers version has no prefix cache support')
+    prompts = score_prompts()
+    assert backend.generate_text(prompts, 'score', shared_prefix=True) == backend.generate_text(prompts, 'score')
+
+def test_falls_back_without_cache_api(model_dir, monkeypatch):
+    # Versions before 4.42 have no DynamicCache.batch_repeat_interleave
+    monkeypatch.setattr(transformers_backend, 'DynamicCache', None)
+    backend = make_backend(model_dir)
+    assert not backend.prefix_cache
+    prompts = score_prompts()
+    assert backend.generate_text(prompts, 'score', shared_prefix=True) == make_backend(model_dir, prefix_cache=False).generate_text(prompts, 'score')
+
+def judge_requests(num_items=6):
+    """(group, rank_type, prompt) requests as the evaluator builds them, for items of varying length."""
+    requests = []
+    for i in range(num_items):
+        item = {**ITEM, 'id': i, 'question': 'Where would you put ' + 'a very old book ' * i + '?'}
+        for rank_type in ['logits', 'full', 'score']:
+            prompts = generate_prompt('cqa', rank_type, item, None)
+            for prompt in prompts if rank_type == 'score' else [prompts]:
+                requests.append((i, rank_type, prompt))
+    return requests
+
+def test_batched_output_matches_batch_size_one(model_dir):
+    requests = judge_requests()
+    single = make_backend(model_dir, batch_size=1).batch(requests)
+    batched = make_backend(model_dir, batch_size=8).batch(requests)
+    for (_, rank_type, _), one, many in zip(requests, single, batched):
+        if rank_type != 'logits':
+            # Greedy text must not depend on how the prompts were batched
+            assert one == many
+            continue
+        # Padded batches sum matrix products in a different order, so logits only agree to float rounding
+        for values_one, values_many in zip(one, many):
+            assert values_many == pytest.approx(values_one, rel=1e-4, abs=1e-5)